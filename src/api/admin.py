@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt
 from data.user_model import User
 from api.errors import AuthenticationErrors, RequestErrors
@@ -6,6 +6,12 @@ from datetime import timedelta
 from api.schema.user_schema import UserSchema
 from marshmallow import ValidationError
 from api.utils.response_builder import error_response, success_response
+from utils.admission import admission_controller
+from utils.profiler import profiler
+from utils.circuit_breaker import openai_breaker
+import base64
+import binascii
+import json
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -40,6 +46,10 @@ def admin_delete_user():
 def get_all_users():
     """
     Get a list of users
+    
+    query:
+        'page', 'per_page': int, optional, offset pagination (per_page defaults to 3, capped by ADMIN_MAX_PAGE_SIZE)
+        'after', 'limit', 'username_prefix', 'email_prefix': switch to the cursor mode, see get_users_page()
     """
     claims = get_jwt()
     if claims.get('role') != 'admin':
@@ -49,10 +59,161 @@ def get_all_users():
             'error': error[1]
         }), 403
     
+    # Cursor mode, walks an index instead of counting and offsetting
+    if any(arg in request.args for arg in ('after', 'limit', 'username_prefix', 'email_prefix')):
+        return get_users_page()
+    
     page = request.args.get('page', default=1, type=int)
     per_page = request.args.get('per_page', default=3, type=int)
+    per_page = min(per_page, current_app.config['ADMIN_MAX_PAGE_SIZE'])
     users = User.query.paginate(page=page, per_page=per_page)
     
     result = UserSchema().dump(users, many=True)
     
-    return success_response('Users retrieved successfully', {'users': result}, status_code=200)
\ No newline at end of file
+    return success_response('Users retrieved successfully', {'users': result}, status_code=200)
+
+@admin_bp.get('/admission')
+@jwt_required()
+def get_admission_stats():
+    """
+    Live state of the admission control of the /ai endpoints: in-flight requests, queue depth,
+    admitted and rejected counters (by reason) and the configured limits, per endpoint.
+    """
+    claims = get_jwt()
+    if claims.get('role') != 'admin':
+        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.AUTH_REQUIRED)
+        return error_response(error[0], error[1], 403)
+    
+    return success_response('Admission stats retrieved successfully', {'admission': admission_controller.stats()}, status_code=200)
+
+@admin_bp.get('/circuit-breaker')
+@jwt_required()
+def get_circuit_breaker_state():
+    """
+    State of the circuit breaker of the OpenAI calls: closed, open or half_open, the calls, failures
+    and slow calls of the current window, the trips, the rejected calls, the last error and the thresholds.
+    """
+    claims = get_jwt()
+    if claims.get('role') != 'admin':
+        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.AUTH_REQUIRED)
+        return error_response(error[0], error[1], 403)
+    
+    return success_response('Circuit breaker state retrieved successfully', {'circuit_breaker': openai_breaker.stats()}, status_code=200)
+
+@admin_bp.get('/profiles')
+@jwt_required()
+def get_profiles():
+    """
+    The profiles kept by the sampling profiler (PROFILER_ENABLED), the slowest first.
+    
+    query:
+        'format': str, optional, 'collapsed' downloads the stacks of every profile in one file
+            instead of listing them, each stack starting with the route of its request
+    """
+    claims = get_jwt()
+    if claims.get('role') != 'admin':
+        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.AUTH_REQUIRED)
+        return error_response(error[0], error[1], 403)
+    
+    profiles = profiler.profiles()
+    if request.args.get('format') == 'collapsed':
+        return collapsed_response(''.join(profile.collapsed() for profile in profiles), 'profiles')
+    return success_response('Profiles retrieved successfully', {
+        'enabled': profiler.enabled,
+        'profiles': [profile.summary() for profile in profiles],
+    }, status_code=200)
+
+@admin_bp.get('/profiles/<profile_id>')
+@jwt_required()
+def get_profile(profile_id):
+    """
+    Download the stacks of a profile in the collapsed format (`frame;frame;frame count` lines),
+    read by flamegraph.pl, speedscope or inferno. The id is the X-Profile-ID of the profiled response.
+    """
+    claims = get_jwt()
+    if claims.get('role') != 'admin':
+        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.AUTH_REQUIRED)
+        return error_response(error[0], error[1], 403)
+    
+    profile = profiler.get(profile_id)
+    if profile is None:
+        error = RequestErrors.get_error_instance(RequestErrors.PROFILE_NOT_FOUND, exception=profile_id)
+        return error_response(error[0], error[1], 404)
+    return collapsed_response(profile.collapsed(), f'profile-{profile.id}')
+
+def collapsed_response(stacks: str, name: str) -> Response:
+    return Response(stacks, mimetype='text/plain', headers={'Content-Disposition': f'attachment; filename="{name}.collapsed"'})
+
+def get_users_page():
+    """
+    Keyset pagination of the users, without a COUNT(*) nor an OFFSET.
+    
+    query:
+        'limit': int, optional, the page size (default 50, capped by ADMIN_MAX_PAGE_SIZE)
+        'after': str, optional, the 'next' cursor of the previous page
+        'username_prefix': str, optional, only the users whose username starts with it
+        'email_prefix': str, optional, only the users whose email starts with it
+    
+    Users are ordered by id, or by the filtered column when a prefix is given so that its unique index
+    serves both the filter and the order.
+    """
+    limit = request.args.get('limit', default=50, type=int)
+    limit = max(1, min(limit, current_app.config['ADMIN_MAX_PAGE_SIZE']))
+    username_prefix = request.args.get('username_prefix')
+    email_prefix = request.args.get('email_prefix')
+    
+    query = User.query
+    order_column = User.id
+    if email_prefix:
+        query = query.filter(User.email.startswith(email_prefix, autoescape=True))
+        order_column = User.email
+    if username_prefix:
+        query = query.filter(User.username.startswith(username_prefix, autoescape=True))
+        order_column = User.username
+    
+    after = request.args.get('after')
+    if after:
+        try:
+            column_name, last_value = decode_cursor(after)
+        except ValueError:
+            error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception='Invalid cursor')
+            return error_response(error[0], error[1])
+        if column_name != order_column.key:
+            error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception='Cursor does not match the filters')
+            return error_response(error[0], error[1])
+        query = query.filter(order_column > last_value)
+    
+    # One extra row tells whether there is a next page
+    users = query.order_by(order_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(order_column.key, getattr(users[-1], order_column.key))
+    
+    result = UserSchema().dump(users, many=True)
+    
+    return success_response('Users retrieved successfully', {'users': result, 'next': next_cursor}, status_code=200)
+
+# Utility functions
+
+# Type of the last value of a cursor, per column it can order by
+CURSOR_COLUMN_TYPES = {'id': int, 'username': str, 'email': str}
+
+def encode_cursor(column_name: str, value) -> str:
+    """Build the opaque cursor pointing after the given row value.
+    """
+    return base64.urlsafe_b64encode(json.dumps([column_name, value]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> tuple:
+    """Read a cursor built by encode_cursor(), raises ValueError when it is malformed.
+    """
+    try:
+        column_name, value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, binascii.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+    if not isinstance(column_name, str) or column_name not in CURSOR_COLUMN_TYPES:
+        raise ValueError(f'Unknown cursor column {column_name}')
+    # bool is an int, but never the value of a row
+    if not isinstance(value, CURSOR_COLUMN_TYPES[column_name]) or isinstance(value, bool):
+        raise ValueError(f'Invalid value for cursor column {column_name}')
+    return column_name, value
\ No newline at end of file
@@ -1,12 +1,30 @@
-from flask import Blueprint, jsonify, request, current_app, g
+from flask import Blueprint, Response, jsonify, request, current_app, g, stream_with_context, url_for
 from data.user_model import User
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required
-from openai import OpenAI  # Version 1.33.0
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, current_user
+from utils.openai_client import openai_client
 from openai.types.beta.threads.message_create_params import Attachment, AttachmentToolFileSearch
 import os
-from api.errors import AiErrors
+from api.errors import AiErrors, AuthenticationErrors, RequestErrors, ServerErrors
 from werkzeug.utils import secure_filename
-from api.utils.response_builder import error_response, success_response
+from werkzeug.exceptions import RequestEntityTooLarge
+from api.utils.response_builder import error_response, success_response, sse_event
+from api.utils.assistant_registry import assistant_registry
+from api.utils.ingestion_worker import ingestion_worker, IngestionQueueFull
+from data.ingestion_job_model import IngestionJob
+from api.utils.uploads import assistant_upload_folder, save_pdf_upload, UploadRejected
+from api.utils.answer_cache import answer_cache, answer_cache_key, bypass_answer_cache
+from api.utils.ask_flow import RunFailed, TERMINAL_STATUSES, answer_flow, fetch_answer_flow, format_answer_flow, question_flow, run_flow
+from data.conversation_model import Conversation
+from api.utils.conversations import close_conversation, is_idle
+from utils.admission import AdmissionRejected, admission_controlled, admission_controller, request_identity
+from utils.circuit_breaker import circuit_open_error, raise_if_circuit_open
+from api.utils.search_index import search_index
+from api.utils.ask_runs import cancel_run
+from data.ask_run_model import AskRun
+from data.document_model import utcnow
+from datetime import timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 """
 Documentation available here: https://platform.openai.com/docs/assistants/quickstart
@@ -24,7 +42,15 @@ def before_request():
     g.MY_OPENAI_KEY = current_app.config.get('OPENAI_API_KEY')
     g.ALLOWED_EXTENSIONS = {'pdf'}
     g.UPLOAD_FOLDER = current_app.config.get('UPLOAD_FOLDER')
-    g.client = OpenAI(api_key=g.MY_OPENAI_KEY)
+    g.client = openai_client.get()
+
+def upstream_error(exception: Exception):
+    """The error of an exception caught where no status code can be returned (streams, batch results).
+    """
+    circuit_open = circuit_open_error(exception)
+    if circuit_open is not None:
+        return ServerErrors.get_error_instance(ServerErrors.UPSTREAM_UNAVAILABLE, str(circuit_open))
+    return AiErrors.get_error_instance(AiErrors.UNHANDLED_EXCEPTION, str(exception))
 
 @jwt_required()
 @assistant_bp.get('/assistants')
@@ -32,7 +58,7 @@ def get_assistants():
     """Return a list of all the available assistants.
     """
     return jsonify({
-        "assistants": [assistant.name for assistant in g.client.beta.assistants.list()]
+        "assistants": assistant_registry.names(loader=g.client.beta.assistants.list)
     }), 200
     
 @jwt_required()
@@ -65,14 +91,15 @@ def create_assistant():
     """
     new_assistant = request.get_json()
     current_app.logger.info(f"Called create_assistant with data: {new_assistant}")
-    if new_assistant.get("name") not in [assistant.name for assistant in g.client.beta.assistants.list()]:
-        g.client.beta.assistants.create(
+    if get_assistant_instance(assistant_name=new_assistant.get("name")) is None:
+        assistant = g.client.beta.assistants.create(
             model="gpt-4o-mini",
             description=new_assistant.get("description"),
             instructions=new_assistant.get("instructions"),
             tools=[{"type": "file_search"}],
             name=new_assistant.get("name"),
         )
+        assistant_registry.put(assistant)
         return jsonify({
             "message": "Assistant created successfully."
         }), 201
@@ -81,11 +108,14 @@ def create_assistant():
             "message": "Assistant already exists."
         }), 400
         
-@jwt_required()
 @assistant_bp.post('/add-pdf')
+@jwt_required()
+@admission_controlled('add-pdf')
 def add_pdf_to_assistant():
     """Add a PDF file to the assistant's tool. Useful documentation here: https://platform.openai.com/docs/assistants/tools/file-search
     
+    The file is indexed in the background: the response (202) contains the job, whose progress is returned to the same user by get_ingestion_job().
+    
     form-data: {
         "assistant_name": "My Assistant Name",
         "file": <file>
@@ -135,115 +165,552 @@ def add_pdf_to_assistant():
         }), 400
     
     filename = secure_filename(file.filename)
-    vector_store = g.client.beta.vector_stores.create(name=filename)
-    target_folder = os.path.join(g.UPLOAD_FOLDER, assistant_name)
+    target_folder = assistant_upload_folder(g.UPLOAD_FOLDER, assistant_name)
     os.makedirs(target_folder, exist_ok=True)  # Ensure the directory exists
     file_path = os.path.join(target_folder, filename)
-    file.save(file_path)
     
-    file_paths = [os.path.join(target_folder, file) for file in os.listdir(target_folder)]
-    file_streams = [open(path, "rb") for path in file_paths]
-    
-    file_batch = g.client.beta.vector_stores.file_batches.upload_and_poll(
-        vector_store_id=vector_store.id, files=file_streams
-    )
-    
-    for stream in file_streams:
-        stream.close()
+    # The job slot is reserved before writing the file, a full queue must not leave a file that is never indexed
+    try:
+        ingestion_worker.reserve()
+    except IngestionQueueFull:
+        error = AiErrors.get_error_instance(AiErrors.INGESTION_QUEUE_FULL)
+        return error_response(error[0], error[1], status_code=503)
     
-    assistant = g.client.beta.assistants.update(
-        assistant_id=assistant_instance.id,
-        tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}},
-    )
+    try:
+        sha256 = save_pdf_upload(
+            file, file_path,
+            max_size=current_app.config['PDF_MAX_FILE_SIZE'],
+            chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'],
+        )
+        
+        # Indexing runs in the background, only new or changed files are pushed to the assistant's vector store
+        job = IngestionJob(
+            user_id=current_user.id if current_user else None,
+            assistant_id=assistant_instance.id,
+            assistant_name=assistant_name,
+            folder=target_folder,
+        )
+        job.set_files({filename: sha256})
+        job.save()
+    except UploadRejected as e:
+        ingestion_worker.cancel_reservation()
+        error = AiErrors.get_error_instance(e.error_key, file.filename)
+        return error_response(error[0], error[1], status_code=413 if e.error_key == AiErrors.FILE_TOO_LARGE else 400)
+    except BaseException:
+        ingestion_worker.cancel_reservation()
+        raise
+    ingestion_worker.submit(job.id, reserved=True)
         
     return jsonify({
-        "message": "File uploaded successfully."
-    }), 201
+        "message": "File uploaded successfully, indexing started.",
+        "job": job.to_dict()
+    }), 202
     
+@assistant_bp.get('/jobs/<job_id>')
 @jwt_required()
+def get_ingestion_job(job_id: str):
+    """Return the progress of an ingestion job started by the user with add_pdf_to_assistant().
+    
+    status: queued, uploading, indexing, search_indexing (local search index), done or failed
+    """
+    job = IngestionJob.get_for_user(job_id, current_user.id) if current_user else None
+    if job is None:
+        error = AiErrors.get_error_instance(AiErrors.JOB_NOT_FOUND)
+        return error_response(error[0], error[1], status_code=404)
+    return jsonify({
+        "job": job.to_dict()
+    }), 200
+    
 @assistant_bp.post('/ask')
+@jwt_required()
+@admission_controlled('ask')
 def ask_question():
     """Ask a question to the assistant and return the response.
     
     body: {
         "question": "What does the High Inverter Temperature error mean in the TT series Danfoss Turbocor compressors mean? How can I assess the issue?",
-        "assistant_name": "My Assistant Name"
+        "assistant_name": "My Assistant Name",
+        "no_cache": false,  # optional, skip the answer cache (a `Cache-Control: no-cache` header does the same)
+        "conversation_id": "...",   # optional, ask a follow-up question in a conversation, see start_conversation()
+        "async": false              # optional, return the run right away (202), its answer is polled with get_ask_run()
+    
+    The async mode does not apply to conversations. A cached answer is returned directly in both modes.
+    
+    Sending `Accept: text/event-stream` switches to the streaming variant, see ask_question_stream().
     """
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return ask_question_stream()
     try:
         data = request.get_json()
         question = data.get('question')
         assistant_name = data.get('assistant_name')
         current_app.logger.info(f"Called ask_question with question: {question} and assistant_name: {assistant_name}")
 
-        # Create a new thread
-        thread = g.client.beta.threads.create()
+        if data.get('conversation_id'):
+            return ask_in_conversation(data.get('conversation_id'), question)
 
-        # Send the question to the assistant
-        g.client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role='user',
-            content=question,
-        )
+        assistant_instance = get_assistant_instance(assistant_name=assistant_name)
+        if assistant_instance is None:
+            error = AiErrors.get_error_instance(AiErrors.ASSISTANT_NOT_FOUND)
+            return error_response(error[0], error[1])
 
-        # Run the thread and wait for the response
-        run = g.client.beta.threads.runs.create_and_poll(
-            thread_id=thread.id,
-            assistant_id=get_assistant_instance(assistant_name=assistant_name).id,
-            timeout=60,
-        )
+        if data.get('async'):
+            return submit_ask_run(assistant_instance, assistant_name, question, use_cache=not bypass_answer_cache(data))
 
-        # Retrieve the failure details
-        if run.status == "failed":
-            run = g.client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-            failure_error = run.last_error.code + " - " + run.last_error.message
-            current_app.logger.error(f"Run failed with error: {failure_error}")
-            
-        # Check if the run was successful
-        if run.status != "completed":
-            current_app.logger.error(f"Run failed with status: {run.status}")
+        # Repeated questions are answered from the cache, unless the client asks to bypass it
+        try:
+            answer, cached = answer_question(g.client, assistant_instance.id, question, use_cache=not bypass_answer_cache(data))
+        except RunFailed:
             error = AiErrors.get_error_instance(AiErrors.CLIENT_RUN_FAIL)
             return jsonify({
                 "message": error[0],
                 "error": error[1]
                 }), 500
-
-        # Fetch the response message
-        messages_cursor = g.client.beta.threads.messages.list(thread_id=thread.id)
-        messages = [message for message in messages_cursor]
-
-        # Extract the assistant's response
-        message = messages[0]
-        message_content = message.content[0].text
-        annotations = message_content.annotations
-        citations = []
-        # Iterate over the annotations and add footnotes
-        for index, annotation in enumerate(annotations):
-            # Replace the text with a footnote
-            message_content.value = message_content.value.replace(annotation.text, f' [{index}]')
-            # Gather citations based on annotation attributes
-            if (file_citation := getattr(annotation, 'file_citation', None)):
-                cited_file = g.client.files.retrieve(file_citation.file_id)
-                citations.append(f"[{index}] from {cited_file.filename}")
-                # Quotes would be amazing. Although they seem to be removed from the API: 
-                # https://github.com/openai/openai-openapi/issues/263
+        if cached:
+            current_app.logger.info(f"Answered from cache for assistant_name: {assistant_name}")
 
         # Return the response
-        return jsonify({
-            "response": message_content.value,
-            "citations": citations})
+        return jsonify(answer)
 
     except Exception as e:
+        # OpenAI is failing, answered with a 503 and a Retry-After by the app error handler
+        raise_if_circuit_open(e)
         error = AiErrors.get_error_instance(AiErrors.UNHANDLED_EXCEPTION, str(e))
         return jsonify({
             'message': error[0],
             'error': error[1]
         }), 500
     
+@assistant_bp.post('/ask/stream')
+@jwt_required()
+@admission_controlled('ask')
+def ask_question_stream():
+    """Ask a question to the assistant and stream the response as Server-Sent Events.
+
+    body: same as ask_question(), except `async`. With a `conversation_id` the question is appended to the conversation.
+
+    events:
+        delta: {"text": "..."}                              a chunk of the answer, as produced by the model
+        done:  {"response": "...", "citations": [...]}      the final answer, with footnotes and citations (and the conversation_id)
+        error: {"message": "...", "error": "..."}           the run failed, the stream ends
+    """
+    data = request.get_json()
+    question = data.get('question')
+    assistant_name = data.get('assistant_name')
+    current_app.logger.info(f"Called ask_question_stream with question: {question} and assistant_name: {assistant_name}")
+
+    cache_key = None
+    conversation = None
+    if data.get('conversation_id'):
+        conversation = Conversation.get_for_user(data.get('conversation_id'), current_user.id) if current_user else None
+        if conversation is None or is_idle(conversation):
+            error = AiErrors.get_error_instance(AiErrors.CONVERSATION_NOT_FOUND)
+            return error_response(error[0], error[1], status_code=404)
+        assistant_id = conversation.assistant_id
+        thread_id = conversation.thread_id
+        # Follow-up answers depend on the conversation, they are never cached
+        g.client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role='user',
+            content=question,
+        )
+    else:
+        assistant_instance = get_assistant_instance(assistant_name=assistant_name)
+        if assistant_instance is None:
+            error = AiErrors.get_error_instance(AiErrors.ASSISTANT_NOT_FOUND)
+            return error_response(error[0], error[1])
+        assistant_id = assistant_instance.id
+
+        if current_app.config['ANSWER_CACHE_ENABLED']:
+            cache_key = answer_cache_key(assistant_id, question)
+            cached_answer = None if bypass_answer_cache(data) else answer_cache.get(cache_key)
+            if cached_answer is not None:
+                return Response(sse_event('done', cached_answer), mimetype='text/event-stream')
+
+        # The thread is created upfront so that setup errors are still returned as plain JSON
+        thread_id = g.client.beta.threads.create(
+            messages=[{"role": "user", "content": question}]
+        ).id
+
+    @stream_with_context
+    def generate():
+        try:
+            with g.client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+            ) as stream:
+                for text in stream.text_deltas:
+                    yield sse_event('delta', {"text": text})
+                run = stream.get_final_run()
+                messages = stream.get_final_messages()
+
+            if run.status != "completed" or not messages:
+                if run.status == 'requires_action':
+                    # No tool output is ever submitted, the run would stay open upstream until it expires
+                    cancel_run(g.client, thread_id, run.id)
+                if run.last_error:
+                    current_app.logger.error(f"Run failed with error: {run.last_error.code} - {run.last_error.message}")
+                current_app.logger.error(f"Run failed with status: {run.status}")
+                error = AiErrors.get_error_instance(AiErrors.CLIENT_RUN_FAIL)
+                yield sse_event('error', {"message": error[0], "error": error[1]})
+                return
+
+            response, citations = format_answer(g.client, messages[-1].content[0].text)
+            answer = {"response": response, "citations": citations}
+            if cache_key is not None:
+                answer_cache.set(cache_key, answer)
+            if conversation is not None:
+                conversation.touch()
+                answer["conversation_id"] = conversation.id
+            yield sse_event('done', answer)
+        except Exception as e:
+            error = upstream_error(e)
+            yield sse_event('error', {"message": error[0], "error": error[1]})
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Keep reverse proxies from buffering the stream
+    })
+    
+@assistant_bp.post('/ask-batch')
+@jwt_required()
+@admission_controlled('ask-batch')
+def ask_questions_batch():
+    """Ask several questions to the same assistant, running them concurrently.
+    
+    body: {
+        "assistant_name": "My Assistant Name",
+        "questions": ["What is ...?", "How do I ...?"],     # at most ASK_BATCH_MAX_QUESTIONS
+        "concurrency": 4,                                   # Optional, capped by ASK_BATCH_CONCURRENCY and the user's 'ask' admission limit
+        "no_cache": false                                   # Optional, see ask_question()
+    }
+    
+    The results follow the order of the questions. Each one has a status, 'completed' with the response
+    and citations of ask_question(), or 'failed' with the error, and the time it took.
+    
+    Every question takes an 'ask' admission slot of the user while it runs, like a call to ask_question(),
+    so a batch can not run more questions at once than the user could.
+    """
+    started = time.perf_counter()
+    data = request.get_json(silent=True) or {}
+    assistant_name = data.get('assistant_name')
+    questions = data.get('questions')
+    current_app.logger.info(f"Called ask_questions_batch with {len(questions) if isinstance(questions, list) else 0} question(s) and assistant_name: {assistant_name}")
+    
+    if not isinstance(questions, list) or not questions or not all(isinstance(question, str) and question.strip() for question in questions):
+        error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception='questions must be a non empty list of questions')
+        return error_response(error[0], error[1])
+    if len(questions) > current_app.config['ASK_BATCH_MAX_QUESTIONS']:
+        error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception=f"At most {current_app.config['ASK_BATCH_MAX_QUESTIONS']} questions are allowed")
+        return error_response(error[0], error[1])
+    try:
+        concurrency = max(1, min(int(data.get('concurrency', current_app.config['ASK_BATCH_CONCURRENCY'])), current_app.config['ASK_BATCH_CONCURRENCY']))
+    except (TypeError, ValueError):
+        error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception='concurrency must be an integer')
+        return error_response(error[0], error[1])
+    
+    assistant_instance = get_assistant_instance(assistant_name=assistant_name)
+    if assistant_instance is None:
+        error = AiErrors.get_error_instance(AiErrors.ASSISTANT_NOT_FOUND)
+        return error_response(error[0], error[1])
+    
+    per_user_limit = admission_controller.per_user_limit('ask')
+    if per_user_limit:
+        concurrency = min(concurrency, per_user_limit)
+    
+    # The worker threads have no request, they get the app, the client and the identity explicitly
+    app = current_app._get_current_object()
+    client = g.client
+    identity = request_identity()
+    use_cache = not bypass_answer_cache(data)
+    
+    def ask(question: str) -> dict:
+        question_started = time.perf_counter()
+        admitted = False
+        with app.app_context():
+            try:
+                # The batch was charged on the 'ask-batch' rate, its questions only count in flight
+                admitted = admission_controller.acquire('ask', identity, rate_limited=False)
+                answer, cached = answer_question(client, assistant_instance.id, question, use_cache=use_cache)
+                result = dict(answer, status='completed', cached=cached)
+            except AdmissionRejected as e:
+                error = RequestErrors.get_error_instance(RequestErrors.TOO_MANY_REQUESTS, exception=e.reason)
+                result = {'status': 'failed', 'message': error[0], 'error': error[1]}
+            except RunFailed:
+                error = AiErrors.get_error_instance(AiErrors.CLIENT_RUN_FAIL)
+                result = {'status': 'failed', 'message': error[0], 'error': error[1]}
+            except Exception as e:
+                error = upstream_error(e)
+                result = {'status': 'failed', 'message': error[0], 'error': error[1]}
+            finally:
+                if admitted:
+                    admission_controller.release('ask', identity)
+        result['question'] = question
+        result['elapsed_ms'] = round((time.perf_counter() - question_started) * 1000, 2)
+        return result
+    
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(questions)), thread_name_prefix='ask-batch') as executor:
+        results = list(executor.map(ask, questions))
+    
+    return jsonify({
+        "assistant_name": assistant_name,
+        "results": results,
+        "completed": sum(result['status'] == 'completed' for result in results),
+        "failed": sum(result['status'] == 'failed' for result in results),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    }), 200
+
+@assistant_bp.post('/conversations')
+@jwt_required()
+def start_conversation():
+    """Start a conversation with an assistant, follow-up questions sent to ask_question() with its id share the context.
+    
+    body: {
+        "assistant_name": "My Assistant Name"
+    }
+    """
+    data = request.get_json()
+    assistant_name = data.get('assistant_name')
+    current_app.logger.info(f"Called start_conversation with assistant_name: {assistant_name}")
+
+    if current_user is None:
+        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.INVALID_USER)
+        return error_response(error[0], error[1])
+
+    assistant_instance = get_assistant_instance(assistant_name=assistant_name)
+    if assistant_instance is None:
+        error = AiErrors.get_error_instance(AiErrors.ASSISTANT_NOT_FOUND)
+        return error_response(error[0], error[1])
+
+    conversation = Conversation(
+        user_id=current_user.id,
+        assistant_id=assistant_instance.id,
+        assistant_name=assistant_name,
+        thread_id=g.client.beta.threads.create().id,
+    )
+    conversation.save()
+    return success_response('Conversation started', {'conversation': conversation.to_dict()}, status_code=201)
+
+@assistant_bp.get('/conversations')
+@jwt_required()
+def get_conversations():
+    """Return the open conversations of the user.
+    """
+    if current_user is None:
+        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.INVALID_USER)
+        return error_response(error[0], error[1])
+    conversations = Conversation.get_all_for_user(current_user.id)
+    return jsonify({
+        "conversations": [conversation.to_dict() for conversation in conversations if not is_idle(conversation)]
+    }), 200
+
+@assistant_bp.post('/conversations/<conversation_id>/close')
+@jwt_required()
+def close_user_conversation(conversation_id: str):
+    """Close a conversation of the user, its thread is deleted.
+    """
+    conversation = Conversation.get_for_user(conversation_id, current_user.id) if current_user else None
+    if conversation is None:
+        error = AiErrors.get_error_instance(AiErrors.CONVERSATION_NOT_FOUND)
+        return error_response(error[0], error[1], status_code=404)
+    close_conversation(g.client, conversation)
+    return success_response('Conversation closed')
+
+@assistant_bp.get('/runs/<run_id>')
+@jwt_required()
+def get_ask_run(run_id: str):
+    """Return the state of a question submitted by the user with `async: true`, with the answer once completed.
+    
+    status: queued, in_progress, completed, failed, cancelled or expired (cancelled upstream after ASK_RUN_DEADLINE seconds)
+    """
+    ask_run = AskRun.get_for_user(run_id, current_user.id) if current_user else None
+    if ask_run is None:
+        error = AiErrors.get_error_instance(AiErrors.RUN_NOT_FOUND)
+        return error_response(error[0], error[1], status_code=404)
+    if not ask_run.is_finished():
+        refresh_ask_run(g.client, ask_run)
+    return jsonify({
+        "run": ask_run.to_dict()
+    }), 200
+
+@assistant_bp.post('/search')
+@jwt_required()
+def search_documents():
+    """Search the assistant's PDFs in the local index, without calling OpenAI.
+    
+    body: {
+        "assistant_name": "My Assistant Name",
+        "query": "oil pressure warning",
+        "k": 5  # Optional, number of passages (capped by SEARCH_MAX_RESULTS)
+    }
+    
+    Returns the best passages first, with their file and page.
+    """
+    started = time.perf_counter()
+    data = request.get_json(silent=True) or {}
+    assistant_name = data.get('assistant_name')
+    query = data.get('query')
+    current_app.logger.info(f"Called search_documents with query: {query} and assistant_name: {assistant_name}")
+    
+    if not assistant_name or not isinstance(query, str) or not query.strip():
+        error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception='assistant_name and query are required')
+        return error_response(error[0], error[1])
+    try:
+        k = max(1, min(int(data.get('k', 5)), current_app.config['SEARCH_MAX_RESULTS']))
+    except (TypeError, ValueError):
+        error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID, exception='k must be an integer')
+        return error_response(error[0], error[1])
+    
+    index = search_index.get(assistant_name)
+    if index is None:
+        error = AiErrors.get_error_instance(AiErrors.SEARCH_INDEX_NOT_FOUND)
+        return error_response(error[0], error[1], status_code=404)
+    
+    return jsonify({
+        "results": index.search(query, k),
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }), 200
+
+@assistant_bp.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(e):
+    """The request body exceeded MAX_CONTENT_LENGTH, werkzeug stopped reading it.
+    """
+    error = AiErrors.get_error_instance(AiErrors.FILE_TOO_LARGE)
+    return error_response(error[0], error[1], status_code=413)
+
 # Utility functions
+def ask_in_conversation(conversation_id: str, question: str):
+    """Append a question to a conversation of the user and return the answer.
+    """
+    conversation = Conversation.get_for_user(conversation_id, current_user.id) if current_user else None
+    if conversation is None or is_idle(conversation):
+        error = AiErrors.get_error_instance(AiErrors.CONVERSATION_NOT_FOUND)
+        return error_response(error[0], error[1], status_code=404)
+
+    try:
+        answer = run_question(g.client, conversation.assistant_id, question, thread_id=conversation.thread_id)
+    except RunFailed:
+        error = AiErrors.get_error_instance(AiErrors.CLIENT_RUN_FAIL)
+        return error_response(error[0], error[1], status_code=500)
+    conversation.touch()
+
+    answer["conversation_id"] = conversation.id
+    return jsonify(answer)
+
+def run_question(client, assistant_id: str, question: str, thread_id: str = None) -> dict:
+    """Ask a question and wait for the assistant's answer, see ask_flow.question_flow().
+
+    Args:
+        client: the OpenAI client, passed explicitly so that the function also runs outside of a request.
+        assistant_id (str): the assistant answering the question.
+        question (str): the question.
+        thread_id (str, optional): append the question to this thread instead of creating a new one.
+
+    Raises:
+        RunFailed: the run did not complete.
+
+    Returns:
+        dict: the response, with footnotes, and its citations.
+    """
+    return run_flow(client, question_flow(current_app._get_current_object(), assistant_id, question, thread_id))
+
+def fetch_answer(client, thread_id: str) -> dict:
+    """Return the last message of a thread, the answer of its completed run, with footnotes and citations.
+    """
+    return run_flow(client, fetch_answer_flow(current_app._get_current_object(), thread_id))
+
+def submit_ask_run(assistant, assistant_name: str, question: str, use_cache: bool = True):
+    """Start a run for the question without waiting for it, see get_ask_run().
+    """
+    if current_app.config['ANSWER_CACHE_ENABLED'] and use_cache:
+        cached_answer = answer_cache.get(answer_cache_key(assistant.id, question))
+        if cached_answer is not None:
+            current_app.logger.info(f"Answered from cache for assistant_name: {assistant_name}")
+            return jsonify(cached_answer)
+
+    thread_id = g.client.beta.threads.create(
+        messages=[{"role": "user", "content": question}]
+    ).id
+    run = g.client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant.id,
+    )
+    ask_run = AskRun(
+        user_id=current_user.id if current_user else None,
+        assistant_id=assistant.id,
+        assistant_name=assistant_name,
+        question=question,
+        thread_id=thread_id,
+        run_id=run.id,
+        deadline_at=utcnow() + timedelta(seconds=current_app.config['ASK_RUN_DEADLINE']),
+    )
+    ask_run.save()
+    return jsonify({
+        "message": "Question submitted, poll the run for the answer.",
+        "run": ask_run.to_dict()
+    }), 202, {'Location': url_for('ai.get_ask_run', run_id=ask_run.id)}
+
+def refresh_ask_run(client, ask_run: AskRun) -> None:
+    """Update an unfinished async run from its upstream state, cancelling it once past its deadline.
+    
+    The caller checks that the run belongs to the user, see get_ask_run().
+    """
+    run = client.beta.threads.runs.retrieve(thread_id=ask_run.thread_id, run_id=ask_run.run_id)
+    if run.status == 'completed':
+        answer = fetch_answer(client, ask_run.thread_id)
+        ask_run.set_answer(answer)
+        ask_run.status = AskRun.STATUS_COMPLETED
+        if current_app.config['ANSWER_CACHE_ENABLED']:
+            answer_cache.set(answer_cache_key(ask_run.assistant_id, ask_run.question), answer)
+    elif run.status in TERMINAL_STATUSES:
+        if run.status == 'requires_action':
+            cancel_run(client, ask_run.thread_id, ask_run.run_id)
+        ask_run.status = run.status if run.status in (AskRun.STATUS_CANCELLED, AskRun.STATUS_EXPIRED) else AskRun.STATUS_FAILED
+        ask_run.error = f"{run.last_error.code} - {run.last_error.message}" if run.last_error else run.status
+        current_app.logger.error(f"Async run {ask_run.run_id} failed with status: {run.status}")
+    elif utcnow() >= ask_run.deadline_at:
+        cancel_run(client, ask_run.thread_id, ask_run.run_id)
+        ask_run.status = AskRun.STATUS_EXPIRED
+        ask_run.error = 'The run did not complete before its deadline'
+    else:
+        ask_run.status = AskRun.STATUS_QUEUED if run.status == 'queued' else AskRun.STATUS_IN_PROGRESS
+    ask_run.save()
+
+def answer_question(client, assistant_id: str, question: str, use_cache: bool = True) -> tuple:
+    """Answer a new question (without a conversation), from the answer cache when enabled or by a run.
+
+    Identical questions asked while a run is in flight wait for its answer instead of starting their own.
+
+    Args:
+        client: the OpenAI client.
+        assistant_id (str): the assistant answering the question.
+        question (str): the question.
+        use_cache (bool, optional): read the answer cache, the new answer is stored in any case.
+
+    Raises:
+        RunFailed: the run did not complete.
+
+    Returns:
+        tuple: the answer, as returned by run_question(), and whether it came from the cache.
+    """
+    return run_flow(client, answer_flow(current_app._get_current_object(), assistant_id, question, use_cache=use_cache))
+
+def format_answer(client, message_content):
+    """Replace the annotations of an assistant message with footnotes and resolve the cited files.
+
+    Args:
+        client: the OpenAI client.
+        message_content: the `text` block of the assistant message.
+
+    Returns:
+        tuple: the answer with footnotes, and the list of citations.
+    """
+    return run_flow(client, format_answer_flow(current_app._get_current_object(), message_content))
+
 def get_assistant_instance(assistant_name: str):
-    for assistant in g.client.beta.assistants.list():
-        if assistant.name == assistant_name:
-            return assistant
+    """Resolve an assistant by name through the process-wide registry, listing the assistants upstream only when the cached listing expired.
+    """
+    return assistant_registry.get(assistant_name, loader=g.client.beta.assistants.list)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in g.ALLOWED_EXTENSIONS
\ No newline at end of file
@@ -0,0 +1,196 @@
+import json
+
+from flask_jwt_extended import decode_token
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route, request_response
+
+from api.errors import AiErrors, RequestErrors, ServerErrors
+from api.utils.ask_flow import RunFailed, answer_flow, run_flow_async
+from api.utils.assistant_registry import assistant_registry
+from data.user_model import User
+from utils.admission import AdmissionRejected, admission_controller
+from utils.circuit_breaker import circuit_open_error
+from utils.metrics import metrics
+from utils.openai_client import openai_client
+from utils.single_flight import AsyncSingleFlight
+
+"""
+asyncio versions of the hot /ai views, served by the ASGI app built in asgi.py.
+
+They hold no thread while waiting on OpenAI, so a single process can serve many questions at
+once. The flow, answers, errors and caches are the ones of the views in assistant.py (see
+api/utils/ask_flow.py); the requests these views do not cover are forwarded to the Flask app.
+"""
+
+
+class ForwardingEndpoint():
+    """ASGI endpoint reading the request body and passing it to `view(request, body)`.
+
+    When the view returns None the request is handed over to the Flask app, with its body replayed.
+    """
+
+    def __init__(self, view, wsgi_app):
+        self.view = view
+        self.wsgi_app = wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        body = await request.body()
+        response = await self.view(request, body)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                # Only the disconnection is left to receive
+                return await receive()
+            replayed = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        metrics.forward_request()
+        await self.wsgi_app(scope, replay, send)
+
+
+def create_async_routes(flask_app, wsgi_app) -> list:
+    """Build the routes of the async /ai views.
+
+    Args:
+        flask_app: the Flask app, providing the configuration, the logger and the database.
+        wsgi_app: the ASGI wrapper of the Flask app, serving the requests forwarded to it.
+    """
+    logger = flask_app.logger
+
+    async def run_sync(fn, *args):
+        """Run blocking code (database, error logging) in a worker thread, within an app context.
+        """
+        def call():
+            with flask_app.app_context():
+                return fn(*args)
+        return await run_in_threadpool(call)
+
+    async def error_response(key: str, status_code: int = 400, exception: str = None) -> JSONResponse:
+        error = await run_sync(AiErrors.get_error_instance, key, exception)
+        return JSONResponse({'message': error[0], 'error': error[1]}, status_code=status_code)
+
+    def log_request(request: Request) -> None:
+        ip = request.headers.get('X-Forwarded-For', '').split(',')[0].strip() or (request.client.host if request.client else None)
+        logger.info(f"Request from {ip}")
+
+    def authenticate(authorization: str):
+        """The identity of a valid access token of an existing user, as checked by jwt_required(), or None.
+        """
+        scheme, _, token = authorization.partition(' ')
+        if scheme != 'Bearer' or not token:
+            return None
+        try:
+            decoded = decode_token(token)
+        except Exception:
+            return None
+        if decoded.get('type') != 'access' or User.get_cached_user_by_username(decoded['sub']) is None:
+            return None
+        return decoded['sub']
+
+    # Concurrent requests finding the registry stale share a single upstream listing
+    listing_flight = AsyncSingleFlight()
+
+    async def load_assistants(client) -> None:
+        async def load():
+            assistant_registry.load([assistant async for assistant in client.beta.assistants.list()])
+        await listing_flight.do('listing', load)
+
+    async def get_assistant_instance(client, assistant_name: str):
+        found, assistant = assistant_registry.lookup(assistant_name)
+        if found:
+            return assistant
+        await load_assistants(client)
+        return assistant_registry.lookup(assistant_name)[1]
+
+    async def get_assistants(request: Request):
+        """Return a list of all the available assistants.
+        """
+        log_request(request)
+        names = assistant_registry.cached_names()
+        if names is None:
+            await load_assistants(openai_client.get_async())
+            names = assistant_registry.cached_names() or []
+        return JSONResponse({
+            "assistants": names
+        })
+
+    async def get_assistant_info(request: Request):
+        """Return the information of the assistant with the given name.
+        """
+        log_request(request)
+        assistant_name = request.path_params['assistant_name']
+        logger.info(f"Called get_assistant_info with assistant_name: {assistant_name}")
+        assistant_instance = await get_assistant_instance(openai_client.get_async(), assistant_name)
+        if assistant_instance is None:
+            return await error_response(AiErrors.ASSISTANT_NOT_FOUND)
+        return JSONResponse({
+            "assistant": assistant_instance.to_dict()
+        })
+
+    async def ask_question(request: Request, body: bytes):
+        """Ask a question to the assistant and return the response, see assistant.ask_question().
+
+        Conversations, streamed answers, async submissions and the requests without a valid access
+        token (answered with the 401 of jwt_required()) are served by the Flask views.
+        """
+        log_request(request)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or data.get('conversation_id') or data.get('async') or 'text/event-stream' in request.headers.get('Accept', ''):
+            return None
+        identity = await run_sync(authenticate, request.headers.get('Authorization', ''))
+        if identity is None:
+            return None
+
+        # Same admission as the Flask view, the wait for a slot happens in a worker thread
+        admission_identity = f'user:{identity}'
+        try:
+            admitted = await run_in_threadpool(admission_controller.acquire, 'ask', admission_identity)
+        except AdmissionRejected as e:
+            error = await run_sync(lambda: RequestErrors.get_error_instance(RequestErrors.TOO_MANY_REQUESTS, exception=e.reason))
+            return JSONResponse({'message': error[0], 'error': error[1]}, status_code=429, headers={'Retry-After': e.retry_after_header()})
+        try:
+            question = data.get('question')
+            assistant_name = data.get('assistant_name')
+            logger.info(f"Called ask_question with question: {question} and assistant_name: {assistant_name}")
+            client = openai_client.get_async()
+
+            assistant_instance = await get_assistant_instance(client, assistant_name)
+            if assistant_instance is None:
+                return await error_response(AiErrors.ASSISTANT_NOT_FOUND)
+
+            use_cache = not data.get('no_cache') and 'no-cache' not in request.headers.get('Cache-Control', '')
+            try:
+                answer, cached = await run_flow_async(client, answer_flow(flask_app, assistant_instance.id, question, use_cache=use_cache), run_sync)
+            except RunFailed:
+                return await error_response(AiErrors.CLIENT_RUN_FAIL, status_code=500)
+            if cached:
+                logger.info(f"Answered from cache for assistant_name: {assistant_name}")
+            return JSONResponse(answer)
+
+        except Exception as e:
+            circuit_open = circuit_open_error(e)
+            if circuit_open is not None:
+                error = await run_sync(ServerErrors.get_error_instance, ServerErrors.UPSTREAM_UNAVAILABLE, str(circuit_open))
+                return JSONResponse({'message': error[0], 'error': error[1]}, status_code=503, headers={'Retry-After': circuit_open.retry_after_header()})
+            return await error_response(AiErrors.UNHANDLED_EXCEPTION, status_code=500, exception=str(e))
+        finally:
+            if admitted:
+                admission_controller.release('ask', admission_identity)
+
+    # Recorded under the labels of the Flask views they stand for
+    return [
+        Route('/ai/assistants', metrics.asgi(request_response(get_assistants), 'ai', '/ai/assistants'), methods=['GET']),
+        Route('/ai/assistant/{assistant_name}', metrics.asgi(request_response(get_assistant_info), 'ai', '/ai/assistant/<assistant_name>'), methods=['GET']),
+        Route('/ai/ask', metrics.asgi(ForwardingEndpoint(ask_question, wsgi_app), 'ai', '/ai/ask'), methods=['POST']),
+    ]
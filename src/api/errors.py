@@ -71,19 +71,27 @@ class RequestErrors(Error):
     """
     BAD_REQUEST_BODY_NOT_FOUND = 'BAD_REQUEST_BODY_NOT_FOUND'
     BAD_REQUEST_BODY_NOT_VALID =  'BAD_REQUEST_BODY_NOT_VALID'
+    TOO_MANY_REQUESTS = 'TOO_MANY_REQUESTS'
+    PROFILE_NOT_FOUND = 'PROFILE_NOT_FOUND'
     
     errors = {
         BAD_REQUEST_BODY_NOT_FOUND: ('Bad request from client side, a json body was expected', 'bad_request_body_not_found'),
-        BAD_REQUEST_BODY_NOT_VALID: ('The request body was found, but its value is not valid', 'bad_request_body_not_valid')
+        BAD_REQUEST_BODY_NOT_VALID: ('The request body was found, but its value is not valid', 'bad_request_body_not_valid'),
+        TOO_MANY_REQUESTS: ('Too many requests, try again later', 'too_many_requests'),
+        PROFILE_NOT_FOUND: ('The profile was not found, it may have been replaced by slower ones', 'profile_not_found')
     }
 
 class ServerErrors(Error):
     """Defines errors caused by the server
     """
     INTERNAL_SERVER_ERROR = 'INTERNAL_SERVER_ERROR'
+    SERVICE_UNAVAILABLE = 'SERVICE_UNAVAILABLE'
+    UPSTREAM_UNAVAILABLE = 'UPSTREAM_UNAVAILABLE'
     
     errors = {
-        INTERNAL_SERVER_ERROR: ('An internal server error occured', 'internal_server_error')
+        INTERNAL_SERVER_ERROR: ('An internal server error occured', 'internal_server_error'),
+        SERVICE_UNAVAILABLE: ('The server is overloaded, try again later', 'service_unavailable'),
+        UPSTREAM_UNAVAILABLE: ('The AI service is unavailable, try again later', 'upstream_unavailable')
     }    
 
 class AiErrors(Error):
@@ -98,6 +106,13 @@ class AiErrors(Error):
     FILE_NOT_FOUND = 'FILE_NOT_FOUND'
     FILENAME_NOT_ALLOWED = 'FILENAME_NOT_ALLOWED'
     ASSISTANT_NOT_FOUND = 'ASSISTANT_NOT_FOUND'
+    INGESTION_QUEUE_FULL = 'INGESTION_QUEUE_FULL'
+    JOB_NOT_FOUND = 'JOB_NOT_FOUND'
+    CONVERSATION_NOT_FOUND = 'CONVERSATION_NOT_FOUND'
+    FILE_NOT_PDF = 'FILE_NOT_PDF'
+    FILE_TOO_LARGE = 'FILE_TOO_LARGE'
+    SEARCH_INDEX_NOT_FOUND = 'SEARCH_INDEX_NOT_FOUND'
+    RUN_NOT_FOUND = 'RUN_NOT_FOUND'
 
     errors = {
         'CLIENT_RUN_FAIL': ('The call to the AI API failed.', 'client_run_fail'),
@@ -105,7 +120,14 @@ class AiErrors(Error):
         'UNHANDLED_EXCEPTION': ('An unhandled exception occured.', 'unhandled_exception'),
         'FILE_NOT_FOUND': ('The file was not found in the request', 'file_not_found'),
         'FILENAME_NOT_ALLOWED': ('The filename is not allowed', 'filename_not_allowed'),
-        'ASSISTANT_NOT_FOUND': ('The assistant was not found', 'assistant_not_found')
+        'ASSISTANT_NOT_FOUND': ('The assistant was not found', 'assistant_not_found'),
+        'INGESTION_QUEUE_FULL': ('Too many files are being indexed, try again later', 'ingestion_queue_full'),
+        'JOB_NOT_FOUND': ('The ingestion job was not found', 'job_not_found'),
+        'CONVERSATION_NOT_FOUND': ('The conversation was not found or was closed', 'conversation_not_found'),
+        'FILE_NOT_PDF': ('The file is not a PDF', 'file_not_pdf'),
+        'FILE_TOO_LARGE': ('The file is too large', 'file_too_large'),
+        'SEARCH_INDEX_NOT_FOUND': ('No document was indexed for this assistant', 'search_index_not_found'),
+        'RUN_NOT_FOUND': ('The run was not found', 'run_not_found')
     }
 
 
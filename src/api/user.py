@@ -1,12 +1,15 @@
-from flask_jwt_extended import jwt_required, get_jwt, create_access_token, create_refresh_token
+from flask_jwt_extended import jwt_required, get_jwt, create_access_token, create_refresh_token, current_user
 from data.user_model import User
 from api.errors import AuthenticationErrors, RequestErrors, ServerErrors
 from flask import Blueprint, jsonify, request, current_app, url_for
 from datetime import timedelta
 from api.schema.registration_schema import RegistrationSchema
 from marshmallow import ValidationError
+from sqlalchemy.exc import IntegrityError
+from data.extensions import db
 from api.utils.response_builder import error_response, success_response
-import requests
+from data.outbox_model import OutboxEmail
+from utils.email_dispatcher import email_dispatcher
 
 user_bp = Blueprint('user', __name__)
 
@@ -24,25 +27,26 @@ def register():
     email = validation_result['email']
     password = validation_result['password']
 
-    if User.get_user_by_username(new_username):
-        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.USERNAME_ALREADY_TAKEN)
-        return error_response(error[0], error[1])
-
-
-    if User.get_user_by_email(email):
-        error = AuthenticationErrors.get_error_instance(AuthenticationErrors.EMAIL_ALREADY_TAKEN)
-        return error_response(error[0], error[1])
-
+    # Cheap checks first, the password is hashed only for a request which can succeed
     is_password_valid = User.validate_password(password)
     if not is_password_valid:
         error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID)
         return error_response(error[0], error[1])
 
+    new_user = User(username = new_username, email = email)
+    new_user.set_password(password)
     try:
-        new_user = User(username = new_username, email = email)
-        new_user.set_password(password)
+        # The unique constraints on username and email reject duplicates, even under concurrent registrations
         new_user.save()
+    except IntegrityError as e:
+        db.session.rollback()
+        if User.get_duplicated_field(e, new_username) == 'email':
+            error = AuthenticationErrors.get_error_instance(AuthenticationErrors.EMAIL_ALREADY_TAKEN)
+        else:
+            error = AuthenticationErrors.get_error_instance(AuthenticationErrors.USERNAME_ALREADY_TAKEN)
+        return error_response(error[0], error[1])
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error creating user: {str(e)}")
         error = ServerErrors.get_error_instance(ServerErrors.INTERNAL_SERVER_ERROR)
         return error_response("An error occurred while creating the user", error[1], status_code=500)
@@ -57,6 +61,7 @@ def login_user():
     if not user or not user.check_password(data['password']):
         error = AuthenticationErrors.get_error_instance(AuthenticationErrors.LOGIN_FAILED)
         return error_response(error[0], error[1])
+    user.upgrade_password_hash(data['password'])
     
     return jsonify({
         'message': 'Login successful!',
@@ -93,9 +98,8 @@ def update_password():
         error = RequestErrors.get_error_instance(RequestErrors.BAD_REQUEST_BODY_NOT_VALID)
         return error_response(error[0], error[1])
 
-    claims = get_jwt()
-    claimed_username = claims.get('sub')
-    user = User.get_user_by_username(claimed_username)
+    # Resolved by the JWT user loader
+    user = current_user
     
     if not user:
         error = AuthenticationErrors.get_error_instance(AuthenticationErrors.INVALID_USER)
@@ -114,9 +118,7 @@ def delete_user():
 
     body: None
     """
-    claims = get_jwt()
-    username = claims.get('sub')
-    user = User.get_user_by_username(username)
+    user = current_user
     if not user:
         error = AuthenticationErrors.get_error_instance(AuthenticationErrors.INVALID_USER)
         return error_response(error[0], error[1])
@@ -133,35 +135,26 @@ def request_password_reset():
         error = AuthenticationErrors.get_error_instance(AuthenticationErrors.INVALID_USER)
         return error_response('User email not found', error[1], status_code=404)
     
-    serializer = current_app.config['SERIALIZER']
-    token = serializer.dumps(email, salt=current_app.config['HASH_SALT'])
-    
-    # Construct the url to send to the user
-    frontend_endpoint_reset_view = current_app.config['FRONTEND_URL'] + 'password_reset/' + token    
-    email_service_url = current_app.config['EMAIL_SERVICE_URL'] + 'forward-email-password-reset'
-    email_service_api_key = current_app.config['EMAIL_SERVICE_API_KEY']
-    current_app.logger.info(f"Token: {email_service_api_key}")
-    
-    email_payload = {
+    # The email is sent in the background by the email dispatcher, the reset link is added at send time
+    OutboxEmail.enqueue('forward-email-password-reset', {
         'email': email,
-        'link': frontend_endpoint_reset_view,
-        'token': email_service_api_key
-    }
-    
-    headers = {
-        'Content-Type': 'application/json',       
-    }
-    
-    current_app.logger.info(f"Sending password reset email to {email}, with reset link: {frontend_endpoint_reset_view}, using email service: {email_service_url}")
-    response = requests.post(email_service_url, json=email_payload, headers=headers)
-    
-    if response.status_code != 200:
-        current_app.logger.error(f"Failed to send password reset email: {response.text}")
-        error = ServerErrors.get_error_instance(ServerErrors.INTERNAL_SERVER_ERROR)
-        return error_response("Failed to send password reset email", error[1], status_code=500)
+    })
+    email_dispatcher.notify()
+    current_app.logger.info(f"Queued password reset email to {email}")
     
     return success_response('Password reset link sent successfully!')
 
+def build_password_reset_payload(payload: dict) -> dict:
+    """Add the reset link to a queued password reset email.
+
+    The token is signed when the email is sent, so the outbox never holds a valid reset token.
+    """
+    serializer = current_app.config['SERIALIZER']
+    token = serializer.dumps(payload['email'], salt=current_app.config['HASH_SALT'])
+    return dict(payload, link=current_app.config['FRONTEND_URL'] + 'password_reset/' + token)
+
+email_dispatcher.register_payload_builder('forward-email-password-reset', build_password_reset_payload)
+
 @user_bp.route('/reset_password/<token>', methods=['POST'])
 def reset_password(token):
     try:
@@ -0,0 +1,35 @@
+import re
+
+from flask import request
+from data.document_model import AssistantStore
+from utils.cache import LRUCache
+
+# (assistant id, corpus version, normalized question) -> {"response": ..., "citations": [...]}
+answer_cache = LRUCache(max_size=512, ttl=86400)
+
+
+def normalize_question(question: str) -> str:
+    """Make trivially different phrasings of a question share the same cache entry.
+    """
+    return re.sub(r'\s+', ' ', question or '').strip().rstrip('?!. ').lower()
+
+
+def answer_cache_key(assistant_id: str, question: str) -> tuple:
+    """Build the cache key of a question.
+
+    The key contains the version of the assistant's document set, so the answers given before a
+    PDF was added are never served again, even by another process.
+    """
+    return (assistant_id, AssistantStore.get_corpus_version(assistant_id), normalize_question(question))
+
+
+def bypass_answer_cache(data: dict) -> bool:
+    """Whether the client asked for a fresh answer, with `"no_cache": true` or `Cache-Control: no-cache`.
+    """
+    return bool(data.get('no_cache')) or 'no-cache' in request.headers.get('Cache-Control', '')
+
+
+def invalidate_assistant_answers(assistant_id: str) -> None:
+    """Drop the cached answers of an assistant, after its documents changed.
+    """
+    answer_cache.remove_where(lambda key: key[0] == assistant_id)
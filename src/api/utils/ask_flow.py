@@ -0,0 +1,286 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import Callable, Generator, Hashable, List
+
+from api.utils.answer_cache import answer_cache, answer_cache_key, normalize_question
+from api.utils.citations import add_footnotes, cited_file_ids, lookup_known_filenames, remember_filename
+from utils.single_flight import AsyncSingleFlight, SingleFlight
+
+"""
+The question answering flow, shared by the Flask views (assistant.py) and the async ones of the ASGI
+serving mode (assistant_async.py).
+
+The flow is written once, as generators yielding the steps they need: an OpenAI call, a wait, calls
+to run concurrently, blocking code (database) or a coalesced sub-flow. `run_flow()` performs the
+steps with the sync client and `run_flow_async()` with the asyncio one, so both serving modes create,
+poll, cancel, format, cache and coalesce the runs the same way.
+"""
+
+# Upstream run statuses after which the run no longer changes
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled', 'expired', 'incomplete', 'requires_action')
+
+# Coalesce the identical questions in flight, in the Flask threads and on the event loop of the ASGI mode
+ask_flight = SingleFlight()
+async_ask_flight = AsyncSingleFlight()
+
+# Concurrent calls of the sync flows, e.g. the retrieval of the cited files
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ask-flow')
+
+
+class RunFailed(Exception):
+    """The assistant run did not complete.
+    """
+
+
+class Call():
+    """Step calling the OpenAI client method at `method` (e.g. 'beta.threads.create'), sends back its result.
+    """
+    def __init__(self, method: str, **kwargs):
+        self.method = method
+        self.kwargs = kwargs
+
+
+class Sleep():
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+
+class Gather():
+    """Step running calls concurrently, sends back their results, or their exceptions, in order.
+    """
+    def __init__(self, calls: List[Call]):
+        self.calls = calls
+
+
+class Blocking():
+    """Step running blocking code needing the app context, e.g. a database query.
+    """
+    def __init__(self, fn: Callable, *args):
+        self.fn = fn
+        self.args = args
+
+
+class Coalesce():
+    """Step running the flow built by `flow_factory`, or waiting for the identical one already in flight.
+    """
+    def __init__(self, key: Hashable, flow_factory: Callable[[], Generator], timeout: float):
+        self.key = key
+        self.flow_factory = flow_factory
+        self.timeout = timeout
+
+
+Flow = Generator[object, object, object]
+
+
+def coalescing_key(assistant_id: str, question: str) -> tuple:
+    return (assistant_id, normalize_question(question))
+
+
+# Flows
+
+def cancel_run_flow(app, thread_id: str, run_id: str) -> Flow:
+    """Cancel a run upstream so it stops consuming tokens, best effort.
+    """
+    try:
+        yield Call('beta.threads.runs.cancel', thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        app.logger.warning(f"Failed to cancel run {run_id} of thread {thread_id}: {str(e)}")
+
+
+def wait_for_run_flow(app, thread_id: str, run, deadline: float) -> Flow:
+    """Poll a run until it reaches a terminal status, cancelling it upstream once the deadline passes
+    or when it requires an action.
+
+    Returns:
+        the last retrieved run, whose status is 'expired' when it was cancelled on the deadline.
+    """
+    interval = app.config['ASK_RUN_POLL_INTERVAL']
+    while run.status not in TERMINAL_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            app.logger.warning(f"Run {run.id} passed its deadline, cancelling it")
+            yield from cancel_run_flow(app, thread_id, run.id)
+            run.status = 'expired'
+            return run
+        yield Sleep(min(interval, remaining))
+        run = yield Call('beta.threads.runs.retrieve', thread_id=thread_id, run_id=run.id)
+    if run.status == 'requires_action':
+        # No tool output is ever submitted, the run would stay open upstream until it expires
+        yield from cancel_run_flow(app, thread_id, run.id)
+    return run
+
+
+def format_answer_flow(app, message_content) -> Flow:
+    """Replace the annotations of an assistant message with footnotes and resolve the cited files.
+
+    The cited files are looked up in the cache and the document catalog first, the other ones are
+    retrieved concurrently.
+
+    Returns:
+        tuple: the answer with footnotes, and the list of citations.
+    """
+    filenames, missing = yield Blocking(lookup_known_filenames, cited_file_ids(message_content))
+    if missing:
+        results = yield Gather([Call('files.retrieve', file_id=file_id) for file_id in missing])
+        for file_id, cited_file in zip(missing, results):
+            if isinstance(cited_file, Exception):
+                app.logger.warning(f"Failed to retrieve cited file {file_id}: {str(cited_file)}")
+                continue
+            filenames[file_id] = cited_file.filename
+            remember_filename(file_id, cited_file.filename)
+    return add_footnotes(message_content, filenames)
+
+
+def fetch_answer_flow(app, thread_id: str) -> Flow:
+    """Return the last message of a thread, the answer of its completed run, with footnotes and citations.
+    """
+    # The most recent message comes first
+    messages = yield Call('beta.threads.messages.list', thread_id=thread_id, limit=1)
+    response, citations = yield from format_answer_flow(app, messages.data[0].content[0].text)
+    return {
+        "response": response,
+        "citations": citations
+    }
+
+
+def question_flow(app, assistant_id: str, question: str, thread_id: str = None) -> Flow:
+    """Ask a question and wait for the assistant's answer.
+
+    Args:
+        app: the Flask app, providing the configuration and the logger.
+        assistant_id (str): the assistant answering the question.
+        question (str): the question.
+        thread_id (str, optional): append the question to this thread instead of creating a new one.
+
+    Raises:
+        RunFailed: the run did not complete.
+
+    Returns:
+        dict: the response, with footnotes, and its citations.
+    """
+    if thread_id is None:
+        # Create a new thread, together with the question
+        thread = yield Call('beta.threads.create', messages=[{"role": "user", "content": question}])
+        thread_id = thread.id
+    else:
+        yield Call('beta.threads.messages.create', thread_id=thread_id, role='user', content=question)
+
+    # Run the thread and wait for the response, the run is cancelled upstream if it takes too long
+    run = yield Call('beta.threads.runs.create', thread_id=thread_id, assistant_id=assistant_id)
+    run = yield from wait_for_run_flow(app, thread_id, run, time.monotonic() + app.config['ASK_RUN_TIMEOUT'])
+
+    if run.status == "failed" and run.last_error:
+        app.logger.error(f"Run failed with error: {run.last_error.code} - {run.last_error.message}")
+    if run.status != "completed":
+        app.logger.error(f"Run failed with status: {run.status}")
+        raise RunFailed(run.status)
+
+    return (yield from fetch_answer_flow(app, thread_id))
+
+
+def answer_flow(app, assistant_id: str, question: str, use_cache: bool = True) -> Flow:
+    """Answer a new question (without a conversation), from the answer cache when enabled or by a run.
+
+    Identical questions asked while a run is in flight wait for its answer instead of starting their own.
+
+    Args:
+        use_cache (bool, optional): read the answer cache, the new answer is stored in any case.
+
+    Raises:
+        RunFailed: the run did not complete.
+
+    Returns:
+        tuple: the answer, as returned by question_flow(), and whether it came from the cache.
+    """
+    cache_key = None
+    if app.config['ANSWER_CACHE_ENABLED']:
+        cache_key = yield Blocking(answer_cache_key, assistant_id, question)
+        if use_cache:
+            cached_answer = answer_cache.get(cache_key)
+            if cached_answer is not None:
+                return cached_answer, True
+
+    if app.config['ASK_COALESCE_ENABLED']:
+        answer = yield Coalesce(
+            coalescing_key(assistant_id, question),
+            lambda: question_flow(app, assistant_id, question),
+            timeout=app.config['ASK_COALESCE_WAIT'],
+        )
+    else:
+        answer = yield from question_flow(app, assistant_id, question)
+
+    if cache_key is not None:
+        answer_cache.set(cache_key, answer)
+    return answer, False
+
+
+# Drivers
+
+def _method(client, call: Call):
+    return reduce(getattr, call.method.split('.'), client)
+
+
+def _call_or_error(client, call: Call):
+    try:
+        return _method(client, call)(**call.kwargs)
+    except Exception as e:
+        return e
+
+
+def run_flow(client, flow: Flow):
+    """Run a flow with the sync OpenAI client, in the calling thread (within an app context).
+    """
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(step, Call):
+                result = _method(client, step)(**step.kwargs)
+            elif isinstance(step, Sleep):
+                time.sleep(step.seconds)
+            elif isinstance(step, Gather):
+                result = list(_executor.map(lambda call: _call_or_error(client, call), step.calls))
+            elif isinstance(step, Blocking):
+                result = step.fn(*step.args)
+            elif isinstance(step, Coalesce):
+                result = ask_flight.do(step.key, lambda: run_flow(client, step.flow_factory()), timeout=step.timeout)
+            else:
+                raise TypeError(f"Unknown step {step!r}")
+        except Exception as e:
+            error = e
+
+
+async def run_flow_async(client, flow: Flow, run_blocking: Callable):
+    """Run a flow with the asyncio OpenAI client.
+
+    Args:
+        run_blocking: coroutine function running `fn(*args)` in a worker thread, within an app context.
+    """
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(step, Call):
+                result = await _method(client, step)(**step.kwargs)
+            elif isinstance(step, Sleep):
+                await asyncio.sleep(step.seconds)
+            elif isinstance(step, Gather):
+                result = list(await asyncio.gather(*(_method(client, call)(**call.kwargs) for call in step.calls), return_exceptions=True))
+            elif isinstance(step, Blocking):
+                result = await run_blocking(step.fn, *step.args)
+            elif isinstance(step, Coalesce):
+                result = await async_ask_flight.do(step.key, lambda: run_flow_async(client, step.flow_factory(), run_blocking), timeout=step.timeout)
+            else:
+                raise TypeError(f"Unknown step {step!r}")
+        except Exception as e:
+            error = e
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from flask import current_app
+from data.extensions import db
+from data.ask_run_model import AskRun
+from data.document_model import utcnow
+from api.utils.ask_flow import cancel_run_flow, run_flow
+from utils.openai_client import openai_client
+
+
+def cancel_run(client, thread_id: str, run_id: str) -> None:
+    """Cancel a run upstream so it stops consuming tokens, best effort.
+    """
+    run_flow(client, cancel_run_flow(current_app, thread_id, run_id))
+
+
+class AskRunSweeper():
+    """Background canceller of the async runs which passed their deadline without being polled to completion.
+
+    Every ASK_RUN_SWEEP_INTERVAL seconds a daemon thread cancels the overdue runs upstream and marks
+    them expired, batch after batch until none is left. `run_once()` performs a single batch, without the thread.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self):
+        self.app = None
+        self.expired = 0
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.extensions['ask_run_sweeper'] = self
+        if app.config['ASK_RUN_SWEEP_INTERVAL'] and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='ask-run-sweeper', daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.app.config['ASK_RUN_SWEEP_INTERVAL'])
+            try:
+                self.sweep()
+            except Exception as e:
+                self.app.logger.error(f"Ask run sweep failed: {str(e)}")
+
+    def sweep(self) -> int:
+        """Expire the overdue runs, one batch after the other until none is left.
+
+        Returns:
+            int: the number of runs expired.
+        """
+        expired = 0
+        while count := self.run_once():
+            expired += count
+        return expired
+
+    def run_once(self) -> int:
+        """Cancel and expire one batch of overdue runs.
+
+        Returns:
+            int: the number of runs expired.
+        """
+        with self.app.app_context():
+            try:
+                ask_runs = AskRun.get_overdue(utcnow(), limit=self.BATCH_SIZE)
+                client = openai_client.get()
+                for ask_run in ask_runs:
+                    current_app.logger.info(f"Expiring overdue run {ask_run.id}")
+                    cancel_run(client, ask_run.thread_id, ask_run.run_id)
+                    ask_run.status = AskRun.STATUS_EXPIRED
+                    ask_run.error = 'The run did not complete before its deadline'
+                    ask_run.save()
+                self.expired += len(ask_runs)
+                return len(ask_runs)
+            finally:
+                db.session.remove()
+
+
+ask_run_sweeper = AskRunSweeper()
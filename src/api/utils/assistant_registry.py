@@ -0,0 +1,161 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from utils.single_flight import SingleFlight
+
+
+class AssistantRegistry():
+    """Process-wide cache of the OpenAI assistants, keyed by name.
+
+    The whole assistant list is fetched with a single listing and kept for `ttl` seconds, so
+    resolving an assistant by name usually costs zero upstream calls. Views that change the
+    assistants (creation, tool resources update) must call `put()` or `invalidate()`.
+
+    The listing is fetched outside the lock, concurrent refreshes share a single upstream call. A name
+    missing from a fresh listing (e.g. an assistant created by another process) refreshes it, at most
+    once every `miss_refresh_interval` seconds.
+    """
+
+    def __init__(self, ttl: float = 300, miss_refresh_interval: float = 10):
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self._assistants: Dict[str, object] = {}
+        self._loaded_at: Optional[float] = None
+        # Bumped when the cached listing is changed, a listing fetched before is not stored
+        self._generation = 0
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def configure(self, ttl: float, miss_refresh_interval: float = None) -> None:
+        """Set the time to live (in seconds) of the cached listing.
+
+        Args:
+            ttl (float): seconds after which the listing is fetched again. 0 disables the cache.
+            miss_refresh_interval (float, optional): least seconds between two refreshes caused by an unknown name.
+        """
+        with self._lock:
+            self.ttl = ttl
+            if miss_refresh_interval is not None:
+                self.miss_refresh_interval = miss_refresh_interval
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def _cached(self, name: str) -> tuple:
+        """Resolve a name from the cached listing, under the lock.
+
+        Returns:
+            tuple: whether the name is resolved without a refresh, and the assistant (None when unknown).
+        """
+        if self._is_fresh():
+            assistant = self._assistants.get(name)
+            if assistant is not None or time.monotonic() - self._loaded_at < self.miss_refresh_interval:
+                self.hits += 1
+                return True, assistant
+        self.misses += 1
+        return False, None
+
+    def _store(self, assistants: Iterable, generation: int) -> None:
+        listing = {}
+        for assistant in assistants:
+            # Keep the first match, as the previous linear scan over the listing did
+            listing.setdefault(assistant.name, assistant)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._assistants = listing
+            self._loaded_at = time.monotonic()
+            self._generation += 1
+
+    def _refresh(self, loader: Callable[[], Iterable]) -> None:
+        """Fetch the listing without holding the lock, or wait for the refresh already in flight.
+        """
+        def refresh():
+            with self._lock:
+                generation = self._generation
+            self._store(loader(), generation)
+        self._flight.do('listing', refresh)
+
+    def get(self, name: str, loader: Callable[[], Iterable]):
+        """Return the assistant with the given name, or None if it does not exist.
+
+        Args:
+            name (str): the assistant name.
+            loader (Callable): returns an iterable over all the assistants, called on a miss.
+        """
+        with self._lock:
+            found, assistant = self._cached(name)
+        if found:
+            return assistant
+        self._refresh(loader)
+        with self._lock:
+            return self._assistants.get(name)
+
+    def lookup(self, name: str) -> tuple:
+        """Resolve a name without loading the listing, for callers which load it themselves (see `load()`).
+
+        Returns:
+            tuple: whether the name is resolved without a refresh, and the assistant (None when the listing
+                must be loaded or the name is unknown).
+        """
+        with self._lock:
+            return self._cached(name)
+
+    def cached_names(self) -> Optional[list]:
+        """Return the names of the known assistants, or None when the listing must be loaded (see `load()`).
+        """
+        with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return list(self._assistants.keys())
+            self.misses += 1
+            return None
+
+    def load(self, assistants: Iterable) -> None:
+        """Replace the cached listing with the given assistants.
+        """
+        with self._lock:
+            generation = self._generation
+        self._store(assistants, generation)
+
+    def names(self, loader: Callable[[], Iterable]) -> list:
+        """Return the names of all the known assistants.
+        """
+        with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return list(self._assistants.keys())
+            self.misses += 1
+        self._refresh(loader)
+        with self._lock:
+            return list(self._assistants.keys())
+
+    def put(self, assistant) -> None:
+        """Insert or replace an assistant after it has been created or updated.
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                self._assistants[assistant.name] = assistant
+            self._generation += 1
+
+    def invalidate(self) -> None:
+        """Drop the cached listing, the next lookup fetches it again.
+        """
+        with self._lock:
+            self._assistants = {}
+            self._loaded_at = None
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._assistants),
+            }
+
+
+assistant_registry = AssistantRegistry()
@@ -0,0 +1,70 @@
+from typing import Dict, Iterable, List, Tuple
+
+from data.document_model import Document
+from utils.cache import LRUCache
+
+# OpenAI file id -> filename, file ids are immutable so entries never expire
+filename_cache = LRUCache(max_size=4096)
+
+
+def remember_filename(file_id: str, filename: str) -> None:
+    """Record the filename of a file uploaded by this process.
+    """
+    filename_cache.set(file_id, filename)
+
+
+def cited_file_ids(message_content) -> list:
+    """Return the ids of the files cited by the annotations of an assistant message.
+    """
+    return [
+        annotation.file_citation.file_id for annotation in message_content.annotations
+        if getattr(annotation, 'file_citation', None)
+    ]
+
+
+def lookup_known_filenames(file_ids: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+    """Resolve file ids from the in-process cache, then from the document catalog, without any API call.
+
+    Returns:
+        tuple: the resolved {file id: filename}, and the deduplicated ids left to retrieve.
+    """
+    filenames = {}
+    missing = []
+    for file_id in dict.fromkeys(file_ids):
+        filename = filename_cache.get(file_id)
+        if filename is None:
+            missing.append(file_id)
+        else:
+            filenames[file_id] = filename
+
+    if missing:
+        for document in Document.query.filter(Document.openai_file_id.in_(missing)):
+            filenames[document.openai_file_id] = document.filename
+            remember_filename(document.openai_file_id, document.filename)
+        missing = [file_id for file_id in missing if file_id not in filenames]
+    return filenames, missing
+
+
+def add_footnotes(message_content, filenames: Dict[str, str]) -> Tuple[str, List[str]]:
+    """Replace the annotations of an assistant message with footnotes.
+
+    Args:
+        message_content: the `text` block of the assistant message.
+        filenames (Dict[str, str]): the filenames of the cited files, see ask_flow.format_answer_flow().
+
+    Returns:
+        tuple: the answer with footnotes, and the list of citations.
+    """
+    response = message_content.value
+    citations = []
+    # Iterate over the annotations and add footnotes
+    for index, annotation in enumerate(message_content.annotations):
+        # Replace the text with a footnote
+        response = response.replace(annotation.text, f' [{index}]')
+        # Gather citations based on annotation attributes
+        if (file_citation := getattr(annotation, 'file_citation', None)) and file_citation.file_id in filenames:
+            citations.append(f"[{index}] from {filenames[file_citation.file_id]}")
+            # Quotes would be amazing. Although they seem to be removed from the API: 
+            # https://github.com/openai/openai-openapi/issues/263
+    return response, citations
+
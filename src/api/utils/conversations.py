@@ -0,0 +1,79 @@
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+from data.extensions import db
+from data.conversation_model import Conversation
+from data.document_model import utcnow
+from utils.openai_client import openai_client
+
+
+def is_idle(conversation: Conversation) -> bool:
+    idle_timeout = timedelta(seconds=current_app.config['CONVERSATION_IDLE_TIMEOUT'])
+    return conversation.last_used_at < utcnow() - idle_timeout
+
+
+def close_conversation(client, conversation: Conversation) -> None:
+    """Delete the conversation and its upstream thread, best effort for the latter.
+    """
+    try:
+        client.beta.threads.delete(conversation.thread_id)
+    except Exception as e:
+        current_app.logger.warning(f"Failed to delete thread {conversation.thread_id}: {str(e)}")
+    conversation.delete()
+
+
+class ConversationJanitor():
+    """Background closer of the conversations nobody can use anymore, outside of the HTTP requests.
+
+    Every CONVERSATION_SWEEP_INTERVAL seconds a daemon thread deletes the threads of the conversations
+    idle for more than CONVERSATION_IDLE_TIMEOUT seconds, and of the ones whose user was deleted.
+    `run_once()` performs a single batch, without the thread.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self):
+        self.app = None
+        self.closed = 0
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.extensions['conversation_janitor'] = self
+        if app.config['CONVERSATION_SWEEP_INTERVAL'] and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='conversation-janitor', daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.app.config['CONVERSATION_SWEEP_INTERVAL'])
+            try:
+                # Keep going while full batches are found
+                while self.run_once() == self.BATCH_SIZE:
+                    pass
+            except Exception as e:
+                self.app.logger.error(f"Conversation sweep failed: {str(e)}")
+
+    def run_once(self) -> int:
+        """Close one batch of idle or orphaned conversations.
+
+        Returns:
+            int: the number of conversations closed.
+        """
+        with self.app.app_context():
+            try:
+                idle_since = utcnow() - timedelta(seconds=self.app.config['CONVERSATION_IDLE_TIMEOUT'])
+                conversations = Conversation.get_closable(idle_since, limit=self.BATCH_SIZE)
+                client = openai_client.get()
+                for conversation in conversations:
+                    current_app.logger.info(f"Closing {'idle' if conversation.user_id else 'orphaned'} conversation {conversation.id}")
+                    close_conversation(client, conversation)
+                self.closed += len(conversations)
+                return len(conversations)
+            finally:
+                db.session.remove()
+
+
+conversation_janitor = ConversationJanitor()
@@ -0,0 +1,208 @@
+import hashlib
+import os
+from typing import Callable, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from data.extensions import db
+from data.document_model import AssistantStore, Document
+from api.utils.citations import remember_filename
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file in fixed size chunks, so memory use does not depend on the file size.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_pdfs(folder: str) -> List[str]:
+    """Return the names of the PDFs saved in an assistant's upload folder.
+    """
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        name for name in os.listdir(folder)
+        if name.lower().endswith('.pdf') and os.path.isfile(os.path.join(folder, name))
+    )
+
+
+def get_or_create_store(client, assistant):
+    """Return the catalog entry of the assistant's vector store, creating the store on first use.
+
+    The assistant is (re)pointed to the store when its file_search tool does not reference it.
+
+    Returns:
+        tuple: the AssistantStore, whether it was just created, and the assistant (updated or not).
+    """
+    store = AssistantStore.get_by_assistant_id(assistant.id)
+    created = store is None
+    if created:
+        vector_store = client.beta.vector_stores.create(name=assistant.name)
+        store = AssistantStore(
+            assistant_id=assistant.id,
+            assistant_name=assistant.name,
+            vector_store_id=vector_store.id,
+        )
+        try:
+            store.save()
+            current_app.logger.info(f"Created vector store {vector_store.id} for assistant {assistant.name}")
+        except IntegrityError:
+            # A concurrent upload created the store first, use that one
+            db.session.rollback()
+            client.beta.vector_stores.delete(vector_store.id)
+            store = AssistantStore.get_by_assistant_id(assistant.id)
+            created = False
+
+    file_search = getattr(assistant.tool_resources, 'file_search', None) if assistant.tool_resources else None
+    if not file_search or store.vector_store_id not in (file_search.vector_store_ids or []):
+        assistant = client.beta.assistants.update(
+            assistant_id=assistant.id,
+            tool_resources={"file_search": {"vector_store_ids": [store.vector_store_id]}},
+        )
+    return store, created, assistant
+
+
+def _remove_upstream_file(client, store: AssistantStore, document: Document) -> None:
+    """Detach the previous version of a document from the vector store, best effort.
+    """
+    if not document.openai_file_id or Document.is_file_shared(document.openai_file_id, document.id):
+        return
+    try:
+        client.beta.vector_stores.files.delete(vector_store_id=store.vector_store_id, file_id=document.openai_file_id)
+        client.files.delete(document.openai_file_id)
+    except Exception as e:
+        current_app.logger.warning(f"Failed to remove file {document.openai_file_id} from vector store {store.vector_store_id}: {str(e)}")
+
+
+def _abandon_uploads(client, store: AssistantStore, documents: List[Document], file_ids: List[str], batch_started: bool) -> None:
+    """Mark the documents of an interrupted ingestion as failed and delete the files already uploaded for them.
+
+    The deletions are best effort, the documents are uploaded again by the next ingestion of their folder.
+    """
+    for document in documents:
+        document.status = Document.STATUS_FAILED
+        document.openai_file_id = None
+    db.session.commit()
+    for file_id in file_ids:
+        try:
+            if batch_started:
+                client.beta.vector_stores.files.delete(vector_store_id=store.vector_store_id, file_id=file_id)
+        except Exception as e:
+            current_app.logger.warning(f"Failed to detach file {file_id} from vector store {store.vector_store_id}: {str(e)}")
+        try:
+            client.files.delete(file_id)
+        except Exception as e:
+            current_app.logger.warning(f"Failed to delete uploaded file {file_id}: {str(e)}")
+
+
+def ingest_documents(client, assistant, folder: str, files: Dict[str, Optional[str]], on_progress: Optional[Callable] = None) -> dict:
+    """Push the new or changed PDFs of an assistant's upload folder into its persistent vector store.
+
+    Files whose SHA-256 matches a document already indexed in the store are not uploaded again.
+    When the store is created, every PDF already in the folder is ingested too, so assistants
+    populated before the catalog existed are migrated on their next upload.
+
+    Args:
+        client: the OpenAI client.
+        assistant: the assistant owning the upload folder.
+        folder (str): the assistant's upload folder.
+        files (Dict[str, Optional[str]]): the files (relative to the folder) that were added or replaced,
+            with their SHA-256 when it was already computed while saving them.
+        on_progress (Callable, optional): called as on_progress(status, counts) when the files are
+            being uploaded ('uploading') and then indexed by the vector store ('indexing').
+
+    Returns:
+        dict: the updated assistant and the number of total, uploaded, skipped and failed files.
+    """
+    store, created, assistant = get_or_create_store(client, assistant)
+    files = dict(files)
+    if created:
+        for filename in list_pdfs(folder):
+            files.setdefault(filename, None)
+    counts = {'total': len(files), 'uploaded': 0, 'skipped': 0, 'failed': 0}
+
+    def report(status):
+        if on_progress:
+            on_progress(status, counts)
+
+    pending = []
+    for filename, sha256 in sorted(files.items()):
+        if sha256 is None:
+            sha256 = file_sha256(os.path.join(folder, filename))
+        document = Document.get_by_filename(store.id, filename)
+        if document and document.sha256 == sha256 and document.status == Document.STATUS_READY:
+            counts['skipped'] += 1
+            continue
+
+        if document and document.openai_file_id:
+            _remove_upstream_file(client, store, document)
+        if document is None:
+            document = Document(store_id=store.id, filename=filename)
+        document.sha256 = sha256
+
+        # The same content may already be indexed under another name
+        duplicate = Document.get_ready_by_sha256(store.id, sha256)
+        if duplicate and duplicate.id != document.id:
+            document.openai_file_id = duplicate.openai_file_id
+            document.status = Document.STATUS_READY
+            db.session.add(document)
+            counts['skipped'] += 1
+            continue
+
+        document.openai_file_id = None
+        document.status = Document.STATUS_UPLOADING
+        db.session.add(document)
+        pending.append(document)
+    db.session.commit()
+
+    if pending:
+        uploaded_ids = []
+        batch_started = False
+        try:
+            report('uploading')
+            for document in pending:
+                with open(os.path.join(folder, document.filename), 'rb') as stream:
+                    file_id = client.files.create(file=stream, purpose='assistants').id
+                uploaded_ids.append(file_id)
+                document.openai_file_id = file_id
+                remember_filename(file_id, document.filename)
+                db.session.commit()
+                counts['uploaded'] += 1
+                report('uploading')
+
+            report('indexing')
+
+            batch_started = True
+            file_batch = client.beta.vector_stores.file_batches.create_and_poll(
+                vector_store_id=store.vector_store_id,
+                file_ids=[document.openai_file_id for document in pending],
+            )
+        except Exception:
+            db.session.rollback()
+            _abandon_uploads(client, store, pending, uploaded_ids, batch_started)
+            raise
+
+        failed_ids = set()
+        if file_batch.file_counts.failed:
+            failed_ids = {
+                vector_store_file.id for vector_store_file in client.beta.vector_stores.file_batches.list_files(
+                    vector_store_id=store.vector_store_id, batch_id=file_batch.id, filter='failed'
+                )
+            }
+        for document in pending:
+            if document.openai_file_id in failed_ids or file_batch.status != 'completed':
+                document.status = Document.STATUS_FAILED
+                counts['uploaded'] -= 1
+                counts['failed'] += 1
+            else:
+                document.status = Document.STATUS_READY
+        db.session.commit()
+
+    current_app.logger.info(f"Ingested {counts['uploaded']} file(s) into {store.vector_store_id}, skipped {counts['skipped']}, failed {counts['failed']}")
+    return dict(counts, assistant=assistant)
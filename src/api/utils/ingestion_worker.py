@@ -0,0 +1,144 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from data.extensions import db
+from data.ingestion_job_model import IngestionJob
+from api.utils.assistant_registry import assistant_registry
+from api.utils.document_ingestion import ingest_documents
+from api.utils.answer_cache import invalidate_assistant_answers
+from api.utils.search_index import search_index
+from utils.openai_client import openai_client
+
+
+class IngestionQueueFull(Exception):
+    """Raised when the number of pending ingestion jobs reached INGESTION_MAX_PENDING.
+    """
+
+
+class IngestionWorker():
+    """Bounded background pool indexing the uploaded PDFs, outside of the HTTP request.
+
+    The job state lives in the database (see IngestionJob), the pool only holds job ids. Jobs left
+    unfinished by a crash are submitted again by `recover()`; this is safe because the ingestion
+    skips the files that are already indexed.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._backlog = False
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.app = app
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config['INGESTION_WORKERS'],
+            thread_name_prefix='ingestion',
+        )
+        # Running and queued jobs together
+        self._slots = threading.BoundedSemaphore(app.config['INGESTION_MAX_PENDING'])
+        app.extensions['ingestion_worker'] = self
+
+    def reserve(self) -> None:
+        """Take the slot of a job about to be submitted with `submit(job_id, reserved=True)`.
+
+        Raises IngestionQueueFull when too many jobs are pending. A reservation which is not
+        submitted must be given back with `cancel_reservation()`.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise IngestionQueueFull()
+
+    def cancel_reservation(self) -> None:
+        self._slots.release()
+
+    def submit(self, job_id: str, reserved: bool = False) -> None:
+        """Queue a job, raises IngestionQueueFull when too many jobs are pending.
+        """
+        if not reserved:
+            self.reserve()
+        with self._lock:
+            self._submitted.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def recover(self) -> None:
+        """Queue again the jobs which were not finished when the process stopped.
+
+        Must be called within an application context. The jobs which do not fit in the pool stay
+        queued in the database and are submitted as the running ones complete.
+        """
+        self._backlog = False
+        for job in IngestionJob.get_unfinished():
+            with self._lock:
+                if job.id in self._submitted:
+                    continue
+            if job.status != IngestionJob.STATUS_QUEUED:
+                job.status = IngestionJob.STATUS_QUEUED
+                job.save()
+            try:
+                self.submit(job.id)
+                self.app.logger.info(f"Resuming ingestion job {job.id}")
+            except IngestionQueueFull:
+                self._backlog = True
+                break
+
+    def _run(self, job_id: str) -> None:
+        try:
+            with self.app.app_context():
+                self._process(job_id)
+        finally:
+            with self._lock:
+                self._submitted.discard(job_id)
+            self._slots.release()
+        if self._backlog:
+            with self.app.app_context():
+                self.recover()
+
+    def _process(self, job_id: str) -> None:
+        if not IngestionJob.claim(job_id):
+            return
+        job = IngestionJob.get_by_id(job_id)
+
+        def on_progress(status, counts):
+            job.status = status
+            job.total_files = counts['total']
+            job.uploaded_files = counts['uploaded']
+            job.skipped_files = counts['skipped']
+            job.failed_files = counts['failed']
+            job.save()
+
+        try:
+            try:
+                client = openai_client.get()
+                assistant = client.beta.assistants.retrieve(job.assistant_id)
+                result = ingest_documents(client, assistant, job.folder, job.get_files(), on_progress=on_progress)
+                assistant_registry.put(result['assistant'])
+                if result['uploaded'] or result['skipped'] < result['total']:
+                    invalidate_assistant_answers(job.assistant_id)
+                final_status = IngestionJob.STATUS_FAILED if result['failed'] else IngestionJob.STATUS_DONE
+                on_progress(IngestionJob.STATUS_SEARCH_INDEXING, result)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+                final_status = IngestionJob.STATUS_FAILED
+                job.status = IngestionJob.STATUS_SEARCH_INDEXING
+                job.error = str(e)
+                job.save()
+
+            # Once the upload is over, so that the PDF parsing does not delay it. The local search index
+            # does not depend on OpenAI, it is updated even when the upload failed
+            try:
+                search_index.update(job.assistant_name, job.folder, job.get_files())
+            except Exception as e:
+                self.app.logger.error(f"Search index update for job {job_id} failed: {str(e)}")
+            job.status = final_status
+            job.save()
+        finally:
+            db.session.remove()
+
+
+ingestion_worker = IngestionWorker()
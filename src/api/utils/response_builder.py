@@ -1,4 +1,5 @@
 from flask import jsonify
+import json
 
 ### Helper functions ###
 
@@ -34,4 +35,16 @@ def success_response(message, data=None, status_code=200):
     response = {'message': message}
     if data:
         response.update(data)
-    return jsonify(response), status_code
\ No newline at end of file
+    return jsonify(response), status_code
+
+def sse_event(event, data):
+    """Serialize a Server-Sent Event.
+
+    Args:
+        event (str): The event name.
+        data (dict): The event payload, sent as JSON.
+
+    Returns:
+        str: The event, ready to be written to a `text/event-stream` response.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
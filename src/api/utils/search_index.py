@@ -0,0 +1,327 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+from pypdf import PdfReader
+
+from api.utils.document_ingestion import file_sha256, list_pdfs
+from api.utils.uploads import assistant_folder
+
+"""
+Local full-text index of the PDFs saved under UPLOAD_FOLDER/<assistant_name>, searched with BM25
+without calling OpenAI.
+
+Each PDF content (identified by its SHA-256) is extracted, split into overlapping passages and
+written once to its own segment file:
+
+    MAGIC | header length (uint32) | JSON header | postings | passage texts
+
+The header holds the passages (page, text offset and length, token count) and the term dictionary
+(term -> postings offset and count). Postings are (passage index uint32, term frequency uint16)
+records. Segments are memory-mapped, only the header is parsed in memory. The manifest of an
+assistant maps its filenames to their segment, adding a file only writes the new segment and the
+manifest.
+"""
+
+MAGIC = b'PDFIDX01'
+HEADER_LENGTH = struct.Struct('<I')
+POSTING = struct.Struct('<IH')
+MANIFEST = 'manifest.json'
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1 or token.isdigit()]
+
+
+def extract_passages(path: str, chunk_words: int, overlap: int) -> List[Tuple[int, str]]:
+    """Split the text of every page of a PDF into passages of chunk_words words.
+
+    Consecutive passages of a page share `overlap` words, so that a sentence cut by a boundary is
+    still found whole. Returns (page number starting at 1, text) pairs.
+    """
+    step = max(1, chunk_words - overlap)
+    passages = []
+    for page_number, page in enumerate(PdfReader(path).pages, start=1):
+        words = (page.extract_text() or '').split()
+        for start in range(0, max(1, len(words) - overlap), step):
+            chunk = words[start:start + chunk_words]
+            if chunk:
+                passages.append((page_number, ' '.join(chunk)))
+    return passages
+
+
+def write_segment(path: str, passages: List[Tuple[int, str]]) -> None:
+    """Write the segment of a document, atomically.
+    """
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    header_passages = []
+    texts = bytearray()
+    for index, (page, text) in enumerate(passages):
+        tokens = tokenize(text)
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term, []).append((index, min(frequency, 0xFFFF)))
+        encoded = text.encode('utf-8')
+        header_passages.append([page, len(texts), len(encoded), len(tokens)])
+        texts += encoded
+
+    terms = {}
+    postings_blob = bytearray()
+    for term in sorted(postings):
+        terms[term] = [len(postings_blob), len(postings[term])]
+        for index, frequency in postings[term]:
+            postings_blob += POSTING.pack(index, frequency)
+
+    header = json.dumps({
+        'passages': header_passages,
+        'terms': terms,
+        'postings_length': len(postings_blob),
+    }, separators=(',', ':')).encode('utf-8')
+
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.segment-', suffix='.part')
+    try:
+        with os.fdopen(descriptor, 'wb') as stream:
+            stream.write(MAGIC)
+            stream.write(HEADER_LENGTH.pack(len(header)))
+            stream.write(header)
+            stream.write(postings_blob)
+            stream.write(texts)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class Segment():
+    """A memory-mapped segment, read only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as stream:
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a search index segment')
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header_length, = HEADER_LENGTH.unpack_from(self._map, len(MAGIC))
+        header = json.loads(self._map[header_start:header_start + header_length])
+        self.passages: List[List[int]] = header['passages']
+        self.terms: Dict[str, List[int]] = header['terms']
+        self._postings_start = header_start + header_length
+        self._texts_start = self._postings_start + header['postings_length']
+        self.token_count = sum(passage[3] for passage in self.passages)
+
+    def document_frequency(self, term: str) -> int:
+        entry = self.terms.get(term)
+        return entry[1] if entry else 0
+
+    def postings(self, term: str):
+        """Yield the (passage index, term frequency) pairs of a term.
+        """
+        entry = self.terms.get(term)
+        if not entry:
+            return
+        start = self._postings_start + entry[0]
+        for offset in range(start, start + entry[1] * POSTING.size, POSTING.size):
+            yield POSTING.unpack_from(self._map, offset)
+
+    def passage(self, index: int) -> Tuple[int, str]:
+        page, offset, length, _ = self.passages[index]
+        start = self._texts_start + offset
+        return page, self._map[start:start + length].decode('utf-8')
+
+
+class SearchIndex():
+    """The segments of an assistant's documents, as listed by its manifest at load time.
+    """
+
+    def __init__(self, documents: List[Tuple[str, Segment]]):
+        self.documents = documents
+        self.passage_count = sum(len(segment.passages) for _, segment in documents)
+        token_count = sum(segment.token_count for _, segment in documents)
+        self.average_length = token_count / self.passage_count if self.passage_count else 0
+
+    def search(self, query: str, k: int) -> List[dict]:
+        """Return the k passages scoring best for the query with BM25, best first.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.passage_count:
+            return []
+
+        scores: Dict[Tuple[int, int], float] = {}
+        for term in terms:
+            document_frequency = sum(segment.document_frequency(term) for _, segment in self.documents)
+            if not document_frequency:
+                continue
+            idf = math.log(1 + (self.passage_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            for document_index, (_, segment) in enumerate(self.documents):
+                for passage_index, frequency in segment.postings(term):
+                    length = segment.passages[passage_index][3]
+                    norm = K1 * (1 - B + B * length / self.average_length)
+                    key = (document_index, passage_index)
+                    scores[key] = scores.get(key, 0) + idf * frequency * (K1 + 1) / (frequency + norm)
+
+        results = []
+        for (document_index, passage_index), score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            filename, segment = self.documents[document_index]
+            page, text = segment.passage(passage_index)
+            results.append({
+                'file': filename,
+                'page': page,
+                'score': round(score, 4),
+                'text': text,
+            })
+        return results
+
+
+class SearchIndexManager():
+    """Builds and serves the local search index of every assistant, under SEARCH_INDEX_FOLDER.
+
+    Updates (from the ingestion jobs) are serialized by a lock, searches are lock free: they use the
+    index loaded from the manifest, which is reloaded when the manifest changes.
+    """
+
+    def __init__(self):
+        self.folder: Optional[str] = None
+        self.chunk_words = 120
+        self.chunk_overlap = 30
+        self._indexes: Dict[str, Tuple[int, SearchIndex]] = {}
+        self._update_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.folder = app.config['SEARCH_INDEX_FOLDER']
+        self.chunk_words = app.config['SEARCH_CHUNK_WORDS']
+        self.chunk_overlap = app.config['SEARCH_CHUNK_OVERLAP']
+        self._indexes = {}
+        app.extensions['search_index'] = self
+
+    def _assistant_folder(self, assistant_name: str) -> str:
+        return assistant_folder(self.folder, assistant_name)
+
+    @staticmethod
+    def _read_manifest(folder: str) -> dict:
+        try:
+            with open(os.path.join(folder, MANIFEST)) as stream:
+                return json.load(stream)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _write_manifest(folder: str, manifest: dict) -> None:
+        descriptor, temporary_path = tempfile.mkstemp(dir=folder, prefix='.manifest-', suffix='.part')
+        with os.fdopen(descriptor, 'w') as stream:
+            json.dump(manifest, stream)
+        os.replace(temporary_path, os.path.join(folder, MANIFEST))
+
+    def update(self, assistant_name: str, upload_folder: str, files: Dict[str, Optional[str]]) -> dict:
+        """Index the added or changed files of an assistant's upload folder.
+
+        The PDFs of the folder which are not in the manifest yet are indexed too, and the files which
+        were removed from the folder are dropped, so that the first update migrates existing folders.
+
+        Args:
+            assistant_name (str): the assistant.
+            upload_folder (str): the assistant's upload folder.
+            files (Dict[str, Optional[str]]): the files that were added or replaced, with their SHA-256
+                when it is known.
+
+        Returns:
+            dict: the number of indexed, skipped and failed files.
+        """
+        folder = self._assistant_folder(assistant_name)
+        counts = {'indexed': 0, 'skipped': 0, 'failed': 0}
+        with self._update_lock:
+            os.makedirs(folder, exist_ok=True)
+            manifest = self._read_manifest(folder)
+            present = set(list_pdfs(upload_folder))
+            candidates = {filename: sha256 for filename, sha256 in files.items() if filename in present}
+            for filename in present - set(manifest):
+                candidates.setdefault(filename, None)
+
+            for filename, sha256 in sorted(candidates.items()):
+                if sha256 is None:
+                    sha256 = file_sha256(os.path.join(upload_folder, filename))
+                entry = manifest.get(filename)
+                if entry and entry['sha256'] == sha256:
+                    counts['skipped'] += 1
+                    continue
+                segment_path = os.path.join(folder, f'{sha256}.seg')
+                if not os.path.exists(segment_path):
+                    try:
+                        passages = extract_passages(os.path.join(upload_folder, filename), self.chunk_words, self.chunk_overlap)
+                        write_segment(segment_path, passages)
+                    except Exception as e:
+                        # Kept in the manifest, so that the same content is not extracted again
+                        current_app.logger.warning(f"Failed to index {filename} for assistant {assistant_name}: {str(e)}")
+                        manifest[filename] = {'sha256': sha256, 'error': str(e)}
+                        counts['failed'] += 1
+                        continue
+                manifest[filename] = {'sha256': sha256}
+                counts['indexed'] += 1
+
+            for filename in set(manifest) - present:
+                del manifest[filename]
+            self._write_manifest(folder, manifest)
+
+            # Segments no longer referenced, the ones still mapped by a loaded index stay readable.
+            # Not while an index is being loaded, it may be reading the previous manifest.
+            referenced = {f"{entry['sha256']}.seg" for entry in manifest.values()}
+            with self._load_lock:
+                for name in os.listdir(folder):
+                    if name.endswith('.seg') and name not in referenced:
+                        os.remove(os.path.join(folder, name))
+
+        current_app.logger.info(f"Search index of {assistant_name}: indexed {counts['indexed']} file(s), skipped {counts['skipped']}, failed {counts['failed']}")
+        return counts
+
+    def get(self, assistant_name: str) -> Optional[SearchIndex]:
+        """Return the index of an assistant, None when none was built.
+        """
+        folder = self._assistant_folder(assistant_name)
+        try:
+            version = os.stat(os.path.join(folder, MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        loaded = self._indexes.get(assistant_name)
+        if loaded and loaded[0] == version:
+            return loaded[1]
+
+        with self._load_lock:
+            loaded = self._indexes.get(assistant_name)
+            if loaded and loaded[0] == version:
+                return loaded[1]
+            # Segments are immutable, the ones of the previous version are reused
+            segments = {segment.path: segment for _, segment in loaded[1].documents} if loaded else {}
+            documents = []
+            indexed = set()
+            for filename, entry in sorted(self._read_manifest(folder).items()):
+                path = os.path.join(folder, f"{entry['sha256']}.seg")
+                # Files sharing the same content are searched once
+                if 'error' in entry or path in indexed:
+                    continue
+                indexed.add(path)
+                if path not in segments:
+                    segments[path] = Segment(path)
+                documents.append((filename, segments[path]))
+            index = SearchIndex(documents)
+            self._indexes[assistant_name] = (version, index)
+            return index
+
+
+search_index = SearchIndexManager()
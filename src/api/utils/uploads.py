@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tempfile
+
+from werkzeug.utils import secure_filename
+
+from api.errors import AiErrors
+
+PDF_MAGIC = b'%PDF-'
+# The PDF header may be preceded by some garbage, readers look for it in the first KB
+PDF_MAGIC_WINDOW = 1024
+
+
+class UploadRejected(Exception):
+    """The uploaded file was refused, `error_key` is the matching AiErrors key.
+    """
+    def __init__(self, error_key: str):
+        super().__init__(error_key)
+        self.error_key = error_key
+
+
+def assistant_folder(root: str, assistant_name: str) -> str:
+    """The folder of an assistant under `root`, the same name is used for its search index and its new uploads.
+
+    The name is sanitized, an assistant name can not point outside of `root`. Names without any
+    ASCII letter or digit get a folder named after their hash.
+    """
+    name = secure_filename(assistant_name) or hashlib.sha256(assistant_name.encode()).hexdigest()[:16]
+    return os.path.join(root, name)
+
+
+def assistant_upload_folder(root: str, assistant_name: str) -> str:
+    """The upload folder of an assistant, see assistant_folder().
+
+    Uploads used to be saved in a folder named after the raw assistant name. That folder keeps being
+    used when it exists and is a plain child of `root`, so that the PDFs uploaded before are still
+    found when the vector store of the assistant is created.
+    """
+    legacy_folder = os.path.join(root, assistant_name)
+    if assistant_name and os.path.isdir(legacy_folder) and os.path.realpath(legacy_folder) == os.path.join(os.path.realpath(root), assistant_name):
+        return legacy_folder
+    return assistant_folder(root, assistant_name)
+
+
+def save_pdf_upload(file, target_path: str, max_size: int, chunk_size: int = 64 * 1024) -> str:
+    """Copy an uploaded PDF to its destination in fixed size chunks, validating it on the way.
+
+    The content goes to a temporary file next to the destination, which is only replaced once the
+    whole upload was accepted. A file which is not a PDF is rejected after its first chunk, a file
+    bigger than max_size as soon as the limit is crossed.
+
+    Args:
+        file: the werkzeug FileStorage of the upload.
+        target_path (str): where the PDF is saved.
+        max_size (int): the maximum size of the file, in bytes.
+        chunk_size (int, optional): the size of the chunks read from the upload.
+
+    Raises:
+        UploadRejected: the file is not a PDF, or it is too large.
+
+    Returns:
+        str: the SHA-256 of the file, computed while copying it.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), prefix='.upload-', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            first_chunk = True
+            while chunk := file.stream.read(chunk_size):
+                if first_chunk and PDF_MAGIC not in chunk[:PDF_MAGIC_WINDOW]:
+                    raise UploadRejected(AiErrors.FILE_NOT_PDF)
+                first_chunk = False
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadRejected(AiErrors.FILE_TOO_LARGE)
+                digest.update(chunk)
+                temp_file.write(chunk)
+            if first_chunk:
+                raise UploadRejected(AiErrors.FILE_NOT_PDF)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return digest.hexdigest()
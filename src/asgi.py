@@ -0,0 +1,26 @@
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from api.assistant_async import create_async_routes
+from main import create_app
+
+"""
+ASGI serving mode, next to the `waitress-serve --call main:create_app` one:
+
+    uvicorn --factory asgi:create_asgi_app --host 0.0.0.0 --port 9000
+
+/ai/assistants, /ai/assistant/<name> and /ai/ask are served by the async views of
+api/assistant_async.py on AsyncOpenAI, every other path by the Flask app, in a thread pool of
+WAITRESS_THREADS threads. These stay synchronous and hold a thread for the whole request:
+/ai/ask/stream (and /ai/ask with Accept: text/event-stream), /ai/ask with a conversation_id or
+async, /ai/ask-batch and /ai/add-pdf. The async /ai/ask applies the JWT and admission checks of
+the Flask view, the profiler (a WSGI middleware) only sees the requests served by the Flask app.
+"""
+
+
+def create_asgi_app():
+    flask_app = create_app()
+    wsgi_app = WSGIMiddleware(flask_app, workers=flask_app.config['WAITRESS_THREADS'])
+    routes = create_async_routes(flask_app, wsgi_app)
+    return Starlette(routes=routes + [Mount('/', app=wsgi_app)])
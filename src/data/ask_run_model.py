@@ -0,0 +1,82 @@
+from data.extensions import db
+from data.document_model import utcnow
+from datetime import datetime
+from uuid import uuid4
+import json
+
+
+class AskRun(db.Model):
+    """A question submitted with `async: true`, its answer is polled with GET /ai/runs/<id>.
+
+    Runs still unfinished at `deadline_at` are cancelled upstream.
+    """
+    __tablename__ = 'ask_runs'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_IN_PROGRESS = 'in_progress'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_EXPIRED = 'expired'
+    UNFINISHED = (STATUS_QUEUED, STATUS_IN_PROGRESS)
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    # The user who submitted the question, the only one allowed to read the run
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, index=True)
+    assistant_id = db.Column(db.String(64), nullable=False)
+    assistant_name = db.Column(db.String(256), nullable=False)
+    question = db.Column(db.Text, nullable=False)
+    thread_id = db.Column(db.String(64), nullable=False)
+    run_id = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED, index=True)
+    answer = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    deadline_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f'<AskRun {self.id} ({self.status})>'
+
+    def is_finished(self) -> bool:
+        return self.status not in self.UNFINISHED
+
+    def get_answer(self) -> dict:
+        return json.loads(self.answer) if self.answer else None
+
+    def set_answer(self, answer: dict) -> None:
+        self.answer = json.dumps(answer)
+
+    def to_dict(self) -> dict:
+        data = {
+            'id': self.id,
+            'assistant_name': self.assistant_name,
+            'thread_id': self.thread_id,
+            'run_id': self.run_id,
+            'status': self.status,
+            'deadline_at': self.deadline_at.isoformat(),
+            'created_at': self.created_at.isoformat(),
+        }
+        if self.status == self.STATUS_COMPLETED:
+            data.update(self.get_answer())
+        if self.error:
+            data['error'] = self.error
+        return data
+
+    @classmethod
+    def get_by_id(cls, run_id: str) -> 'AskRun':
+        return db.session.get(cls, run_id)
+
+    @classmethod
+    def get_for_user(cls, run_id: str, user_id: int) -> 'AskRun':
+        return cls.query.filter_by(id=run_id, user_id=user_id).first()
+
+    @classmethod
+    def get_overdue(cls, now: datetime, limit: int = 20) -> list:
+        return cls.query.filter(cls.status.in_(cls.UNFINISHED), cls.deadline_at < now).limit(limit).all()
+
+    # Db instance methods
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
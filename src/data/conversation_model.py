@@ -0,0 +1,65 @@
+from data.extensions import db
+from data.document_model import utcnow
+from datetime import datetime
+from sqlalchemy import or_
+from uuid import uuid4
+
+
+class Conversation(db.Model):
+    """An OpenAI thread owned by a user, follow-up questions are appended to it.
+    """
+    __tablename__ = 'conversations'
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    # Cleared when the user is deleted, the janitor then deletes the thread (see ConversationJanitor)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, index=True)
+    assistant_id = db.Column(db.String(64), nullable=False)
+    assistant_name = db.Column(db.String(256), nullable=False)
+    thread_id = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+
+    def __repr__(self):
+        return f'<Conversation {self.id} ({self.assistant_name})>'
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'assistant_name': self.assistant_name,
+            'created_at': self.created_at.isoformat(),
+            'last_used_at': self.last_used_at.isoformat(),
+        }
+
+    def touch(self) -> None:
+        self.last_used_at = utcnow()
+        self.save()
+
+    @classmethod
+    def get_for_user(cls, conversation_id: str, user_id: int) -> 'Conversation':
+        return cls.query.filter_by(id=conversation_id, user_id=user_id).first()
+
+    @classmethod
+    def get_all_for_user(cls, user_id: int) -> list:
+        return cls.query.filter_by(user_id=user_id).order_by(cls.last_used_at.desc()).all()
+
+    @classmethod
+    def get_closable(cls, idle_since: datetime, limit: int = 100) -> list:
+        """The conversations idle since before `idle_since`, or whose user was deleted.
+        """
+        return cls.query.filter(or_(cls.last_used_at < idle_since, cls.user_id.is_(None))).limit(limit).all()
+
+    @classmethod
+    def orphan_for_user(cls, user_id: int) -> None:
+        """Detach the conversations of a user about to be deleted, in the current transaction.
+        """
+        cls.query.filter_by(user_id=user_id).update({'user_id': None})
+
+    # Db instance methods
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
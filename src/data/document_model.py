@@ -0,0 +1,100 @@
+from data.extensions import db
+from datetime import datetime, timezone
+from sqlalchemy import and_, func
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class AssistantStore(db.Model):
+    """The vector store attached to an assistant, reused by every upload to that assistant.
+    """
+    __tablename__ = 'assistant_stores'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    assistant_id = db.Column(db.String(64), unique=True, nullable=False)
+    assistant_name = db.Column(db.String(256), nullable=False)
+    vector_store_id = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    documents = db.relationship('Document', backref='store', lazy='dynamic', cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<AssistantStore {self.assistant_name} ({self.vector_store_id})>'
+
+    @classmethod
+    def get_by_assistant_id(cls, assistant_id: str) -> 'AssistantStore':
+        return cls.query.filter_by(assistant_id=assistant_id).first()
+
+    @classmethod
+    def get_corpus_version(cls, assistant_id: str) -> str:
+        """Return a string which changes every time a document of the assistant is indexed or replaced.
+        """
+        version = db.session.query(
+            cls.vector_store_id, func.count(Document.id), func.max(Document.updated_at)
+        ).outerjoin(
+            Document, and_(Document.store_id == cls.id, Document.status == Document.STATUS_READY)
+        ).filter(cls.assistant_id == assistant_id).group_by(cls.id, cls.vector_store_id).first()
+        if version is None:
+            return ''
+        vector_store_id, count, updated_at = version
+        return f'{vector_store_id}:{count}:{updated_at.isoformat() if updated_at else ""}'
+
+    # Db instance methods
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
+
+
+class Document(db.Model):
+    """A PDF uploaded to an assistant's vector store, identified by the SHA-256 of its content.
+    """
+    __tablename__ = 'documents'
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'filename', name='uq_documents_store_filename'),
+    )
+
+    STATUS_UPLOADING = 'uploading'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('assistant_stores.id'), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    openai_file_id = db.Column(db.String(64), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_UPLOADING)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f'<Document {self.filename} ({self.status})>'
+
+    @classmethod
+    def get_by_filename(cls, store_id: int, filename: str) -> 'Document':
+        return cls.query.filter_by(store_id=store_id, filename=filename).first()
+
+    @classmethod
+    def get_ready_by_sha256(cls, store_id: int, sha256: str) -> 'Document':
+        return cls.query.filter_by(store_id=store_id, sha256=sha256, status=cls.STATUS_READY).first()
+
+    @classmethod
+    def is_file_shared(cls, openai_file_id: str, exclude_id: int) -> bool:
+        """Whether another document of the catalog points to the same OpenAI file.
+        """
+        return cls.query.filter(cls.openai_file_id == openai_file_id, cls.id != exclude_id).first() is not None
+
+    # Db instance methods
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
@@ -0,0 +1,99 @@
+from data.extensions import db
+from data.document_model import utcnow
+from uuid import uuid4
+import json
+
+
+class IngestionJob(db.Model):
+    """A PDF upload waiting to be (or being) indexed into an assistant's vector store.
+
+    Jobs are persisted so that the ones interrupted by a crash or a restart are picked up again.
+    """
+    __tablename__ = 'ingestion_jobs'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_UPLOADING = 'uploading'
+    STATUS_INDEXING = 'indexing'
+    # The vector store is done, the local search index is being updated
+    STATUS_SEARCH_INDEXING = 'search_indexing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    UNFINISHED = (STATUS_QUEUED, STATUS_UPLOADING, STATUS_INDEXING, STATUS_SEARCH_INDEXING)
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    # The user who uploaded the file, the only one allowed to read the job
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True, index=True)
+    assistant_id = db.Column(db.String(64), nullable=False)
+    assistant_name = db.Column(db.String(256), nullable=False)
+    folder = db.Column(db.String(512), nullable=False)
+    filenames = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED, index=True)
+    total_files = db.Column(db.Integer, nullable=False, default=0)
+    uploaded_files = db.Column(db.Integer, nullable=False, default=0)
+    skipped_files = db.Column(db.Integer, nullable=False, default=0)
+    failed_files = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f'<IngestionJob {self.id} ({self.status})>'
+
+    def get_files(self) -> dict:
+        """Return the files of the job, as {filename: SHA-256 or None when it was not computed}.
+        """
+        files = json.loads(self.filenames)
+        if isinstance(files, list):
+            return dict.fromkeys(files)
+        return files
+
+    def set_files(self, files: dict) -> None:
+        self.filenames = json.dumps(files)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'assistant_name': self.assistant_name,
+            'status': self.status,
+            'files': {
+                'total': self.total_files,
+                'uploaded': self.uploaded_files,
+                'skipped': self.skipped_files,
+                'failed': self.failed_files,
+            },
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+        }
+
+    @classmethod
+    def get_by_id(cls, job_id: str) -> 'IngestionJob':
+        return db.session.get(cls, job_id)
+
+    @classmethod
+    def get_for_user(cls, job_id: str, user_id: int) -> 'IngestionJob':
+        return cls.query.filter_by(id=job_id, user_id=user_id).first()
+
+    @classmethod
+    def get_unfinished(cls) -> list:
+        return cls.query.filter(cls.status.in_(cls.UNFINISHED)).order_by(cls.created_at).all()
+
+    @classmethod
+    def claim(cls, job_id: str) -> bool:
+        """Atomically move a queued job to uploading, so that a job is processed only once.
+        """
+        claimed = cls.query.filter_by(id=job_id, status=cls.STATUS_QUEUED).update(
+            {'status': cls.STATUS_UPLOADING, 'updated_at': utcnow()}
+        )
+        db.session.commit()
+        return claimed == 1
+
+    # Db instance methods
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
@@ -0,0 +1,93 @@
+from data.extensions import db
+from data.document_model import utcnow
+from datetime import timedelta
+import json
+
+
+class OutboxEmail(db.Model):
+    """An email waiting to be sent by the email dispatcher.
+
+    The email is written in the same database as the request data and sent in the background,
+    retried with an exponential backoff and finally dead-lettered.
+    """
+    __tablename__ = 'email_outbox'
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    endpoint = db.Column(db.String(255), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxEmail {self.id} ({self.status})>'
+
+    def get_payload(self) -> dict:
+        return json.loads(self.payload)
+
+    def erase_payload(self) -> None:
+        """Forget the recipient and content of an email which will not be sent again.
+        """
+        self.payload = '{}'
+
+    @classmethod
+    def enqueue(cls, endpoint: str, payload: dict) -> 'OutboxEmail':
+        email = cls(endpoint=endpoint, payload=json.dumps(payload))
+        email.save()
+        return email
+
+    @classmethod
+    def claim_due(cls, limit: int, lease: timedelta) -> list:
+        """Claim up to `limit` emails due for sending.
+
+        Claimed emails are not due again before the lease expires, so an email whose sender crashed
+        is picked up again later, and two dispatchers never send the same email concurrently.
+        """
+        now = utcnow()
+        due = cls.query.filter(
+            cls.status.in_((cls.STATUS_PENDING, cls.STATUS_SENDING)),
+            cls.next_attempt_at <= now,
+        ).order_by(cls.next_attempt_at).limit(limit).all()
+        claimed = []
+        for email in due:
+            updated = cls.query.filter_by(id=email.id, next_attempt_at=email.next_attempt_at).update(
+                {'status': cls.STATUS_SENDING, 'next_attempt_at': now + lease},
+                synchronize_session=False,
+            )
+            if updated:
+                claimed.append(email.id)
+        db.session.commit()
+        return cls.query.filter(cls.id.in_(claimed)).all() if claimed else []
+
+    @classmethod
+    def prune(cls, before) -> int:
+        """Delete the sent and dead emails created before `before`, returns how many were deleted.
+        """
+        deleted = cls.query.filter(
+            cls.status.in_((cls.STATUS_SENT, cls.STATUS_DEAD)),
+            cls.created_at < before,
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    # Db instance methods
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
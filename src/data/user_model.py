@@ -1,8 +1,15 @@
 from data.extensions import db
 from uuid import uuid4
 from sqlalchemy import Integer, String
-from sqlalchemy.orm import Mapped, mapped_column
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
+import re
+from sqlalchemy.orm import Mapped, mapped_column, make_transient_to_detached
+from utils.password_hasher import password_hasher
+from utils.cache import LRUCache
+from data.conversation_model import Conversation
+
+# username -> column values of the user, used to resolve the JWT identity without a query
+user_cache = LRUCache(max_size=1024, ttl=60)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -16,15 +23,39 @@ class User(db.Model):
         return f'<User {self.username}>'
     
     def set_password(self, password: str) -> None:
-        self.password = generate_password_hash(password)
+        self.password = password_hasher.hash(password)
         
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password, password)
+        return password_hasher.verify(self.password, password)
+
+    def upgrade_password_hash(self, password: str) -> None:
+        """Hash the password again when the configured method or cost changed, after a successful login.
+        """
+        if password_hasher.needs_rehash(self.password):
+            self.set_password(password)
+            self.save()
     
     @classmethod
     def get_user_by_username(cls, username: str) -> 'User':
         return cls.query.filter_by(username=username).first()
 
+    @classmethod
+    def get_cached_user_by_username(cls, username: str) -> 'User':
+        """Same as get_user_by_username(), served from the user cache when possible.
+
+        The cached values are attached to the current session without querying the database, the
+        returned user can be modified, saved and deleted as usual.
+        """
+        values = user_cache.get(username)
+        if values is None:
+            user = cls.get_user_by_username(username)
+            if user is not None:
+                user_cache.set(username, {column.key: getattr(user, column.key) for column in cls.__table__.columns})
+            return user
+        user = cls(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     @classmethod
     def validate_password(cls, new_password: str) -> bool:
         if len(new_password) < 8:
@@ -43,13 +74,36 @@ class User(db.Model):
     @classmethod
     def get_user_by_email(cls, email: str) -> 'User':
         return cls.query.filter_by(email=email).first()
+
+    @classmethod
+    def get_duplicated_field(cls, error: IntegrityError, username: str) -> str:
+        """Tell which unique constraint ('username' or 'email') an insert violated.
+
+        The constraint is read from the database error (MySQL, SQLite or PostgreSQL formats); when it
+        cannot be, a single query on the username decides.
+        """
+        message = str(error.orig)
+        match = (
+            re.search(r"for key '(?:\w+\.)?(\w+)'", message)          # MySQL
+            or re.search(r"UNIQUE constraint failed: \w+\.(\w+)", message)  # SQLite
+            or re.search(r"Key \((\w+)\)=", message)                 # PostgreSQL
+        )
+        if match and match.group(1) in ('username', 'email'):
+            return match.group(1)
+        return 'username' if cls.get_user_by_username(username) else 'email'
     
     # Db instance methods
     
     def delete(self):
+        username = self.username
+        # Their threads are deleted upstream by the conversation janitor
+        Conversation.orphan_for_user(self.id)
         db.session.delete(self)
         db.session.commit()
+        user_cache.pop(username)
     
     def save(self):
+        username = self.username
         db.session.add(self)
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+        user_cache.pop(username)
\ No newline at end of file
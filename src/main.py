@@ -1,14 +1,39 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from data.extensions import db, jwt
 from api.admin import admin_bp
 from api.user import user_bp
 from api.assistant import assistant_bp
+from api.utils.ask_flow import ask_flight, async_ask_flight
+from api.utils.assistant_registry import assistant_registry
+from utils.openai_client import openai_client
+from utils.openai_recorder import openai_recorder
+from utils.metrics import metrics, stats_collector
+from utils.profiler import profiler
+from utils.circuit_breaker import CircuitOpenError, circuit_open_error, openai_breaker
+from werkzeug.exceptions import InternalServerError
+from werkzeug.middleware.proxy_fix import ProxyFix
+import openai
 from flask_cors import CORS
 from flask_jwt_extended import jwt_required, get_jwt
-from data.user_model import User
-from api.errors import AuthenticationErrors
+from data.user_model import User, user_cache
+from data.document_model import AssistantStore, Document
+from data.ingestion_job_model import IngestionJob
+from data.conversation_model import Conversation
+from data.outbox_model import OutboxEmail
+from data.ask_run_model import AskRun
+from utils.email_dispatcher import email_dispatcher
+from api.utils.ingestion_worker import ingestion_worker
+from api.utils.conversations import conversation_janitor
+from api.utils.ask_runs import ask_run_sweeper
+from api.utils.answer_cache import answer_cache
+from api.utils.search_index import search_index
+from api.utils.citations import filename_cache
+from api.errors import AuthenticationErrors, RequestErrors, ServerErrors
+from utils.admission import admission_controller, AdmissionRejected
+from utils.password_hasher import password_hasher, HashingUnavailable
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+import hmac
 import os
 from logging.config import dictConfig
 from itsdangerous import URLSafeTimedSerializer
@@ -35,6 +60,11 @@ def create_app():
     
     app = Flask(__name__)   
     app.config.from_prefixed_env()
+    
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is trusted for the client address
+    app.config.setdefault('PROXY_FIX_X_FOR', 0)
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
     allowed_origin = app.config.get('ALLOWED_ORIGIN')
     if allowed_origin:
         cors = CORS(app, resources={r"/api/*": {"origins": allowed_origin}})
@@ -56,12 +86,194 @@ def create_app():
     app.config['EMAIL_SERVICE_API_KEY'] = os.getenv('EMAIL_SERVICE_API_KEY')
     app.config['SUDO_PASSWORD'] = os.getenv('SUDO_PASSWORD')
     
+    # Seconds the assistants listing is cached before resolving a name goes upstream again, an unknown
+    # name refreshes it at most once every ASSISTANT_REGISTRY_MISS_REFRESH_INTERVAL seconds
+    app.config.setdefault('ASSISTANT_REGISTRY_TTL', 300)
+    app.config.setdefault('ASSISTANT_REGISTRY_MISS_REFRESH_INTERVAL', 10)
+    assistant_registry.configure(ttl=app.config['ASSISTANT_REGISTRY_TTL'], miss_refresh_interval=app.config['ASSISTANT_REGISTRY_MISS_REFRESH_INTERVAL'])
+    
+    # Prometheus metrics served by /metrics, METRICS_TOKEN requires it as a bearer token
+    app.config.setdefault('METRICS_ENABLED', False)
+    app.config.setdefault('METRICS_TOKEN', None)
+    metrics.init_app(app)
+    
+    # Sampling profiler, keeps the PROFILER_MAX_PROFILES slowest of the sampled requests and of the ones slower than
+    # PROFILER_SLOW_THRESHOLD seconds (None: only sampled ones), downloaded from /admin/profiles
+    app.config.setdefault('PROFILER_ENABLED', False)
+    app.config.setdefault('PROFILER_SAMPLE_RATE', 0.01)
+    app.config.setdefault('PROFILER_SLOW_THRESHOLD', 2.0)
+    app.config.setdefault('PROFILER_INTERVAL', 0.005)
+    app.config.setdefault('PROFILER_MAX_PROFILES', 20)
+    profiler.init_app(app)
+    
+    # Shared OpenAI client, its connection pool is sized on the waitress thread count (waitress default: 4)
+    app.config.setdefault('WAITRESS_THREADS', 4)
+    app.config.setdefault('OPENAI_MAX_CONNECTIONS', None)
+    app.config.setdefault('OPENAI_MAX_KEEPALIVE_CONNECTIONS', None)
+    app.config.setdefault('OPENAI_KEEPALIVE_EXPIRY', 30)
+    app.config.setdefault('OPENAI_CONNECT_TIMEOUT', 5)
+    app.config.setdefault('OPENAI_READ_TIMEOUT', 60)
+    app.config.setdefault('OPENAI_MAX_RETRIES', 2)
+    # Connections of the asyncio client, used by the ASGI serving mode (asgi.py)
+    app.config.setdefault('OPENAI_ASYNC_MAX_CONNECTIONS', 100)
+    # Read timeout per OpenAI operation, 'default' for the other ones. For streamed runs it bounds the wait between two events
+    app.config.setdefault('OPENAI_OPERATION_TIMEOUTS', {
+        'default': app.config['OPENAI_READ_TIMEOUT'],
+        'assistants.list': 10,
+        'assistants.retrieve': 10,
+        'threads.create': 15,
+        'threads.messages.create': 15,
+        'threads.messages.list': 15,
+        'threads.runs.create': 30,
+        'threads.runs.retrieve': 10,
+        'threads.runs.cancel': 10,
+        'files.retrieve': 10,
+        'files.create': 120,
+        'vector_stores.file_batches.create': 60,
+    })
+    # OpenAI calls fail fast with a 503 while most of the recent ones failed or were slow (more than slow_call_fraction
+    # of their timeout), then half_open_calls trial calls decide whether the breaker closes
+    app.config.setdefault('CIRCUIT_BREAKER_ENABLED', True)
+    app.config.setdefault('CIRCUIT_BREAKER', {
+        'window': 30,
+        'min_calls': 10,
+        'failure_ratio': 0.5,
+        'slow_call_ratio': 0.5,
+        'slow_call_fraction': 0.5,
+        'open_duration': 30,
+        'half_open_calls': 2,
+    })
+    openai_breaker.configure(**app.config['CIRCUIT_BREAKER'])
+    openai_breaker.enabled = app.config['CIRCUIT_BREAKER_ENABLED']
+    # Record the upstream OpenAI calls to a JSONL file, or answer them from one (see tools/openai_traffic_report.py)
+    app.config.setdefault('OPENAI_RECORD_PATH', None)
+    app.config.setdefault('OPENAI_RECORD_REDACT', True)
+    app.config.setdefault('OPENAI_REPLAY_PATH', None)
+    app.config.setdefault('OPENAI_REPLAY_LATENCY_SCALE', 1.0)
+    openai_recorder.init_app(app)
+    openai_client.init_app(app)
+    
+    # Background PDF indexing
+    app.config.setdefault('INGESTION_WORKERS', 2)
+    app.config.setdefault('INGESTION_MAX_PENDING', 16)
+    
+    # Upload limits, werkzeug stops reading a request body larger than MAX_CONTENT_LENGTH
+    app.config.setdefault('PDF_MAX_FILE_SIZE', 50 * 1024 * 1024)
+    app.config.setdefault('MAX_CONTENT_LENGTH', app.config['PDF_MAX_FILE_SIZE'] + 1024 * 1024)
+    app.config.setdefault('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    
+    # Local BM25 index of the uploaded PDFs, served by /ai/search without calling OpenAI
+    app.config.setdefault('SEARCH_INDEX_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], '.search_index'))
+    app.config.setdefault('SEARCH_CHUNK_WORDS', 120)
+    app.config.setdefault('SEARCH_CHUNK_OVERLAP', 30)
+    app.config.setdefault('SEARCH_MAX_RESULTS', 20)
+    search_index.init_app(app)
+    
+    # Optional cache of the answers to repeated questions
+    app.config.setdefault('ANSWER_CACHE_ENABLED', False)
+    app.config.setdefault('ANSWER_CACHE_MAX_ENTRIES', 512)
+    app.config.setdefault('ANSWER_CACHE_TTL', 86400)
+    answer_cache.configure(max_size=app.config['ANSWER_CACHE_MAX_ENTRIES'], ttl=app.config['ANSWER_CACHE_TTL'])
+    
+    # Identical questions in flight share a single run, followers wait at most ASK_COALESCE_WAIT seconds
+    app.config.setdefault('ASK_COALESCE_ENABLED', True)
+    app.config.setdefault('ASK_COALESCE_WAIT', 90)
+    
+    # Runs are cancelled upstream after ASK_RUN_TIMEOUT seconds (ASK_RUN_DEADLINE for the ones submitted with async,
+    # whose overdue runs are expired by a background sweep every ASK_RUN_SWEEP_INTERVAL seconds, 0: no sweep)
+    app.config.setdefault('ASK_RUN_TIMEOUT', 60)
+    app.config.setdefault('ASK_RUN_DEADLINE', 300)
+    app.config.setdefault('ASK_RUN_POLL_INTERVAL', 1)
+    app.config.setdefault('ASK_RUN_SWEEP_INTERVAL', 60)
+    
+    # /ai/ask-batch, questions per batch and runs in flight per batch
+    app.config.setdefault('ASK_BATCH_MAX_QUESTIONS', 50)
+    app.config.setdefault('ASK_BATCH_CONCURRENCY', 4)
+    
+    # Conversations idle for longer are closed and their threads deleted by a background sweep (0: no sweep)
+    app.config.setdefault('CONVERSATION_IDLE_TIMEOUT', 86400)
+    app.config.setdefault('CONVERSATION_SWEEP_INTERVAL', 300)
+    
+    # JWT identities resolved without a query, entries are dropped when the user is saved or deleted
+    app.config.setdefault('USER_CACHE_TTL', 60)
+    app.config.setdefault('USER_CACHE_MAX_ENTRIES', 1024)
+    user_cache.configure(max_size=app.config['USER_CACHE_MAX_ENTRIES'], ttl=app.config['USER_CACHE_TTL'])
+    
+    metrics.register_cache('assistant_registry', assistant_registry)
+    metrics.register_cache('answer', answer_cache)
+    metrics.register_cache('citation_filename', filename_cache)
+    metrics.register_cache('user', user_cache)
+    metrics.register_collector('circuit_breaker', stats_collector('openai_circuit_breaker', 'Circuit breaker of the OpenAI calls', openai_breaker.stats))
+    metrics.register_collector('ask_coalescing', stats_collector('ask_coalescing', 'Coalescing of identical questions', ask_flight.stats))
+    metrics.register_collector('async_ask_coalescing', stats_collector('async_ask_coalescing', 'Coalescing of identical questions in the ASGI serving mode', async_ask_flight.stats))
+    
+    # Password hashing runs in its own process pool, stored hashes are upgraded at login when the method changes
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config.setdefault('PASSWORD_HASH_SALT_LENGTH', 16)
+    app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 16)
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+    password_hasher.init_app(app)
+    
+    # Largest page returned by /admin/get-all
+    app.config.setdefault('ADMIN_MAX_PAGE_SIZE', 500)
+    
+    # Outbox emails, sent in the background with retries
+    app.config.setdefault('EMAIL_DISPATCHER_ENABLED', True)
+    app.config.setdefault('EMAIL_BATCH_SIZE', 20)
+    app.config.setdefault('EMAIL_POLL_INTERVAL', 5)
+    app.config.setdefault('EMAIL_CONNECT_TIMEOUT', 3)
+    app.config.setdefault('EMAIL_SEND_TIMEOUT', 10)
+    app.config.setdefault('EMAIL_MAX_ATTEMPTS', 6)
+    app.config.setdefault('EMAIL_RETRY_BASE_DELAY', 5)
+    app.config.setdefault('EMAIL_RETRY_MAX_DELAY', 600)
+    # Sent and dead emails are deleted after EMAIL_RETENTION seconds, checked every EMAIL_PRUNE_INTERVAL seconds
+    app.config.setdefault('EMAIL_RETENTION', 7 * 86400)
+    app.config.setdefault('EMAIL_PRUNE_INTERVAL', 3600)
+    
+    # Admission control of the expensive /ai endpoints, keyed by JWT identity (client address when anonymous).
+    # The ask cap leaves a waitress thread free for the other endpoints, the queue waits for a global slot.
+    app.config.setdefault('ADMISSION_ENABLED', True)
+    app.config.setdefault('ADMISSION_LIMITS', {
+        'ask': {
+            'max_in_flight': max(1, app.config['WAITRESS_THREADS'] - 1),
+            'per_user_in_flight': 2,
+            'rate': 0.5,
+            'burst': 5,
+            'queue_size': app.config['WAITRESS_THREADS'],
+            'queue_timeout': 2,
+        },
+        'ask-batch': {
+            'max_in_flight': 1,
+            'per_user_in_flight': 1,
+            'rate': 0.1,
+            'burst': 2,
+            'queue_size': 1,
+            'queue_timeout': 2,
+        },
+        'add-pdf': {
+            'max_in_flight': 1,
+            'per_user_in_flight': 1,
+            'rate': 0.2,
+            'burst': 5,
+            'queue_size': 2,
+            'queue_timeout': 5,
+        },
+    })
+    admission_controller.init_app(app)
+    
     cors = CORS(app)
     db.init_app(app)
     with app.app_context():
         app.logger.info('Creating all tables')
         db.create_all()
     jwt.init_app(app)
+    ingestion_worker.init_app(app)
+    email_dispatcher.init_app(app)
+    conversation_janitor.init_app(app)
+    ask_run_sweeper.init_app(app)
+    with app.app_context():
+        ingestion_worker.recover()
     
     # Register the blueprints  
     app.register_blueprint(user_bp, url_prefix='/user')
@@ -83,7 +295,7 @@ def create_app():
     @jwt.user_lookup_loader
     def user_lookup_callback(_jwt_headers, jwt_data):
         identity = jwt_data["sub"]
-        return User.query.filter_by(username=identity).one_or_none()
+        return User.get_cached_user_by_username(identity)
     
     # Error handling 
     @jwt.expired_token_loader
@@ -109,4 +321,51 @@ def create_app():
             'message': error[0],
             'error': error[1] 
         }), 401
+    
+    if app.config['METRICS_ENABLED']:
+        if not app.config['METRICS_TOKEN']:
+            app.logger.warning("METRICS_TOKEN is not set, /metrics is served to anyone")
+
+        @app.get('/metrics')
+        def metrics_endpoint():
+            token = app.config['METRICS_TOKEN']
+            if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+                error = AuthenticationErrors.get_error_instance(AuthenticationErrors.AUTH_REQUIRED)
+                return jsonify({
+                    'message': error[0],
+                    'error': error[1]
+                }), 401
+            return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    
+    @app.errorhandler(HashingUnavailable)
+    def hashing_unavailable_handler(e):
+        error = ServerErrors.get_error_instance(ServerErrors.SERVICE_UNAVAILABLE)
+        return jsonify({
+            'message': error[0],
+            'error': error[1]
+        }), 503, {'Retry-After': '1'}
+    
+    @app.errorhandler(CircuitOpenError)
+    def circuit_open_handler(e):
+        error = ServerErrors.get_error_instance(ServerErrors.UPSTREAM_UNAVAILABLE, exception=str(e))
+        return jsonify({
+            'message': error[0],
+            'error': error[1]
+        }), 503, {'Retry-After': e.retry_after_header()}
+    
+    @app.errorhandler(openai.InternalServerError)
+    def upstream_error_handler(e):
+        # The 503 made up by the circuit breaker, raised by a view without a catch-all
+        circuit_open = circuit_open_error(e)
+        if circuit_open is None:
+            return InternalServerError(original_exception=e)
+        return circuit_open_handler(circuit_open)
+    
+    @app.errorhandler(AdmissionRejected)
+    def admission_rejected_handler(e):
+        error = RequestErrors.get_error_instance(RequestErrors.TOO_MANY_REQUESTS, exception=e.reason)
+        return jsonify({
+            'message': error[0],
+            'error': error[1]
+        }), 429, {'Retry-After': e.retry_after_header()}
     return app
\ No newline at end of file
@@ -0,0 +1,222 @@
+import math
+import threading
+import time
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import g, make_response, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted, the client should retry after `retry_after` seconds.
+    """
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def retry_after_header(self) -> str:
+        """Whole seconds, at least 1, as expected by the Retry-After header.
+        """
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class _TokenBucket():
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token, return 0 on success or the seconds until the next token.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class _Gate():
+    """Admission state of one endpoint.
+    """
+    # Buckets are pruned once there are more than this many users
+    MAX_BUCKETS = 10000
+
+    def __init__(self, limits: dict):
+        self.max_in_flight = limits['max_in_flight']
+        self.per_user_in_flight = limits['per_user_in_flight']
+        self.rate = limits['rate']
+        self.burst = limits['burst']
+        self.queue_size = limits['queue_size']
+        self.queue_timeout = limits['queue_timeout']
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {'rate_limited': 0, 'user_limit': 0, 'queue_full': 0, 'queue_timeout': 0}
+        self.user_in_flight: Dict[str, int] = {}
+        self.buckets: Dict[str, _TokenBucket] = {}
+        self.condition = threading.Condition()
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected[reason] += 1
+        return AdmissionRejected(reason, retry_after)
+
+    def acquire(self, identity: str, rate_limited: bool = True) -> None:
+        with self.condition:
+            if self.rate and rate_limited:
+                bucket = self.buckets.get(identity)
+                if bucket is None:
+                    if len(self.buckets) >= self.MAX_BUCKETS:
+                        self.buckets = {key: value for key, value in self.buckets.items() if not value.is_full()}
+                    bucket = self.buckets[identity] = _TokenBucket(self.rate, self.burst)
+                wait = bucket.take()
+                if wait:
+                    raise self._reject('rate_limited', wait)
+
+            if self.user_in_flight.get(identity, 0) >= self.per_user_in_flight:
+                raise self._reject('user_limit', 1)
+
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.queue_size:
+                    raise self._reject('queue_full', 1)
+                self.waiting += 1
+                try:
+                    admitted = self.condition.wait_for(lambda: self.in_flight < self.max_in_flight, self.queue_timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    raise self._reject('queue_timeout', 1)
+                # The user may have started other requests while waiting
+                if self.user_in_flight.get(identity, 0) >= self.per_user_in_flight:
+                    self.condition.notify()
+                    raise self._reject('user_limit', 1)
+
+            self.in_flight += 1
+            self.user_in_flight[identity] = self.user_in_flight.get(identity, 0) + 1
+            self.admitted += 1
+
+    def release(self, identity: str) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            remaining = self.user_in_flight.get(identity, 1) - 1
+            if remaining:
+                self.user_in_flight[identity] = remaining
+            else:
+                self.user_in_flight.pop(identity, None)
+            self.condition.notify()
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'users_in_flight': len(self.user_in_flight),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'limits': {
+                    'max_in_flight': self.max_in_flight,
+                    'per_user_in_flight': self.per_user_in_flight,
+                    'rate': self.rate,
+                    'burst': self.burst,
+                    'queue_size': self.queue_size,
+                    'queue_timeout': self.queue_timeout,
+                },
+            }
+
+
+class AdmissionController():
+    """Limits the concurrency of the expensive endpoints, globally and per user.
+
+    Each endpoint has a global in-flight cap, a per-user in-flight cap, a per-user token bucket and
+    a short bounded queue of requests waiting for a global slot. Requests which cannot be admitted
+    are rejected with a 429 and a Retry-After header (see `admission_controlled`).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._gates: Dict[str, _Gate] = {}
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config['ADMISSION_ENABLED']
+        self._gates = {endpoint: _Gate(limits) for endpoint, limits in app.config['ADMISSION_LIMITS'].items()}
+        app.extensions['admission_controller'] = self
+
+    def acquire(self, endpoint: str, identity: str, rate_limited: bool = True) -> bool:
+        """Admit a request or raise AdmissionRejected. Returns False when the endpoint is not limited.
+
+        `rate_limited=False` skips the token bucket, for work already charged on another endpoint
+        (e.g. the questions of a batch) which must still count in the in-flight limits.
+        """
+        gate = self._gates.get(endpoint)
+        if not self.enabled or gate is None:
+            return False
+        gate.acquire(identity, rate_limited)
+        return True
+
+    def release(self, endpoint: str, identity: str) -> None:
+        self._gates[endpoint].release(identity)
+
+    def per_user_limit(self, endpoint: str) -> Optional[int]:
+        """The per_user_in_flight limit of an endpoint, None when it is not enforced.
+        """
+        gate = self._gates.get(endpoint)
+        if not self.enabled or gate is None:
+            return None
+        return gate.per_user_in_flight
+
+    def stats(self) -> dict:
+        return {endpoint: gate.stats() for endpoint, gate in self._gates.items()}
+
+
+admission_controller = AdmissionController()
+
+
+def request_identity() -> str:
+    """The JWT identity of the request, or its client address for anonymous requests.
+
+    The address is the one of the peer, X-Forwarded-For is only trusted through the proxies
+    declared with PROXY_FIX_X_FOR (see create_app()), a client cannot pick its own identity.
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None
+    if identity:
+        return f'user:{identity}'
+    return f'ip:{request.remote_addr}'
+
+
+def admission_controlled(endpoint: str):
+    """Decorator running a view only once admitted by the admission controller for `endpoint`.
+
+    The slot is released when the response is closed, so streamed responses keep it until they end.
+    A view called from another admitted view (e.g. a delegation) does not take a second slot.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.get('admission_ticket'):
+                return view(*args, **kwargs)
+            identity = request_identity()
+            if not admission_controller.acquire(endpoint, identity):
+                return view(*args, **kwargs)
+            g.admission_ticket = (endpoint, identity)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                admission_controller.release(endpoint, identity)
+                raise
+            response.call_on_close(lambda: admission_controller.release(endpoint, identity))
+            return response
+        return wrapper
+    return decorator
+
@@ -0,0 +1,282 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import httpx
+
+from utils.openai_recorder import classify_openai_request
+
+# Header of the responses made up by the breaker instead of calling OpenAI, see circuit_open_error()
+CIRCUIT_HEADER = 'x-circuit-breaker'
+
+
+class CircuitOpenError(Exception):
+    """The upstream API is considered down, the call was not sent. Retry after `retry_after` seconds.
+    """
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f'The circuit breaker of {name} is open, retry in {math.ceil(retry_after)} s')
+        self.name = name
+        self.retry_after = retry_after
+
+    def retry_after_header(self) -> str:
+        """Whole seconds, at least 1, as expected by the Retry-After header.
+        """
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def circuit_open_error(exception: BaseException) -> Optional[CircuitOpenError]:
+    """The CircuitOpenError behind an exception raised by the OpenAI client, None for other errors.
+
+    The client turns the 503 made up by the breaker into an openai.InternalServerError, whose
+    response carries the breaker headers.
+    """
+    if isinstance(exception, CircuitOpenError):
+        return exception
+    response = getattr(exception, 'response', None)
+    if isinstance(response, httpx.Response) and CIRCUIT_HEADER in response.headers:
+        return CircuitOpenError(response.headers[CIRCUIT_HEADER], float(response.headers.get('retry-after', 1)))
+    return None
+
+
+def raise_if_circuit_open(exception: BaseException) -> None:
+    """Re-raise an open circuit as CircuitOpenError, for the views catching every exception.
+    """
+    error = circuit_open_error(exception)
+    if error is not None:
+        raise error from exception
+
+
+class CircuitBreaker():
+    """Stops calling an upstream API while most of its recent calls fail or are slow.
+
+    closed: calls go through, their outcomes are kept for `window` seconds. Once at least `min_calls`
+        were made, the breaker opens when `failure_ratio` of them failed (connection errors, timeouts,
+        429 and 5xx statuses) or `slow_call_ratio` of them were slow, i.e. used more than
+        `slow_call_fraction` of the timeout of their operation.
+    open: calls fail immediately for `open_duration` seconds.
+    half-open: up to `half_open_calls` trial calls go through, the breaker closes when they all
+        succeed and opens again on the first failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window: float = 30, min_calls: int = 10, failure_ratio: float = 0.5,
+                 slow_call_ratio: float = 0.5, slow_call_fraction: float = 0.5, open_duration: float = 30,
+                 half_open_calls: int = 2):
+        self.name = name
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.configure(window, min_calls, failure_ratio, slow_call_ratio, slow_call_fraction, open_duration, half_open_calls)
+
+    def configure(self, window: float, min_calls: int, failure_ratio: float, slow_call_ratio: float,
+                  slow_call_fraction: float, open_duration: float, half_open_calls: int) -> None:
+        """Set the thresholds, and close the breaker.
+        """
+        with self._lock:
+            self.window = window
+            self.min_calls = min_calls
+            self.failure_ratio = failure_ratio
+            self.slow_call_ratio = slow_call_ratio
+            self.slow_call_fraction = slow_call_fraction
+            self.open_duration = open_duration
+            self.half_open_calls = half_open_calls
+            self._close()
+            self.trips = 0
+            self.rejected = 0
+            self.last_error: Optional[str] = None
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self.opened_at: Optional[float] = None
+        self._outcomes: deque = deque()
+        self._failures = 0
+        self._slow_calls = 0
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, failed, slow = self._outcomes.popleft()
+            self._failures -= failed
+            self._slow_calls -= slow
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError when the call must not be sent. Returns whether it is a half-open trial.
+        """
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.open_duration - now
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._trials_in_flight + self._trial_successes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 1)
+                self._trials_in_flight += 1
+                return True
+            return False
+
+    def record(self, trial: bool, failed: bool, slow: bool, error: Optional[str] = None) -> None:
+        """Count the outcome of a call let through by before_call().
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if failed:
+                self.last_error = error
+            if trial:
+                self._trials_in_flight = max(0, self._trials_in_flight - 1)
+                if self.state != self.HALF_OPEN:
+                    return
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self._close()
+                return
+            if self.state != self.CLOSED:
+                # Sent before the breaker opened
+                return
+            self._outcomes.append((now, failed, slow))
+            self._failures += failed
+            self._slow_calls += slow
+            self._prune(now)
+            calls = len(self._outcomes)
+            if calls >= self.min_calls and (self._failures >= self.failure_ratio * calls or self._slow_calls >= self.slow_call_ratio * calls):
+                self._open(now)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            return {
+                'enabled': self.enabled,
+                'state': self.state,
+                'open': int(self.state != self.CLOSED),
+                'retry_after': max(0.0, round(self.opened_at + self.open_duration - now, 2)) if self.state == self.OPEN else 0.0,
+                'calls': len(self._outcomes),
+                'failures': self._failures,
+                'slow_calls': self._slow_calls,
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'last_error': self.last_error,
+                'thresholds': {
+                    'window': self.window,
+                    'min_calls': self.min_calls,
+                    'failure_ratio': self.failure_ratio,
+                    'slow_call_ratio': self.slow_call_ratio,
+                    'slow_call_fraction': self.slow_call_fraction,
+                    'open_duration': self.open_duration,
+                    'half_open_calls': self.half_open_calls,
+                },
+            }
+
+
+class _Guard():
+    """What CircuitBreakerTransport and its async flavour share: the timeouts and the outcomes.
+    """
+
+    def __init__(self, breaker: CircuitBreaker, timeouts: Dict[str, float], connect_timeout: float):
+        self.breaker = breaker
+        self.timeouts = timeouts
+        self.connect_timeout = connect_timeout
+
+    def prepare(self, request: httpx.Request) -> bool:
+        timeout = self.timeouts.get(classify_openai_request(request.method, request.url.path), self.timeouts.get('default'))
+        if timeout is not None:
+            request.extensions['timeout'] = httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout)).as_dict()
+        return self.breaker.before_call()
+
+    def _timeout(self, request: httpx.Request) -> Optional[float]:
+        return request.extensions.get('timeout', {}).get('read')
+
+    def rejection(self, request: httpx.Request, error: CircuitOpenError) -> httpx.Response:
+        # Not retried by the OpenAI client (x-should-retry), raised as openai.InternalServerError
+        return httpx.Response(503, headers={
+            CIRCUIT_HEADER: self.breaker.name,
+            'retry-after': error.retry_after_header(),
+            'x-should-retry': 'false',
+        }, json={'error': {'message': str(error), 'type': 'circuit_open', 'code': 'circuit_open', 'param': None}}, request=request)
+
+    def record(self, request: httpx.Request, trial: bool, started: float, response: Optional[httpx.Response], error: Optional[Exception]) -> None:
+        failed = error is not None or response.status_code == 429 or response.status_code >= 500
+        detail = repr(error) if error is not None else (f'HTTP {response.status_code}' if failed else None)
+        timeout = self._timeout(request)
+        slow = timeout is not None and time.monotonic() - started > self.breaker.slow_call_fraction * timeout
+        self.breaker.record(trial, failed, slow, detail)
+
+
+class CircuitBreakerTransport(httpx.BaseTransport):
+    """Applies the per-operation timeouts and the circuit breaker to the calls of the OpenAI client.
+
+    The duration is the one to the response headers, streamed bodies (SSE runs) are bounded by the
+    read timeout between two chunks instead.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, breaker: CircuitBreaker, timeouts: Dict[str, float], connect_timeout: float):
+        self._transport = transport
+        self._guard = _Guard(breaker, timeouts, connect_timeout)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            trial = self._guard.prepare(request)
+        except CircuitOpenError as e:
+            return self._guard.rejection(request, e)
+        started = time.monotonic()
+        try:
+            response = self._transport.handle_request(request)
+        except Exception as e:
+            self._guard.record(request, trial, started, None, e)
+            raise
+        self._guard.record(request, trial, started, response, None)
+        return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncCircuitBreakerTransport(httpx.AsyncBaseTransport):
+    """CircuitBreakerTransport of the asyncio client (ASGI serving mode), sharing the same breaker.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker, timeouts: Dict[str, float], connect_timeout: float):
+        self._transport = transport
+        self._guard = _Guard(breaker, timeouts, connect_timeout)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            trial = self._guard.prepare(request)
+        except CircuitOpenError as e:
+            return self._guard.rejection(request, e)
+        started = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception as e:
+            self._guard.record(request, trial, started, None, e)
+            raise
+        self._guard.record(request, trial, started, response, None)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+openai_breaker = CircuitBreaker('openai')
@@ -0,0 +1,152 @@
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from data.extensions import db
+from data.outbox_model import OutboxEmail
+from data.document_model import utcnow
+
+
+class EmailDispatcher():
+    """Background sender of the emails written to the outbox table.
+
+    A daemon thread sends the due emails in batches over a pooled HTTP session, with timeouts.
+    Failed sends are retried with an exponential backoff, up to EMAIL_MAX_ATTEMPTS, after which
+    the email is marked dead. `run_once()` performs a single pass, without the thread.
+
+    Secrets (API key, reset links) are never written to the outbox: the payload builder registered
+    for the endpoint completes the stored payload at send time. Once an email is sent or dead its
+    payload is erased, and the row is deleted EMAIL_RETENTION seconds later.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+        self._session = None
+        self._builders: Dict[str, Callable[[dict], dict]] = {}
+        self._last_prune = 0.0
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=app.config['EMAIL_BATCH_SIZE'])
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update({'Content-Type': 'application/json'})
+        app.extensions['email_dispatcher'] = self
+        if app.config['EMAIL_DISPATCHER_ENABLED'] and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='email-dispatcher', daemon=True)
+            self._thread.start()
+
+    def register_payload_builder(self, endpoint: str, builder: Callable[[dict], dict]) -> None:
+        """Complete the payloads of the emails sent to `endpoint`, called at send time within an app context.
+        """
+        self._builders[endpoint] = builder
+
+    def notify(self) -> None:
+        """Wake the dispatcher up, an email was just enqueued.
+        """
+        self._wakeup.set()
+
+    def _loop(self) -> None:
+        while True:
+            self._wakeup.wait(self.app.config['EMAIL_POLL_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                # Keep going while full batches are found
+                while self.run_once() == self.app.config['EMAIL_BATCH_SIZE']:
+                    pass
+                if time.monotonic() - self._last_prune >= self.app.config['EMAIL_PRUNE_INTERVAL']:
+                    self._last_prune = time.monotonic()
+                    self.prune()
+            except Exception as e:
+                self.app.logger.error(f"Email dispatcher pass failed: {str(e)}")
+
+    def run_once(self) -> int:
+        """Send one batch of due emails.
+
+        Returns:
+            int: the number of emails handled (sent or rescheduled).
+        """
+        config = self.app.config
+        with self.app.app_context():
+            try:
+                emails = OutboxEmail.claim_due(
+                    limit=config['EMAIL_BATCH_SIZE'],
+                    lease=timedelta(seconds=config['EMAIL_SEND_TIMEOUT'] * 2 + config['EMAIL_CONNECT_TIMEOUT']),
+                )
+                for email in emails:
+                    self._send(email)
+                    db.session.commit()
+                return len(emails)
+            finally:
+                db.session.remove()
+
+    def prune(self) -> int:
+        """Delete the sent and dead emails older than EMAIL_RETENTION seconds.
+
+        Returns:
+            int: the number of emails deleted.
+        """
+        with self.app.app_context():
+            try:
+                return OutboxEmail.prune(utcnow() - timedelta(seconds=self.app.config['EMAIL_RETENTION']))
+            finally:
+                db.session.remove()
+
+    def _send(self, email: OutboxEmail) -> None:
+        config = self.app.config
+        payload = email.get_payload()
+        builder = self._builders.get(email.endpoint)
+        if builder is not None:
+            payload = builder(payload)
+        # The API key is added at send time, it is never written to the outbox
+        payload['token'] = config['EMAIL_SERVICE_API_KEY']
+        email.attempts += 1
+        try:
+            response = self._session.post(
+                config['EMAIL_SERVICE_URL'] + email.endpoint,
+                json=payload,
+                timeout=(config['EMAIL_CONNECT_TIMEOUT'], config['EMAIL_SEND_TIMEOUT']),
+            )
+            if response.status_code == 200:
+                email.status = OutboxEmail.STATUS_SENT
+                email.sent_at = utcnow()
+                email.last_error = None
+                email.erase_payload()
+                self.sent += 1
+                return
+            error = f"HTTP {response.status_code}: {response.text[:500]}"
+        except requests.RequestException as e:
+            error = str(e)
+
+        email.last_error = error
+        self.failed += 1
+        if email.attempts >= config['EMAIL_MAX_ATTEMPTS']:
+            email.status = OutboxEmail.STATUS_DEAD
+            email.erase_payload()
+            self.dead += 1
+            self.app.logger.error(f"Email {email.id} dead after {email.attempts} attempts: {error}")
+            return
+        delay = min(config['EMAIL_RETRY_BASE_DELAY'] * 2 ** (email.attempts - 1), config['EMAIL_RETRY_MAX_DELAY'])
+        email.status = OutboxEmail.STATUS_PENDING
+        email.next_attempt_at = utcnow() + timedelta(seconds=delay)
+        self.app.logger.warning(f"Email {email.id} failed (attempt {email.attempts}), retrying in {delay}s: {error}")
+
+    def stats(self) -> dict:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'dead': self.dead,
+        }
+
+
+email_dispatcher = EmailDispatcher()
@@ -0,0 +1,375 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.openai_recorder import classify_openai_request
+
+# Seconds, from a cached lookup to an assistant run
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Sample of the request being served, in a Flask request or an ASGI endpoint (and its worker threads)
+_current_request: ContextVar[Optional['RequestSample']] = ContextVar('metrics_request', default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _quote(value) -> str:
+    return '"' + _escape(value) + '"'
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}={_quote(value)}' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric():
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in values]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Histogram with fixed buckets, `observe()` only increments one bucket, the cumulative counts
+    expected by Prometheus are computed when rendering.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = self._header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, "le=%s" % _quote(bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class RequestSample():
+    """Measures of one request, from `MetricsRegistry.start_request()` to `end_request()`.
+    """
+    __slots__ = ('started', 'blueprint', 'route', 'queries', 'query_time', 'status', 'forwarded')
+
+    def __init__(self, blueprint: str, route: str):
+        self.started = time.perf_counter()
+        self.blueprint = blueprint
+        self.route = route
+        self.queries = 0
+        self.query_time = 0.0
+        self.status: Optional[int] = None
+        # Handed over to another instrumented app, which records the request itself
+        self.forwarded = False
+
+
+class ASGIRequestMetrics():
+    """ASGI wrapper recording the requests of an endpoint served outside of Flask (see asgi.py),
+    under the same metrics as the Flask requests.
+
+    `blueprint` and `route` are the labels of the Flask view it stands for, e.g. 'ai' and '/ai/ask'.
+    """
+
+    def __init__(self, app, registry: 'MetricsRegistry', blueprint: str, route: str):
+        self.app = app
+        self.registry = registry
+        self.blueprint = blueprint
+        self.route = route
+
+    async def __call__(self, scope, receive, send):
+        if not self.registry.enabled or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        sample = self.registry.start_request(self.blueprint, self.route)
+        token = _current_request.set(sample)
+
+        async def send_and_record(message):
+            if message['type'] == 'http.response.start':
+                sample.status = message['status']
+            await send(message)
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            _current_request.reset(token)
+            self.registry.end_request(sample, scope['method'])
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """Times the OpenAI calls per operation. The time is the one to the response headers, the body
+    of streamed responses (SSE runs) is read by the caller afterwards.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, registry: 'MetricsRegistry'):
+        self._transport = transport
+        self._registry = registry
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        operation = classify_openai_request(request.method, request.url.path)
+        started = time.perf_counter()
+        status = 'error'
+        self._registry.openai_in_flight.inc()
+        try:
+            response = self._transport.handle_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            self._registry.openai_in_flight.dec()
+            self._registry.openai_duration.observe(time.perf_counter() - started, operation)
+            self._registry.openai_requests.inc(operation, status)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncInstrumentedTransport(httpx.AsyncBaseTransport):
+    """InstrumentedTransport of the asyncio client (ASGI serving mode).
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, registry: 'MetricsRegistry'):
+        self._transport = transport
+        self._registry = registry
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        operation = classify_openai_request(request.method, request.url.path)
+        started = time.perf_counter()
+        status = 'error'
+        self._registry.openai_in_flight.inc()
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            self._registry.openai_in_flight.dec()
+            self._registry.openai_duration.observe(time.perf_counter() - started, operation)
+            self._registry.openai_requests.inc(operation, status)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class MetricsRegistry():
+    """Process-wide metrics, exported in the Prometheus text format by GET /metrics.
+
+    Covers the requests (latency, status codes, in flight) per blueprint and route, the OpenAI
+    calls per operation, the SQL queries per request and the hit ratios of the in-process caches.
+    Recording a sample takes a lock and a few dict operations, the aggregation is done when scraping.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._listening = False
+        self._caches: Dict[str, object] = {}
+        self._collectors: Dict[str, Callable[[], List[str]]] = {}
+        self.requests = Counter('http_requests_total', 'Requests served, by route and status code', ('blueprint', 'route', 'method', 'status'))
+        self.request_duration = Histogram('http_request_duration_seconds', 'Time to serve a request', ('blueprint', 'route', 'method'))
+        self.requests_in_flight = Gauge('http_requests_in_flight', 'Requests being served', ('blueprint',))
+        self.openai_requests = Counter('openai_requests_total', 'Calls to the OpenAI API, by operation and status code', ('operation', 'status'))
+        self.openai_duration = Histogram('openai_request_duration_seconds', 'Time to the response headers of an OpenAI call', ('operation',))
+        self.openai_in_flight = Gauge('openai_requests_in_flight', 'OpenAI calls waiting for their response headers')
+        self.db_queries = Counter('db_queries_total', 'SQL statements executed, by kind', ('kind',))
+        self.db_duration = Histogram('db_query_duration_seconds', 'Time to execute an SQL statement', ('kind',))
+        self.db_queries_per_request = Histogram('db_queries_per_request', 'SQL statements executed while serving a request', ('route',), QUERY_COUNT_BUCKETS)
+        self.db_time_per_request = Histogram('db_time_per_request_seconds', 'Time spent in SQL statements while serving a request', ('route',))
+        self._metrics = [
+            self.requests, self.request_duration, self.requests_in_flight,
+            self.openai_requests, self.openai_duration, self.openai_in_flight,
+            self.db_queries, self.db_duration, self.db_queries_per_request, self.db_time_per_request,
+        ]
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config['METRICS_ENABLED']
+        if self.enabled:
+            app.before_request(self._before_request)
+            app.after_request(self._after_request)
+            app.teardown_request(self._teardown_request)
+            if not self._listening:
+                # Every engine of the process, the listeners are registered once per process
+                event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+                self._listening = True
+        app.extensions['metrics'] = self
+
+    def register_cache(self, name: str, cache) -> None:
+        """Export the hits, misses and size of a cache having a `stats()` method (LRUCache, AssistantRegistry).
+        """
+        self._caches[name] = cache
+
+    def register_collector(self, name: str, collector: Callable[[], List[str]]) -> None:
+        """Add lines to the export, the collector is called on every scrape.
+        """
+        self._collectors[name] = collector
+
+    def transport(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        return InstrumentedTransport(transport, self) if self.enabled else transport
+
+    def async_transport(self, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        return AsyncInstrumentedTransport(transport, self) if self.enabled else transport
+
+    def asgi(self, app, blueprint: str, route: str):
+        return ASGIRequestMetrics(app, self, blueprint, route)
+
+    # Requests
+
+    def start_request(self, blueprint: str, route: str) -> RequestSample:
+        self.requests_in_flight.inc(blueprint)
+        return RequestSample(blueprint, route)
+
+    def end_request(self, sample: RequestSample, method: str) -> None:
+        self.requests_in_flight.dec(sample.blueprint)
+        if sample.forwarded:
+            return
+        # Without a status no response was built, the exception turned into a 500
+        self.requests.inc(sample.blueprint, sample.route, method, str(sample.status or 500))
+        self.request_duration.observe(time.perf_counter() - sample.started, sample.blueprint, sample.route, method)
+        self.db_queries_per_request.observe(sample.queries, sample.route)
+        self.db_time_per_request.observe(sample.query_time, sample.route)
+
+    def forward_request(self) -> None:
+        """Leave the current request to the app it is handed over to, so that it is counted once.
+        """
+        sample = _current_request.get()
+        if sample is not None:
+            sample.forwarded = True
+
+    def _before_request(self):
+        blueprint = request.blueprint or ''
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        g.metrics_request = self.start_request(blueprint, route)
+        _current_request.set(g.metrics_request)
+
+    def _after_request(self, response):
+        sample = g.get('metrics_request')
+        if sample is not None:
+            sample.status = response.status_code
+        return response
+
+    def _teardown_request(self, exception):
+        sample = g.get('metrics_request')
+        if sample is None:
+            return
+        _current_request.set(None)
+        self.end_request(sample, request.method)
+
+    # SQL statements
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        self.db_queries.inc(kind)
+        self.db_duration.observe(elapsed, kind)
+        sample = _current_request.get()
+        if sample is not None:
+            sample.queries += 1
+            sample.query_time += elapsed
+
+    # Export
+
+    def _render_caches(self) -> List[str]:
+        metrics = {
+            'cache_hits_total': Counter('cache_hits_total', 'Lookups answered by an in-process cache', ('cache',)),
+            'cache_misses_total': Counter('cache_misses_total', 'Lookups an in-process cache could not answer', ('cache',)),
+            'cache_entries': Gauge('cache_entries', 'Entries held by an in-process cache', ('cache',)),
+            'cache_hit_ratio': Gauge('cache_hit_ratio', 'Share of the lookups answered by an in-process cache', ('cache',)),
+        }
+        for name, cache in self._caches.items():
+            stats = cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            metrics['cache_hits_total'].inc(name, amount=stats['hits'])
+            metrics['cache_misses_total'].inc(name, amount=stats['misses'])
+            metrics['cache_entries'].set(name, value=stats['size'])
+            metrics['cache_hit_ratio'].set(name, value=stats['hits'] / lookups if lookups else 0.0)
+        return [line for metric in metrics.values() for line in metric.render()]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(self._render_caches())
+        for collector in self._collectors.values():
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+def stats_collector(prefix: str, documentation: str, stats: Callable[[], dict]) -> Callable[[], List[str]]:
+    """Collector exporting the numbers of a `stats()` dict as gauges named `<prefix>_<key>`.
+    """
+    def collect() -> List[str]:
+        lines = []
+        for key, value in stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauge = Gauge(f'{prefix}_{key}', f'{documentation}: {key}')
+                gauge.set(value=value)
+                lines.extend(gauge.render())
+        return lines
+    return collect
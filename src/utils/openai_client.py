@@ -0,0 +1,119 @@
+import threading
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from utils.circuit_breaker import AsyncCircuitBreakerTransport, CircuitBreakerTransport, openai_breaker
+from utils.metrics import metrics
+from utils.openai_recorder import openai_recorder
+
+
+class OpenAIClientManager():
+    """Holds a single OpenAI client per process, shared by every request and waitress thread.
+
+    The client is built lazily on first use from the configuration read in `init_app()`. Its httpx
+    connection pool keeps idle connections alive, so consecutive requests reuse the same TLS
+    sessions instead of opening new ones. Both `OpenAI` and `httpx.Client` are thread safe.
+
+    Every call gets the timeout of its operation (OPENAI_OPERATION_TIMEOUTS) and goes through the
+    circuit breaker of utils/circuit_breaker.py, which fails fast while OpenAI is degraded.
+    """
+
+    def __init__(self):
+        self._config: dict = {}
+        self._client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        threads = app.config.get('WAITRESS_THREADS')
+        self._config = {
+            'api_key':             app.config.get('OPENAI_API_KEY'),
+            'base_url':            app.config.get('OPENAI_BASE_URL'),
+            'max_connections':     app.config.get('OPENAI_MAX_CONNECTIONS') or threads,
+            'max_keepalive':       app.config.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS') or threads,
+            'keepalive_expiry':    app.config.get('OPENAI_KEEPALIVE_EXPIRY'),
+            'connect_timeout':     app.config.get('OPENAI_CONNECT_TIMEOUT'),
+            'read_timeout':        app.config.get('OPENAI_READ_TIMEOUT'),
+            'max_retries':         app.config.get('OPENAI_MAX_RETRIES'),
+            'async_max_connections': app.config.get('OPENAI_ASYNC_MAX_CONNECTIONS'),
+            'operation_timeouts':  app.config.get('OPENAI_OPERATION_TIMEOUTS'),
+        }
+        self.close()
+        app.extensions['openai_client'] = self
+
+    def _build_http_client(self) -> httpx.Client:
+        limits = httpx.Limits(
+            max_connections=self._config['max_connections'],
+            max_keepalive_connections=self._config['max_keepalive'],
+            keepalive_expiry=self._config['keepalive_expiry'],
+        )
+        # The limits of the client are ignored when a transport is given, the transport gets them instead
+        transport = openai_recorder.transport(limits) or httpx.HTTPTransport(limits=limits)
+        transport = CircuitBreakerTransport(transport, openai_breaker, self._config['operation_timeouts'], self._config['connect_timeout'])
+        return httpx.Client(
+            limits=limits,
+            transport=metrics.transport(transport),
+            timeout=httpx.Timeout(
+                self._config['read_timeout'],
+                connect=self._config['connect_timeout'],
+            ),
+        )
+
+    def get_async(self) -> AsyncOpenAI:
+        """Return the shared asyncio client, used by the ASGI serving mode (see asgi.py).
+
+        It must be used from a single event loop, the one of the ASGI server. Its pool is sized for
+        many concurrent requests instead of the waitress thread count.
+        """
+        if self._async_client is None:
+            limits = httpx.Limits(
+                max_connections=self._config['async_max_connections'],
+                max_keepalive_connections=self._config['async_max_connections'],
+                keepalive_expiry=self._config['keepalive_expiry'],
+            )
+            self._async_client = AsyncOpenAI(
+                api_key=self._config.get('api_key'),
+                base_url=self._config.get('base_url'),
+                max_retries=self._config.get('max_retries'),
+                http_client=httpx.AsyncClient(
+                    transport=metrics.async_transport(AsyncCircuitBreakerTransport(
+                        httpx.AsyncHTTPTransport(limits=limits),
+                        openai_breaker,
+                        self._config['operation_timeouts'],
+                        self._config['connect_timeout'],
+                    )),
+                    timeout=httpx.Timeout(
+                        self._config['read_timeout'],
+                        connect=self._config['connect_timeout'],
+                    ),
+                ),
+            )
+        return self._async_client
+
+    def get(self) -> OpenAI:
+        """Return the shared client, creating it on first use.
+        """
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                self._client = OpenAI(
+                    api_key=self._config.get('api_key'),
+                    base_url=self._config.get('base_url'),
+                    max_retries=self._config.get('max_retries'),
+                    http_client=self._build_http_client(),
+                )
+            return self._client
+
+    def close(self) -> None:
+        """Close the pooled connections, a new client is built on the next `get()`.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+openai_client = OpenAIClientManager()
@@ -0,0 +1,353 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from flask import g, has_request_context, request
+
+
+# Method, path relative to the API root, operation
+_OPERATIONS = [
+    ('GET',    r'/assistants',                                   'assistants.list'),
+    ('POST',   r'/assistants',                                   'assistants.create'),
+    ('GET',    r'/assistants/[^/]+',                             'assistants.retrieve'),
+    ('POST',   r'/assistants/[^/]+',                             'assistants.update'),
+    ('DELETE', r'/assistants/[^/]+',                             'assistants.delete'),
+    ('POST',   r'/threads',                                      'threads.create'),
+    ('GET',    r'/threads/[^/]+',                                'threads.retrieve'),
+    ('DELETE', r'/threads/[^/]+',                                'threads.delete'),
+    ('POST',   r'/threads/[^/]+/messages',                       'threads.messages.create'),
+    ('GET',    r'/threads/[^/]+/messages',                       'threads.messages.list'),
+    ('POST',   r'/threads/[^/]+/runs',                           'threads.runs.create'),
+    ('GET',    r'/threads/[^/]+/runs/[^/]+',                     'threads.runs.retrieve'),
+    ('POST',   r'/threads/[^/]+/runs/[^/]+/cancel',              'threads.runs.cancel'),
+    ('POST',   r'/files',                                        'files.create'),
+    ('GET',    r'/files/[^/]+',                                  'files.retrieve'),
+    ('DELETE', r'/files/[^/]+',                                  'files.delete'),
+    ('POST',   r'/vector_stores',                                'vector_stores.create'),
+    ('DELETE', r'/vector_stores/[^/]+',                          'vector_stores.delete'),
+    ('DELETE', r'/vector_stores/[^/]+/files/[^/]+',              'vector_stores.files.delete'),
+    ('POST',   r'/vector_stores/[^/]+/file_batches',             'vector_stores.file_batches.create'),
+    ('GET',    r'/vector_stores/[^/]+/file_batches/[^/]+',       'vector_stores.file_batches.retrieve'),
+    ('GET',    r'/vector_stores/[^/]+/file_batches/[^/]+/files', 'vector_stores.file_batches.list_files'),
+]
+_OPERATION_PATTERNS = [(method, re.compile(pattern + '$'), operation) for method, pattern, operation in _OPERATIONS]
+
+# Keys whose values are user content or customer names (assistants, vector stores, documents), see redact()
+REDACTED_KEYS = ('content', 'value', 'instructions', 'question', 'questions', 'query', 'name', 'description', 'assistant_name')
+# Keys of file names, redacted with their extension kept so that replayed uploads are still accepted
+REDACTED_FILENAME_KEYS = ('filename',)
+
+
+def api_path(path: str) -> str:
+    """The path relative to the API root, e.g. /v1/threads/x -> /threads/x.
+    """
+    path = path.split('?', 1)[0]
+    index = path.find('/v1/')
+    return path[index + 3:] if index >= 0 else path
+
+
+def classify_openai_request(method: str, path: str) -> str:
+    """Name the OpenAI operation of a request, after the client method, e.g. 'threads.runs.retrieve'.
+    """
+    path = api_path(path).rstrip('/')
+    for operation_method, pattern, operation in _OPERATION_PATTERNS:
+        if method == operation_method and pattern.match(path):
+            return operation
+    return 'other'
+
+
+def _redact_value(value):
+    if isinstance(value, str):
+        return f'[redacted:{hashlib.sha256(value.encode()).hexdigest()[:12]}]'
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return [_redact_value(item) for item in value]
+    return redact(value)
+
+
+def _redact_filename(value):
+    if not isinstance(value, str):
+        return redact(value)
+    extension = os.path.splitext(value)[1]
+    return _redact_value(value) + (extension if extension[1:].isalnum() else '')
+
+
+def redact(data):
+    """Replace the user content of a JSON value (questions, messages, instructions, names, descriptions
+    and file names) by a hash of it.
+    """
+    if isinstance(data, dict):
+        return {
+            key: _redact_value(value) if key in REDACTED_KEYS else _redact_filename(value) if key in REDACTED_FILENAME_KEYS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [redact(item) for item in data]
+    return data
+
+
+def _redact_body(body: str, content_type: str) -> str:
+    if 'text/event-stream' in content_type:
+        lines = []
+        for line in body.split('\n'):
+            if line.startswith('data: ') and line[6:].startswith('{'):
+                line = 'data: ' + json.dumps(redact(json.loads(line[6:])))
+            lines.append(line)
+        return '\n'.join(lines)
+    try:
+        return json.dumps(redact(json.loads(body)))
+    except ValueError:
+        return body
+
+
+def _describe_upload(request: httpx.Request, body: bytes) -> Optional[dict]:
+    """Filename, size and SHA-256 of the file of a multipart upload (files.create).
+    """
+    match = re.search(r'boundary=([^;]+)', request.headers.get('content-type', ''))
+    if not match:
+        return None
+    for part in body.split(b'--' + match.group(1).strip('"').encode()):
+        head, _, content = part.partition(b'\r\n\r\n')
+        filename = re.search(rb'filename="([^"]*)"', head)
+        if filename:
+            content = content[:-2] if content.endswith(b'\r\n') else content
+            return {
+                'filename': filename.group(1).decode('utf-8', 'replace'),
+                'bytes': len(content),
+                'sha256': hashlib.sha256(content).hexdigest(),
+            }
+    return None
+
+
+def load_recording(path: str) -> List[dict]:
+    with open(path) as stream:
+        return [json.loads(line) for line in stream if line.strip()]
+
+
+class _RecordedStream(httpx.SyncByteStream):
+    """Pass the response body through, then record it once the client closed the response.
+    """
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._chunks = []
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._chunks.append(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close:
+                on_close(b''.join(self._chunks))
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, recorder: 'OpenAIRecorder'):
+        self._transport = transport
+        self._recorder = recorder
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        trace, route = self._recorder.current_trace()
+        started = time.monotonic()
+        body = request.read()
+        operation = classify_openai_request(request.method, request.url.path)
+        response = self._transport.handle_request(request)
+
+        def record(response_body: bytes):
+            content_type = response.headers.get('content-type', '')
+            entry = {
+                'type': 'upstream',
+                'trace': trace,
+                'route': route,
+                'started': round(started - self._recorder.started, 6),
+                'duration': round(time.monotonic() - started, 6),
+                'method': request.method,
+                'path': api_path(request.url.path),
+                'query': request.url.query.decode(),
+                'operation': operation,
+                'status': response.status_code,
+                'content_type': content_type,
+            }
+            if operation == 'files.create':
+                entry['upload'] = self._recorder.redact_data(_describe_upload(request, body))
+            elif body:
+                entry['request'] = self._recorder.redact_body(body.decode('utf-8', 'replace'), request.headers.get('content-type', ''))
+            entry['response'] = self._recorder.redact_body(response_body.decode('utf-8', 'replace'), content_type)
+            self._recorder.write(entry)
+
+        if response.is_stream_consumed:
+            # In memory responses (replay) are read on creation, the client never closes their stream
+            record(response.content)
+        else:
+            response.stream = _RecordedStream(response.stream, record)
+        return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """Answer the upstream calls from a recording, in the recorded order per operation.
+
+    A call gets the first unused recorded call of the same operation and path, or of the same
+    operation when the path is unknown (e.g. an id created differently). Polls beyond the recorded
+    ones get the last recorded response of their path again. Calls absent from the recording get a 404.
+    """
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        self.latency_scale = latency_scale
+        self.calls = Counter()
+        self.unmatched = Counter()
+        self._pending: Dict[Tuple[str, str], List[dict]] = {}
+        self._last: Dict[Tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+        entries = [entry for entry in load_recording(path) if entry['type'] == 'upstream']
+        for entry in sorted(entries, key=lambda entry: entry['started']):
+            self._pending.setdefault((entry['method'], entry['operation']), []).append(entry)
+
+    def _match(self, method: str, path: str, operation: str) -> Optional[dict]:
+        pending = self._pending.get((method, operation), [])
+        entry = next((candidate for candidate in pending if candidate['path'] == path), None)
+        if entry is None:
+            entry = self._last.get((method, path))
+            if entry is not None:
+                return entry
+            entry = pending[0] if pending else None
+        if entry is not None:
+            pending.remove(entry)
+            self._last[(method, path)] = entry
+        return entry
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        path = api_path(request.url.path)
+        operation = classify_openai_request(request.method, path)
+        with self._lock:
+            entry = self._match(request.method, path, operation)
+            self.calls[operation] += 1
+            if entry is None:
+                self.unmatched[operation] += 1
+        if entry is None:
+            return httpx.Response(404, json={'error': {
+                'message': f'{request.method} {path} is not in the recording', 'type': 'invalid_request_error', 'code': None, 'param': None,
+            }}, request=request)
+        time.sleep(entry['duration'] * self.latency_scale)
+        return httpx.Response(
+            entry['status'],
+            headers={'content-type': entry['content_type']},
+            content=entry['response'].encode('utf-8'),
+            request=request,
+        )
+
+
+class OpenAIRecorder():
+    """Records and replays the OpenAI traffic, at the httpx transport of the shared client.
+
+    With OPENAI_RECORD_PATH, every upstream call is appended to a JSONL file with its order, timing,
+    operation, request and response, together with the /ai requests which caused it (`inbound`
+    entries, grouped by `trace`). With OPENAI_REPLAY_PATH, the upstream calls are answered from such a
+    file instead of the network, after the recorded latency scaled by OPENAI_REPLAY_LATENCY_SCALE.
+    Both can be set at once to record a replay, and compare its calls to the original ones with
+    tools/openai_traffic_report.py.
+
+    The API key is never recorded. With OPENAI_RECORD_REDACT (the default), the questions, messages,
+    instructions, the names and descriptions of the assistants and vector stores and the file names
+    are replaced by a hash of their value, so that replays still tell them apart.
+    """
+
+    def __init__(self):
+        self.record_path: Optional[str] = None
+        self.replay_path: Optional[str] = None
+        self.redact = True
+        self.latency_scale = 1.0
+        self.started = time.monotonic()
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.record_path = app.config['OPENAI_RECORD_PATH']
+        self.replay_path = app.config['OPENAI_REPLAY_PATH']
+        self.redact = app.config['OPENAI_RECORD_REDACT']
+        self.latency_scale = app.config['OPENAI_REPLAY_LATENCY_SCALE']
+        if self.record_path:
+            with self._lock:
+                if self._stream is not None:
+                    self._stream.close()
+                self._stream = open(self.record_path, 'a', buffering=1)
+            app.before_request(self._start_trace)
+            app.after_request(self._record_inbound)
+            app.logger.warning(f'Recording the OpenAI traffic to {self.record_path}')
+        if self.replay_path:
+            app.logger.warning(f'Replaying the OpenAI traffic from {self.replay_path}, nothing is sent to OpenAI')
+        app.extensions['openai_recorder'] = self
+
+    def transport(self, limits: httpx.Limits) -> Optional[httpx.BaseTransport]:
+        """The transport of the OpenAI client, None for the default one.
+        """
+        transport = None
+        if self.replay_path:
+            transport = ReplayTransport(self.replay_path, self.latency_scale)
+        if self.record_path:
+            transport = RecordingTransport(transport or httpx.HTTPTransport(limits=limits), self)
+        return transport
+
+    def redact_body(self, body: str, content_type: str) -> str:
+        return _redact_body(body, content_type) if self.redact else body
+
+    def redact_data(self, data):
+        return redact(data) if self.redact else data
+
+    def current_trace(self) -> Tuple[str, str]:
+        """The trace and route of the request being served.
+
+        Calls made outside of a request (ingestion, citation lookups, batch questions) have no trace,
+        their route is named after the pool of the calling thread, e.g. 'background:citations'.
+        """
+        if has_request_context() and 'openai_trace' in g:
+            return g.openai_trace, f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        return None, 'background:' + threading.current_thread().name.rsplit('_', 1)[0]
+
+    def write(self, entry: dict) -> None:
+        line = json.dumps(entry)
+        with self._lock:
+            if self._stream is not None:
+                self._stream.write(line + '\n')
+
+    def _start_trace(self):
+        g.openai_trace = uuid.uuid4().hex
+        g.openai_trace_started = time.monotonic()
+
+    def _record_inbound(self, response):
+        if request.blueprint != 'ai' or 'openai_trace' not in g:
+            return response
+        self.write({
+            'type': 'inbound',
+            'trace': g.openai_trace,
+            'route': self.current_trace()[1],
+            'started': round(g.openai_trace_started - self.started, 6),
+            'duration': round(time.monotonic() - g.openai_trace_started, 6),
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode(),
+            'status': response.status_code,
+            'location': response.headers.get('Location'),
+            'accept': request.headers.get('Accept'),
+            'json': self.redact_data(request.get_json(silent=True)),
+            'form': self.redact_data(request.form.to_dict()) if request.form else None,
+            'files': self.redact_data([{'field': field, 'filename': file.filename} for field, file in request.files.items()]) or None,
+        })
+        return response
+
+
+openai_recorder = OpenAIRecorder()
@@ -0,0 +1,109 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingUnavailable(Exception):
+    """Raised when PASSWORD_HASH_MAX_PENDING hashes are already queued, a hash timed out or its worker died.
+    """
+
+
+class PasswordHasher():
+    """Computes the password hashes in a dedicated, size limited process pool.
+
+    Hashing is CPU bound on purpose: running it on the waitress threads lets a burst of logins take
+    every thread (and the GIL) away from the other requests. Callers block until their hash is
+    done, but no more than PASSWORD_HASH_MAX_PENDING of them can wait at the same time, the others
+    get HashingUnavailable immediately. PASSWORD_HASH_WORKERS = 0 hashes in the calling thread.
+    """
+
+    def __init__(self):
+        self.method = 'scrypt'
+        self.salt_length = 16
+        self.timeout = 10
+        self.rejected = 0
+        self._workers = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._method_prefix: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = app.config['PASSWORD_HASH_SALT_LENGTH']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._workers = app.config['PASSWORD_HASH_WORKERS']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+        self._method_prefix = None
+        self.shutdown()
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking a multi-threaded server is unsafe, the workers are spawned instead
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Drop a broken pool (a worker died), the next hash starts a new one.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        if not self._workers:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingUnavailable()
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard_executor(executor)
+                raise HashingUnavailable() from e
+            raise
+        # The slot is held until the hash actually finishes, a timed out hash still occupies a worker
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingUnavailable()
+        except BrokenProcessPool as e:
+            self._discard_executor(executor)
+            raise HashingUnavailable() from e
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """Whether a stored hash was made with another method or cost than the configured one.
+        """
+        if self._method_prefix is None:
+            # werkzeug expands the method with its default cost (e.g. scrypt -> scrypt:32768:8:1)
+            self._method_prefix = generate_password_hash('', self.method, 1).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._method_prefix
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,218 @@
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+
+
+class Profile():
+    """The stacks sampled while a request was served, as collapsed stack counts.
+    """
+
+    def __init__(self, method: str, path: str, thread_id: int, client_request_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        # The X-Request-ID sent by the client, only echoed, the profile id is always generated here
+        self.client_request_id = client_request_id
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.thread_id = thread_id
+        self.sampled = False
+        self.status: Optional[str] = None
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'client_request_id': self.client_request_id,
+            'method': self.method,
+            'path': self.path,
+            'route': self.route,
+            'status': self.status,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 2),
+            'samples': self.samples,
+            'sampled': self.sampled,
+        }
+
+    def collapsed(self) -> str:
+        """The stacks in the collapsed format of flamegraph.pl and speedscope: `frame;frame;frame count`.
+        """
+        root = f'{self.method} {self.route or self.path}'
+        return ''.join(f'{root};{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class ProfilerMiddleware():
+    """WSGI middleware registering the requests to profile with the sampling profiler.
+
+    The profile covers the whole response, including the body iterated by the server after the
+    view returned (streamed answers). Profiled requests get an X-Profile-ID header, the id of
+    their profile.
+    """
+
+    def __init__(self, wsgi_app, profiler: 'SamplingProfiler'):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        profile = self.profiler.begin(environ)
+        if profile is None:
+            return self.wsgi_app(environ, start_response)
+
+        environ['profiler.profile'] = profile
+
+        def profiled_start_response(status, headers, exc_info=None):
+            profile.status = status.split(' ', 1)[0]
+            return start_response(status, headers + [('X-Profile-ID', profile.id)], exc_info)
+
+        try:
+            result = self.wsgi_app(environ, profiled_start_response)
+        except BaseException:
+            self.profiler.end(profile)
+            raise
+        return ClosingIterator(result, lambda: self.profiler.end(profile))
+
+
+class SamplingProfiler():
+    """Opt-in statistical profiler of the slow requests, see PROFILER_* in create_app().
+
+    A daemon thread reads the stacks of the threads serving the tracked requests with
+    `sys._current_frames()` every PROFILER_INTERVAL seconds, the requests run uninstrumented.
+    A PROFILER_SAMPLE_RATE share of the requests is tracked and kept, and with PROFILER_SLOW_THRESHOLD
+    every request is tracked and kept when it lasted longer. The PROFILER_MAX_PROFILES slowest
+    profiles are kept in memory, for GET /admin/profiles.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.slow_threshold: Optional[float] = None
+        self.interval = 0.01
+        self.max_profiles = 20
+        self.max_depth = 128
+        self._active: Dict[int, Profile] = {}
+        self._kept: List[tuple] = []
+        self._sequence = 0
+        self._labels: Dict[object, str] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config['PROFILER_ENABLED']
+        self.sample_rate = app.config['PROFILER_SAMPLE_RATE']
+        self.slow_threshold = app.config['PROFILER_SLOW_THRESHOLD']
+        self.interval = app.config['PROFILER_INTERVAL']
+        self.max_profiles = app.config['PROFILER_MAX_PROFILES']
+        if self.enabled:
+            app.wsgi_app = ProfilerMiddleware(app.wsgi_app, self)
+            app.before_request(self._name_route)
+            app.logger.warning(f'Profiling {self.sample_rate:.1%} of the requests and the ones slower than {self.slow_threshold} s')
+        app.extensions['profiler'] = self
+
+    def _name_route(self):
+        profile = request.environ.get('profiler.profile')
+        if profile is not None and request.url_rule is not None:
+            profile.route = request.url_rule.rule
+
+    def begin(self, environ) -> Optional[Profile]:
+        """Start tracking a request, None when it is not profiled.
+        """
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            return None
+        client_request_id = environ.get('HTTP_X_REQUEST_ID')
+        profile = Profile(
+            environ.get('REQUEST_METHOD', ''), environ.get('PATH_INFO', ''), threading.get_ident(),
+            client_request_id[:64] if client_request_id else None,
+        )
+        profile.sampled = sampled
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return profile
+
+    def end(self, profile: Profile) -> None:
+        profile.duration = time.perf_counter() - profile.started
+        keep = profile.sampled or (self.slow_threshold is not None and profile.duration >= self.slow_threshold)
+        with self._lock:
+            if self._active.get(profile.thread_id) is profile:
+                del self._active[profile.thread_id]
+            if not keep:
+                return
+            self._sequence += 1
+            entry = (profile.duration, self._sequence, profile)
+            if len(self._kept) < self.max_profiles:
+                heapq.heappush(self._kept, entry)
+            else:
+                heapq.heappushpop(self._kept, entry)
+
+    def profiles(self) -> List[Profile]:
+        """The kept profiles, the slowest first.
+        """
+        with self._lock:
+            return [profile for _, _, profile in sorted(self._kept, reverse=True)]
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return next((profile for profile in self.profiles() if profile.id == profile_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._kept = []
+
+    # Sampling
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        return label
+
+    def _collapse(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def _run(self) -> None:
+        while True:
+            frames = sys._current_frames()
+            with self._lock:
+                targets = [(profile, frames.get(profile.thread_id)) for profile in self._active.values()]
+                idle = not targets
+            del frames
+            # Collapsed outside of the lock, begin() and end() run on the request threads
+            stacks = [(profile, self._collapse(frame)) for profile, frame in targets if frame is not None]
+            del targets
+            if stacks:
+                # Only the profiles still active, a profile is never written once its request ended
+                with self._lock:
+                    for profile, stack in stacks:
+                        if self._active.get(profile.thread_id) is profile:
+                            profile.stacks[stack] += 1
+                            profile.samples += 1
+                del stacks
+            if idle:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            else:
+                time.sleep(self.interval)
+
+profiler = SamplingProfiler()
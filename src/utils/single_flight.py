@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight():
+    """Coalesce concurrent calls sharing the same key into a single execution.
+
+    The first caller (the leader) runs the function, the callers arriving while it runs (the
+    followers) wait for its result. A follower runs the function itself when the leader fails or
+    does not finish within the given timeout.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self.fallbacks = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Run fn, or wait for the result of the identical call already in flight.
+
+        Args:
+            key (Hashable): identifies identical calls.
+            fn (Callable): the call, without arguments.
+            timeout (float, optional): seconds a follower waits for the leader before running fn itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.done.wait(timeout) and call.error is None:
+            with self._lock:
+                self.shared += 1
+            return call.result
+
+        with self._lock:
+            self.fallbacks += 1
+        return fn()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'fallbacks': self.fallbacks,
+                'in_flight': len(self._calls),
+            }
+
+
+class AsyncSingleFlight():
+    """asyncio flavour of SingleFlight, for coroutines running on a single event loop.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self.fallbacks = 0
+        self._calls = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Await fn(), or the result of the identical call already in flight.
+
+        Args:
+            key (Hashable): identifies identical calls.
+            fn (Callable): returns the awaitable to run, without arguments.
+            timeout (float, optional): seconds a follower waits for the leader before running fn itself.
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.get_running_loop().create_future()
+            self.leaders += 1
+            # The outcome is (succeeded, result), so that a failure without followers is not reported as unhandled
+            try:
+                result = await fn()
+                future.set_result((True, result))
+                return result
+            except BaseException:
+                future.set_result((False, None))
+                raise
+            finally:
+                del self._calls[key]
+
+        try:
+            succeeded, result = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            succeeded = False
+        if succeeded:
+            self.shared += 1
+            return result
+        self.fallbacks += 1
+        return await fn()
+
+    def stats(self) -> dict:
+        return {
+            'leaders': self.leaders,
+            'shared': self.shared,
+            'fallbacks': self.fallbacks,
+            'in_flight': len(self._calls),
+        }
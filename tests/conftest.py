@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules are imported from src/, as when the app runs (`python src/main.py`), the OpenAI stand-in from tools/
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+
+class FakeOpenAI():
+    """The OpenAI stand-in of the benchmarks (tools/fake_openai.py), served on a local port.
+    """
+
+    def __init__(self):
+        from fake_openai import create_fake_app
+        from werkzeug.serving import make_server
+
+        self.app = create_fake_app(assistants=['Manuals'])
+        self.server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def calls(self, operation: str = None):
+        """The number of calls per operation (e.g. 'GET /v1/assistants'), since the last reset.
+        """
+        calls = self.app.test_client().get('/_stats').get_json()['calls']
+        return calls.get(operation, 0) if operation else calls
+
+    def reset(self) -> None:
+        self.app.test_client().post('/_reset')
+
+
+@pytest.fixture(scope='session')
+def fake_openai():
+    fake = FakeOpenAI()
+    yield fake
+    fake.server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def api_app(fake_openai, tmp_path_factory):
+    """The app built by create_app(), on a SQLite database and the OpenAI stand-in.
+
+    The admission control is off, see test_admission.py.
+    """
+    with pytest.MonkeyPatch.context() as patch:
+        folder = tmp_path_factory.mktemp('app')
+        # The upload folder is relative to the working directory
+        patch.chdir(folder)
+        patch.setenv('ENVIRONMENT', 'development')
+        patch.setenv('SQLALCHEMY_DATABASE_URI_DEV', f"sqlite:///{folder / 'app.db'}")
+        patch.setenv('SUDO_PASSWORD', 'sudo')
+        for key, value in {
+            'SECRET_KEY': 's' * 32,
+            'JWT_SECRET_KEY': 'j' * 32,
+            'OPENAI_API_KEY': 'sk-test',
+            'OPENAI_BASE_URL': fake_openai.url,
+            'OPENAI_MAX_RETRIES': '0',
+            'EMAIL_DISPATCHER_ENABLED': 'false',
+            'ADMISSION_ENABLED': 'false',
+            'ASK_RUN_POLL_INTERVAL': '0.01',
+            'PASSWORD_HASH_WORKERS': '1',
+        }.items():
+            patch.setenv(f'FLASK_{key}', value)
+
+        from main import create_app
+        app = create_app()
+        app.config['TESTING'] = True
+        yield app
+
+
+@pytest.fixture
+def client(api_app, fake_openai):
+    fake_openai.reset()
+    return api_app.test_client()
+
+
+@pytest.fixture
+def auth_headers(api_app):
+    """Returns the Authorization header of a new access token, creating its user when needed.
+    """
+    from flask_jwt_extended import create_access_token
+
+    from data.extensions import db
+    from data.user_model import User
+
+    def auth_headers(username: str = 'alice') -> dict:
+        with api_app.app_context():
+            if User.get_user_by_username(username) is None:
+                db.session.add(User(username=username, email=f'{username}@example.com', password='x'))
+                db.session.commit()
+            return {'Authorization': f'Bearer {create_access_token(identity=username)}'}
+    return auth_headers
@@ -0,0 +1,169 @@
+import threading
+
+import pytest
+from flask import Flask, Response
+from flask_jwt_extended import JWTManager
+
+from utils import admission
+from utils.admission import AdmissionRejected, _Gate, _TokenBucket, admission_controlled, admission_controller
+
+
+LIMITS = {
+    'max_in_flight': 1,
+    'per_user_in_flight': 1,
+    'rate': 0,
+    'burst': 1,
+    'queue_size': 1,
+    'queue_timeout': 0.05,
+}
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, 'monotonic', fake)
+    return fake
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = _TokenBucket(rate=2, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.take() == 0
+    assert not bucket.is_full()
+    clock.now += 10
+    assert bucket.is_full()
+    # Refilled up to the burst only
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() > 0
+
+
+def test_gate_rate_limited(clock):
+    gate = _Gate(dict(LIMITS, rate=1, burst=1, per_user_in_flight=5, max_in_flight=5))
+    gate.acquire('alice')
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('alice')
+    assert rejected.value.reason == 'rate_limited'
+    assert rejected.value.retry_after_header() == '1'
+    # Other users have their own bucket
+    gate.acquire('bob')
+    assert gate.stats()['rejected']['rate_limited'] == 1
+
+
+def test_gate_without_rate_limit_only_counts_in_flight(clock):
+    gate = _Gate(dict(LIMITS, rate=1, burst=1, per_user_in_flight=5, max_in_flight=5))
+    gate.acquire('alice')
+    gate.acquire('alice', rate_limited=False)
+    assert gate.stats()['in_flight'] == 2
+    assert gate.stats()['rejected']['rate_limited'] == 0
+
+
+def test_gate_user_limit():
+    gate = _Gate(dict(LIMITS, max_in_flight=5))
+    gate.acquire('alice')
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('alice')
+    assert rejected.value.reason == 'user_limit'
+    gate.release('alice')
+    gate.acquire('alice')
+
+
+def test_gate_queue_full_and_timeout():
+    gate = _Gate(dict(LIMITS, queue_size=0))
+    gate.acquire('alice')
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('bob')
+    assert rejected.value.reason == 'queue_full'
+
+    gate = _Gate(LIMITS)
+    gate.acquire('alice')
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.acquire('bob')
+    assert rejected.value.reason == 'queue_timeout'
+    assert gate.stats()['queue_depth'] == 0
+
+
+def test_gate_release_wakes_a_waiter():
+    gate = _Gate(dict(LIMITS, queue_timeout=5))
+    gate.acquire('alice')
+    admitted = threading.Event()
+
+    def wait():
+        gate.acquire('bob')
+        admitted.set()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    assert not admitted.wait(0.1)
+    gate.release('alice')
+    assert admitted.wait(5)
+    waiter.join()
+    stats = gate.stats()
+    assert stats['in_flight'] == 1
+    assert stats['admitted'] == 2
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        JWT_SECRET_KEY='j' * 32,
+        ADMISSION_ENABLED=True,
+        ADMISSION_LIMITS={'ask': dict(LIMITS, queue_size=0)},
+    )
+    JWTManager(app)
+    admission_controller.init_app(app)
+
+    @app.route('/stream')
+    @admission_controlled('ask')
+    def stream():
+        return Response(iter(['a', 'b']))
+
+    @app.route('/fail')
+    @admission_controlled('ask')
+    def fail():
+        raise RuntimeError('boom')
+
+    yield app
+    admission_controller.enabled = False
+
+
+def test_admission_slot_held_until_the_response_is_closed(app):
+    client = app.test_client()
+    response = client.get('/stream', buffered=False)
+    assert admission_controller.stats()['ask']['in_flight'] == 1
+    with pytest.raises(AdmissionRejected):
+        client.get('/stream', environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    response.close()
+    assert admission_controller.stats()['ask']['in_flight'] == 0
+    assert client.get('/stream').status_code == 200
+
+
+def test_admission_slot_released_when_the_view_fails(app):
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    assert app.test_client().get('/fail').status_code == 500
+    assert admission_controller.stats()['ask']['in_flight'] == 0
+
+
+def test_per_user_limit(app):
+    assert admission_controller.per_user_limit('ask') == 1
+    assert admission_controller.per_user_limit('ask-batch') is None
+    admission_controller.enabled = False
+    assert admission_controller.per_user_limit('ask') is None
+
+
+def test_anonymous_identity_ignores_forwarded_for(app):
+    with app.test_request_context('/', headers={'X-Forwarded-For': '1.2.3.4'}, environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert admission.request_identity() == 'ip:10.0.0.1'
@@ -0,0 +1,26 @@
+import pytest
+
+from api.utils.answer_cache import normalize_question
+
+
+@pytest.mark.parametrize('question', ['What is X?', '  what   is x ', 'WHAT IS X?!', 'What is\nX.'])
+def test_normalized_questions_share_a_cache_entry(question):
+    assert normalize_question(question) == 'what is x'
+
+
+def test_repeated_question_is_answered_from_the_cache(api_app, client, fake_openai, auth_headers, monkeypatch):
+    monkeypatch.setitem(api_app.config, 'ANSWER_CACHE_ENABLED', True)
+    headers = auth_headers()
+    ask = lambda question, **kwargs: client.post('/ai/ask', json=dict(assistant_name='Manuals', question=question, **kwargs), headers=headers)
+
+    first = ask('Is the answer cached?')
+    assert first.status_code == 200
+    assert ask('  is the answer CACHED ').get_json() == first.get_json()
+    assert fake_openai.calls('POST /v1/threads/<thread_id>/runs') == 1
+
+    # A fresh answer is asked for, and stored for the next ones
+    assert ask('Is the answer cached?', no_cache=True).status_code == 200
+    assert client.post('/ai/ask', json={'assistant_name': 'Manuals', 'question': 'Is the answer cached?'}, headers=dict(headers, **{'Cache-Control': 'no-cache'})).status_code == 200
+    assert fake_openai.calls('POST /v1/threads/<thread_id>/runs') == 3
+    assert ask('Is the answer cached?').status_code == 200
+    assert fake_openai.calls('POST /v1/threads/<thread_id>/runs') == 3
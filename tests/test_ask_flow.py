@@ -0,0 +1,113 @@
+import types
+
+import pytest
+from flask import Flask
+
+from api.utils.ask_flow import RunFailed, format_answer_flow, question_flow, run_flow
+
+NS = types.SimpleNamespace
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(ASK_RUN_TIMEOUT=5, ASK_RUN_POLL_INTERVAL=0)
+    return app
+
+
+def fake_client(statuses):
+    calls = []
+    statuses = iter(statuses)
+
+    def method(name, result):
+        def call(**kwargs):
+            calls.append(name)
+            return result() if callable(result) else result
+        return call
+    run = lambda: NS(id='run_1', status=next(statuses), last_error=None)
+    message = NS(content=[NS(text=NS(value='The answer', annotations=[]))])
+    client = NS(
+        calls=calls,
+        beta=NS(threads=NS(
+            create=method('threads.create', NS(id='thread_1')),
+            runs=NS(create=method('runs.create', run), retrieve=method('runs.retrieve', run), cancel=method('runs.cancel', None)),
+            messages=NS(list=method('messages.list', NS(data=[message]))),
+        )),
+    )
+    return client
+
+
+def test_question_flow_polls_until_completed(app, monkeypatch):
+    monkeypatch.setattr('api.utils.ask_flow.lookup_known_filenames', lambda file_ids: ({}, []))
+    client = fake_client(['queued', 'in_progress', 'completed'])
+    assert run_flow(client, question_flow(app, 'asst_1', 'Q?')) == {'response': 'The answer', 'citations': []}
+    assert client.calls == ['threads.create', 'runs.create', 'runs.retrieve', 'runs.retrieve', 'messages.list']
+
+
+def test_run_requiring_an_action_is_cancelled(app):
+    client = fake_client(['queued', 'requires_action'])
+    with pytest.raises(RunFailed):
+        run_flow(client, question_flow(app, 'asst_1', 'Q?'))
+    assert client.calls[-1] == 'runs.cancel'
+
+
+def test_run_past_its_deadline_is_cancelled(app):
+    app.config['ASK_RUN_TIMEOUT'] = 0
+    client = fake_client(['queued'])
+    with pytest.raises(RunFailed, match='expired'):
+        run_flow(client, question_flow(app, 'asst_1', 'Q?'))
+    assert client.calls == ['threads.create', 'runs.create', 'runs.cancel']
+
+
+def test_footnotes_resolve_only_the_unknown_files_once(app, monkeypatch):
+    monkeypatch.setattr('api.utils.ask_flow.lookup_known_filenames', lambda file_ids: ({'file_1': 'known.pdf'}, ['file_2', 'file_3']))
+    monkeypatch.setattr('api.utils.ask_flow.remember_filename', lambda file_id, filename: None)
+    retrieved = []
+
+    def retrieve(file_id):
+        retrieved.append(file_id)
+        if file_id == 'file_3':
+            raise RuntimeError('gone')
+        return NS(filename='fetched.pdf')
+    annotations = [NS(text=f'<{index}>', file_citation=NS(file_id=f'file_{index}')) for index in (1, 2, 3)]
+    content = NS(value='a<1> b<2> c<3>', annotations=annotations)
+    response, citations = run_flow(NS(files=NS(retrieve=retrieve)), format_answer_flow(app, content))
+    assert response == 'a [0] b [1] c [2]'
+    assert citations == ['[0] from known.pdf', '[1] from fetched.pdf']
+    assert sorted(retrieved) == ['file_2', 'file_3']
+
+
+@pytest.fixture(scope='module')
+def asgi_client(api_app):
+    """The app of the ASGI serving mode (asgi.py), around the test app.
+    """
+    from a2wsgi import WSGIMiddleware
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from starlette.testclient import TestClient
+
+    from api.assistant_async import create_async_routes
+
+    wsgi_app = WSGIMiddleware(api_app, workers=2)
+    with TestClient(Starlette(routes=create_async_routes(api_app, wsgi_app) + [Mount('/', app=wsgi_app)])) as client:
+        yield client
+
+
+def test_async_and_flask_views_answer_alike(client, asgi_client, fake_openai, auth_headers):
+    headers = auth_headers()
+    question = {'assistant_name': 'Manuals', 'question': 'Same flow?'}
+    flask_answer = client.post('/ai/ask', json=question, headers=headers)
+    async_answer = asgi_client.post('/ai/ask', json=question, headers=headers)
+    assert flask_answer.status_code == async_answer.status_code == 200
+    assert async_answer.json() == flask_answer.get_json()
+    assert fake_openai.calls('POST /v1/threads/<thread_id>/runs') == 2
+
+    unknown = asgi_client.post('/ai/ask', json=dict(question, assistant_name='Unknown'), headers=headers)
+    assert unknown.status_code == 400
+    assert unknown.json()['error'] == client.post('/ai/ask', json=dict(question, assistant_name='Unknown'), headers=headers).get_json()['error']
+
+
+def test_async_view_hands_unauthenticated_requests_to_flask(asgi_client):
+    question = {'assistant_name': 'Manuals', 'question': 'Anonymous?'}
+    assert asgi_client.post('/ai/ask', json=question).status_code == 401
+    assert asgi_client.post('/ai/ask', json=question, headers={'Authorization': 'Bearer not-a-token'}).status_code == 401
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+
+from api.utils.ask_runs import ask_run_sweeper
+from data.ask_run_model import AskRun
+from data.document_model import utcnow
+from data.extensions import db
+
+
+def submit(client, headers, question: str):
+    response = client.post('/ai/ask', json={'assistant_name': 'Manuals', 'question': question, 'async': True}, headers=headers)
+    assert response.status_code == 202
+    assert response.headers['Location'].endswith(f"/ai/runs/{response.get_json()['run']['id']}")
+    return response.get_json()['run']
+
+
+def test_run_is_only_returned_to_its_owner(client, auth_headers):
+    owner = auth_headers('alice')
+    run = submit(client, owner, 'Whose run?')
+    response = client.get(f"/ai/runs/{run['id']}", headers=owner)
+    assert response.status_code == 200
+    assert response.get_json()['run']['status'] == 'completed'
+    assert response.get_json()['run']['response'].startswith('This is the answer to: Whose run?')
+
+    assert client.get(f"/ai/runs/{run['id']}", headers=auth_headers('mallory')).status_code == 404
+    assert client.get(f"/ai/runs/{run['id']}").status_code == 401
+
+
+@pytest.fixture
+def slow_runs(fake_openai, monkeypatch):
+    # The runs stay in progress upstream
+    monkeypatch.setitem(fake_openai.app.config, 'RUN_DURATION', 600)
+
+
+def test_sweep_expires_every_overdue_run(api_app, client, fake_openai, auth_headers, slow_runs, monkeypatch):
+    headers = auth_headers()
+    run_ids = [submit(client, headers, f'Abandoned {index}?')['id'] for index in range(5)]
+    pending = submit(client, headers, 'Still pending?')['id']
+    with api_app.app_context():
+        for run_id in run_ids:
+            ask_run = AskRun.get_by_id(run_id)
+            ask_run.deadline_at = utcnow() - timedelta(seconds=1)
+            db.session.add(ask_run)
+        db.session.commit()
+
+    # Nobody polls the runs nor submits a new question, the sweep goes on until no overdue run is left
+    monkeypatch.setattr(ask_run_sweeper, 'BATCH_SIZE', 2)
+    assert ask_run_sweeper.sweep() == 5
+    assert fake_openai.calls('POST /v1/threads/<thread_id>/runs/<run_id>/cancel') == 5
+    with api_app.app_context():
+        assert {AskRun.get_by_id(run_id).status for run_id in run_ids} == {AskRun.STATUS_EXPIRED}
+        assert AskRun.get_by_id(pending).status == AskRun.STATUS_QUEUED
+    assert ask_run_sweeper.sweep() == 0
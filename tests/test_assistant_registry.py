@@ -0,0 +1,140 @@
+import threading
+import types
+
+import pytest
+
+from api.utils.assistant_registry import AssistantRegistry, assistant_registry
+from utils.openai_client import openai_client
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr('api.utils.assistant_registry.time.monotonic', fake)
+    return fake
+
+
+def assistant(name: str, assistant_id: str):
+    return types.SimpleNamespace(name=name, id=assistant_id)
+
+
+def test_registry_lists_once_per_ttl(clock):
+    listings = []
+
+    def loader():
+        listings.append(1)
+        return [assistant('Manuals', 'asst_1'), assistant('Manuals', 'asst_2'), assistant('Other', 'asst_3')]
+    registry = AssistantRegistry(ttl=60)
+    # The first assistant of a name wins
+    assert registry.get('Manuals', loader).id == 'asst_1'
+    assert registry.get('Unknown', loader) is None
+    assert registry.names(loader) == ['Manuals', 'Other']
+    assert len(listings) == 1
+    clock.now += 61
+    assert registry.lookup('Manuals') == (False, None)
+    registry.get('Other', loader)
+    assert len(listings) == 2
+
+
+def test_unknown_name_refreshes_at_most_once_per_interval(clock):
+    listing = [assistant('Manuals', 'asst_1')]
+    listings = []
+
+    def loader():
+        listings.append(1)
+        return list(listing)
+    registry = AssistantRegistry(ttl=300, miss_refresh_interval=10)
+    registry.get('Manuals', loader)
+    # Created by another process
+    listing.append(assistant('New', 'asst_2'))
+    assert registry.get('New', loader) is None
+    assert len(listings) == 1
+    clock.now += 10
+    assert registry.get('New', loader).id == 'asst_2'
+    assert len(listings) == 2
+    clock.now += 1
+    assert registry.get('Missing', loader) is None
+    assert registry.lookup('Missing') == (True, None)
+    assert len(listings) == 2
+
+
+def test_listing_is_fetched_outside_the_lock_and_shared():
+    registry = AssistantRegistry(ttl=300)
+    registry.load([assistant('Manuals', 'asst_1')])
+    registry.invalidate()
+    listing_started = threading.Event()
+    release_listing = threading.Event()
+    listings = []
+
+    def slow_loader():
+        listings.append(1)
+        listing_started.set()
+        release_listing.wait(5)
+        return [assistant('Manuals', 'asst_1')]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get('Manuals', slow_loader))) for _ in range(4)]
+    threads[0].start()
+    assert listing_started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # The registry stays usable while the listing is in flight
+    assert registry.lookup('Manuals') == (False, None)
+    assert registry.stats()['size'] == 0
+    release_listing.set()
+    for thread in threads:
+        thread.join(5)
+    assert [result.id for result in results] == ['asst_1'] * 4
+    assert len(listings) == 1
+
+
+def test_listing_fetched_before_an_invalidation_is_dropped():
+    registry = AssistantRegistry(ttl=300)
+
+    def loader():
+        # The assistants change while the listing is in flight
+        registry.invalidate()
+        return [assistant('Stale', 'asst_0')]
+    assert registry.get('Stale', loader) is None
+    assert registry.lookup('Stale') == (False, None)
+
+
+def test_registry_put_and_invalidate():
+    registry = AssistantRegistry(ttl=60)
+    # Not loaded yet, a put does not make a partial listing look complete
+    registry.put(assistant('New', 'asst_9'))
+    assert registry.cached_names() is None
+    registry.load([assistant('Manuals', 'asst_1')])
+    registry.put(assistant('New', 'asst_9'))
+    assert registry.cached_names() == ['Manuals', 'New']
+    registry.invalidate()
+    assert registry.lookup('New') == (False, None)
+
+
+def test_registry_ttl_zero_disables_the_cache():
+    registry = AssistantRegistry(ttl=0)
+    registry.load([assistant('Manuals', 'asst_1')])
+    assert registry.cached_names() is None
+
+
+def test_assistant_created_elsewhere_is_found_by_the_view(api_app, client, fake_openai, auth_headers, monkeypatch):
+    headers = auth_headers()
+    assert client.get('/ai/assistant/Manuals', headers=headers).status_code == 200
+    listed = fake_openai.calls('GET /v1/assistants')
+    assert client.get('/ai/assistant/Manuals', headers=headers).status_code == 200
+    assert client.get('/ai/assistant/Missing', headers=headers).status_code == 400
+    assert fake_openai.calls('GET /v1/assistants') == listed
+
+    with api_app.app_context():
+        openai_client.get().beta.assistants.create(model='gpt-4o-mini', name='Created Elsewhere')
+    monkeypatch.setattr(assistant_registry, 'miss_refresh_interval', 0)
+    response = client.get('/ai/assistant/Created Elsewhere', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['assistant']['name'] == 'Created Elsewhere'
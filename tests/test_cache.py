@@ -0,0 +1,93 @@
+import pytest
+
+from api.utils.assistant_registry import assistant_registry
+from utils import cache
+from utils.cache import LRUCache
+from utils.openai_client import openai_client
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache.time, 'monotonic', fake)
+    return fake
+
+
+def test_lru_evicts_the_least_recently_used():
+    lru = LRUCache(max_size=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1 and lru.get('c') == 3
+    assert lru.stats() == {'hits': 3, 'misses': 1, 'size': 2}
+
+
+def test_lru_entries_expire_after_ttl(clock):
+    lru = LRUCache(max_size=8, ttl=10)
+    lru.set('a', 1)
+    clock.now += 9.9
+    assert lru.get('a') == 1
+    clock.now += 0.2
+    assert lru.get('a', 'missing') == 'missing'
+    assert lru.stats()['size'] == 0
+
+
+def test_lru_configure_shrinks_and_changes_ttl(clock):
+    lru = LRUCache(max_size=3)
+    for key in 'abc':
+        lru.set(key, key)
+    lru.configure(max_size=1, ttl=5)
+    assert lru.stats()['size'] == 1
+    assert lru.get('c') == 'c'
+    lru.set('d', 'd')
+    clock.now += 6
+    assert lru.get('d') is None
+
+
+def test_lru_size_zero_stores_nothing():
+    lru = LRUCache(max_size=0)
+    lru.set('a', 1)
+    assert lru.get('a') is None
+
+
+def test_lru_remove_where_and_pop():
+    lru = LRUCache()
+    lru.set(('asst_1', 1, 'q'), 'x')
+    lru.set(('asst_2', 1, 'q'), 'y')
+    lru.remove_where(lambda key: key[0] == 'asst_1')
+    assert lru.get(('asst_1', 1, 'q')) is None
+    lru.pop(('asst_2', 1, 'q'))
+    assert lru.stats()['size'] == 0
+
+
+@pytest.fixture
+def cited_assistant(api_app):
+    """A new assistant whose answers cite a file uploaded upstream only, unknown to the document catalog.
+    """
+    with api_app.app_context():
+        client = openai_client.get()
+        uploaded = client.files.create(file=('manual.pdf', b'%PDF-1.4'), purpose='assistants')
+        store = client.beta.vector_stores.create(name='Cited')
+        client.beta.vector_stores.file_batches.create(vector_store_id=store.id, file_ids=[uploaded.id])
+        client.beta.assistants.create(model='gpt-4o-mini', name='Cited', tool_resources={'file_search': {'vector_store_ids': [store.id]}})
+    assistant_registry.invalidate()
+    return uploaded
+
+
+def test_cited_filename_is_retrieved_once(client, fake_openai, cited_assistant, auth_headers):
+    headers = auth_headers()
+    for question in ('What is X?', 'What is Y?'):
+        response = client.post('/ai/ask', json={'assistant_name': 'Cited', 'question': question}, headers=headers)
+        assert response.status_code == 200
+        assert response.get_json()['citations'] == ['[0] from manual.pdf']
+    assert fake_openai.calls('GET /v1/files/<file_id>') == 1
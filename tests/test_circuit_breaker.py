@@ -0,0 +1,190 @@
+import httpx
+import openai
+import pytest
+
+from utils import circuit_breaker
+from utils.circuit_breaker import CIRCUIT_HEADER, CircuitBreaker, CircuitBreakerTransport, CircuitOpenError, circuit_open_error
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', fake)
+    return fake
+
+
+def make_breaker(**thresholds) -> CircuitBreaker:
+    return CircuitBreaker('test', **dict(dict(window=30, min_calls=4, failure_ratio=0.5, open_duration=10, half_open_calls=2), **thresholds))
+
+
+def call(breaker: CircuitBreaker, failed: bool = False, slow: bool = False) -> None:
+    trial = breaker.before_call()
+    breaker.record(trial, failed, slow)
+
+
+def trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.min_calls):
+        call(breaker, failed=True)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_opens_on_failure_ratio_once_min_calls_reached(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, failed=True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    call(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = make_breaker(slow_call_ratio=0.5)
+    for _ in range(4):
+        call(breaker, slow=True)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_outcomes_leave_the_window(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, failed=True)
+    clock.now += 31
+    call(breaker, failed=True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['calls'] == 1
+
+
+def test_open_rejects_until_open_duration(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 4
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.before_call()
+    assert rejected.value.retry_after_header() == '6'
+    assert breaker.rejected == 1
+
+
+def test_half_open_limits_trials_and_closes_when_they_succeed(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    first = breaker.before_call()
+    second = breaker.before_call()
+    assert first and second
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(first, failed=False, slow=False)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record(second, failed=False, slow=False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_reopens_on_a_failed_or_slow_trial(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    breaker.record(breaker.before_call(), failed=False, slow=True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+
+
+def test_calls_sent_before_opening_are_ignored(clock):
+    breaker = make_breaker()
+    late = breaker.before_call()
+    trip(breaker)
+    breaker.record(late, failed=True, slow=False)
+    assert breaker.stats()['failures'] == 4
+    assert breaker.trips == 1
+
+
+def test_disabled_breaker_lets_everything_through(clock):
+    breaker = make_breaker()
+    breaker.enabled = False
+    for _ in range(10):
+        call(breaker, failed=True)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def transport_client(breaker: CircuitBreaker, handler, timeouts=None) -> httpx.Client:
+    timeouts = timeouts or {'default': 60, 'threads.runs.retrieve': 10}
+    return httpx.Client(transport=CircuitBreakerTransport(httpx.MockTransport(handler), breaker, timeouts, connect_timeout=5))
+
+
+def test_transport_applies_the_timeout_of_the_operation(clock):
+    seen = {}
+
+    def handler(request):
+        seen[request.url.path] = request.extensions['timeout']
+        return httpx.Response(200, json={})
+    client = transport_client(make_breaker(), handler)
+    client.get('https://api.openai.com/v1/threads/thread_1/runs/run_1')
+    client.post('https://api.openai.com/v1/threads')
+    assert seen['/v1/threads/thread_1/runs/run_1'] == {'connect': 5, 'read': 10, 'write': 10, 'pool': 10}
+    assert seen['/v1/threads']['read'] == 60
+
+
+def test_transport_records_5xx_and_429_as_failures(clock):
+    breaker = make_breaker()
+    statuses = iter([500, 429, 503, 200])
+    client = transport_client(breaker, lambda request: httpx.Response(next(statuses)))
+    for _ in range(4):
+        client.post('https://api.openai.com/v1/threads')
+    assert breaker.stats()['failures'] == 3
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_open_circuit_answers_a_synthetic_503_without_calling_upstream(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={})
+    response = transport_client(breaker, handler).post('https://api.openai.com/v1/threads')
+    assert calls == []
+    assert response.status_code == 503
+    assert response.headers[CIRCUIT_HEADER] == 'test'
+    assert response.headers['x-should-retry'] == 'false'
+    assert response.headers['retry-after'] == '10'
+
+
+def test_openai_client_does_not_retry_the_synthetic_503(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    http_client = transport_client(breaker, lambda request: httpx.Response(200, json={}))
+    client = openai.OpenAI(api_key='sk-test', base_url='https://api.openai.com/v1', max_retries=2, http_client=http_client)
+    with pytest.raises(openai.InternalServerError) as raised:
+        client.beta.threads.retrieve('thread_1')
+    assert breaker.rejected == 1
+    error = circuit_open_error(raised.value)
+    assert error is not None and error.name == 'test'
+    assert circuit_open_error(ValueError('other')) is None
+
+
+@pytest.fixture
+def open_breaker(api_app):
+    # Without the outcomes of the calls of other tests
+    circuit_breaker.openai_breaker.configure(**api_app.config['CIRCUIT_BREAKER'])
+    trip(circuit_breaker.openai_breaker)
+    yield circuit_breaker.openai_breaker
+    circuit_breaker.openai_breaker.configure(**api_app.config['CIRCUIT_BREAKER'])
+
+
+def test_open_breaker_answers_ask_with_a_503_without_calling_upstream(client, fake_openai, auth_headers, open_breaker):
+    headers = auth_headers()
+    response = client.post('/ai/ask', json={'assistant_name': 'Manuals', 'question': 'Is OpenAI down?'}, headers=headers)
+    assert response.status_code == 503
+    assert 0 < int(response.headers['Retry-After']) <= open_breaker.open_duration
+    assert fake_openai.calls('POST /v1/threads') == 0
+    assert open_breaker.rejected >= 1
@@ -0,0 +1,74 @@
+import pytest
+
+from api.admin import decode_cursor, encode_cursor
+from data.extensions import db
+from data.user_model import User
+
+
+@pytest.mark.parametrize('column_name, value', [
+    ('id', 42),
+    ('username', 'alice'),
+    ('email', 'élise+tag@example.com'),
+    ('username', ''),
+])
+def test_cursor_round_trip(column_name, value):
+    cursor = encode_cursor(column_name, value)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (column_name, value)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64 !',
+    encode_cursor('id', 1)[:-3],
+    encode_cursor('password', 'x'),
+    'bnVsbA',  # null
+    'WzFd',  # [1]
+    encode_cursor(['id'], 1),
+    encode_cursor('id', [1]),
+    encode_cursor('id', {'a': 1}),
+    encode_cursor('id', '1'),
+    encode_cursor('id', 1.5),
+    encode_cursor('id', True),
+    encode_cursor('id', None),
+    encode_cursor('username', 1),
+    encode_cursor('email', ['a@x.io']),
+])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.fixture
+def admin_headers(api_app, auth_headers):
+    with api_app.app_context():
+        for index in range(5):
+            if User.get_user_by_username(f'page{index}') is None:
+                db.session.add(User(username=f'page{index}', email=f'page{index}@example.com', password='x'))
+        db.session.commit()
+    # The admin role is granted to this identity by the claims loader
+    return auth_headers('fatjonfreskina')
+
+
+def test_get_all_walks_the_pages_with_the_cursor(client, admin_headers):
+    usernames = []
+    query = {'limit': 2, 'username_prefix': 'page'}
+    while True:
+        response = client.get('/admin/get-all', query_string=query, headers=admin_headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        usernames += [user['username'] for user in data['users']]
+        if data['next'] is None:
+            break
+        query['after'] = data['next']
+    assert usernames == [f'page{index}' for index in range(5)]
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64 !',
+    encode_cursor('id', [1]),
+    encode_cursor('id', {'a': 1}),
+    encode_cursor('username', 'page1'),
+])
+def test_get_all_rejects_a_bad_cursor_with_400(client, admin_headers, cursor):
+    response = client.get('/admin/get-all', query_string={'after': cursor}, headers=admin_headers)
+    assert response.status_code == 400
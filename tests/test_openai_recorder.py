@@ -0,0 +1,90 @@
+import io
+
+import httpx
+import openai
+from flask import Blueprint, Flask, jsonify, request
+
+from utils.openai_recorder import OpenAIRecorder, RecordingTransport, load_recording
+
+# Customer content, none of it may reach a redacted recording
+SECRETS = ('Acme Chillers', 'Service manuals of Acme', 'Answer as an Acme technician', 'acme-confidential', 'Acme Store', 'How do I reset the Acme board')
+
+
+def recording_app(path: str, fake_openai, redact: bool) -> Flask:
+    """An /ai blueprint whose views call OpenAI (the stand-in) through a recording transport.
+    """
+    app = Flask(__name__)
+    app.config.update(OPENAI_RECORD_PATH=path, OPENAI_RECORD_REDACT=redact, OPENAI_REPLAY_PATH=None, OPENAI_REPLAY_LATENCY_SCALE=1.0)
+    recorder = OpenAIRecorder()
+    recorder.init_app(app)
+    client = openai.OpenAI(
+        api_key='sk-test',
+        base_url='http://openai.test/v1',
+        http_client=httpx.Client(transport=RecordingTransport(httpx.WSGITransport(app=fake_openai.app), recorder)),
+    )
+    ai = Blueprint('ai', __name__)
+
+    @ai.post('/add-pdf')
+    def add_pdf():
+        upload = request.files['file']
+        assistant = client.beta.assistants.create(
+            model='gpt-4o-mini',
+            name=request.form['assistant_name'],
+            description='Service manuals of Acme',
+            instructions='Answer as an Acme technician',
+        )
+        uploaded = client.files.create(file=(upload.filename, upload.read()), purpose='assistants')
+        store = client.beta.vector_stores.create(name='Acme Store')
+        client.beta.vector_stores.file_batches.create(vector_store_id=store.id, file_ids=[uploaded.id])
+        client.files.retrieve(uploaded.id)
+        list(client.beta.assistants.list())
+        return jsonify({'assistant': assistant.id})
+
+    @ai.post('/ask')
+    def ask():
+        thread = client.beta.threads.create(messages=[{'role': 'user', 'content': request.get_json()['question']}])
+        client.beta.threads.messages.list(thread_id=thread.id)
+        return jsonify({'thread': thread.id})
+
+    app.register_blueprint(ai, url_prefix='/ai')
+    return app
+
+
+def record_session(app: Flask) -> None:
+    client = app.test_client()
+    assert client.post('/ai/add-pdf', data={
+        'assistant_name': 'Acme Chillers',
+        'file': (io.BytesIO(b'%PDF-1.4 manual'), 'acme-confidential.pdf', 'application/pdf'),
+    }).status_code == 200
+    assert client.post('/ai/ask', json={'assistant_name': 'Acme Chillers', 'question': 'How do I reset the Acme board?'}).status_code == 200
+    app.extensions['openai_recorder']._stream.close()
+
+
+def test_redacted_recording_contains_no_customer_content(tmp_path, fake_openai):
+    path = str(tmp_path / 'recording.jsonl')
+    record_session(recording_app(path, fake_openai, redact=True))
+    with open(path) as stream:
+        recording = stream.read()
+    for secret in SECRETS:
+        assert secret not in recording
+
+    entries = load_recording(path)
+    operations = {entry.get('operation') for entry in entries}
+    assert {'assistants.create', 'files.create', 'vector_stores.create', 'files.retrieve', 'assistants.list', 'threads.create'} <= operations
+    upload = next(entry['upload'] for entry in entries if entry.get('operation') == 'files.create')
+    # The extension is kept, a replayed upload is still a PDF
+    assert upload['filename'].startswith('[redacted:') and upload['filename'].endswith('.pdf')
+    inbound = next(entry for entry in entries if entry['type'] == 'inbound' and entry['path'] == '/ai/add-pdf')
+    assert inbound['files'][0]['filename'] == upload['filename']
+    # The same name is hashed alike in the requests and the responses, a replay still resolves the assistant
+    listed = next(entry for entry in entries if entry.get('operation') == 'assistants.list')
+    assert inbound['form']['assistant_name'] in listed['response']
+
+
+def test_unredacted_recording_keeps_the_names(tmp_path, fake_openai):
+    path = str(tmp_path / 'recording.jsonl')
+    record_session(recording_app(path, fake_openai, redact=False))
+    with open(path) as stream:
+        recording = stream.read()
+    for secret in SECRETS:
+        assert secret in recording
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_the_leader_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'answer'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', fn, timeout=5))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    # Let the followers register before the leader finishes, the late ones run fn themselves
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert results == ['answer'] * 4
+    assert len(calls) + flight.stats()['shared'] == 4
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_follower_runs_itself_when_the_leader_fails():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('boom')
+
+    errors = []
+
+    def lead():
+        try:
+            flight.do('key', failing)
+        except RuntimeError as e:
+            errors.append(e)
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert started.wait(5)
+    result = []
+    follower = threading.Thread(target=lambda: result.append(flight.do('key', lambda: 'own', timeout=5)))
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 1
+    assert result == ['own']
+
+
+def test_follower_runs_itself_after_the_timeout():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'leader'
+    leader = threading.Thread(target=lambda: flight.do('key', slow))
+    leader.start()
+    assert started.wait(5)
+    assert flight.do('key', lambda: 'own', timeout=0.01) == 'own'
+    assert flight.stats()['fallbacks'] == 1
+    release.set()
+    leader.join()
+
+
+def test_distinct_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.stats()['leaders'] == 2
+
+
+def test_async_followers_share_the_leader_result():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'answer'
+
+    async def main():
+        return await asyncio.gather(*(flight.do('key', fn, timeout=5) for _ in range(4)))
+    assert asyncio.run(main()) == ['answer'] * 4
+    assert calls == [1]
+    assert flight.stats() == {'leaders': 1, 'shared': 3, 'fallbacks': 0, 'in_flight': 0}
+
+
+def test_async_follower_runs_itself_when_the_leader_fails():
+    flight = AsyncSingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('boom')
+
+    async def own():
+        return 'own'
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do('key', failing))
+        await asyncio.sleep(0)
+        follower = await flight.do('key', own, timeout=5)
+        with pytest.raises(RuntimeError):
+            await leader
+        return follower
+    assert asyncio.run(main()) == 'own'
+    assert flight.stats()['fallbacks'] == 1
+
+
+def test_identical_questions_in_flight_share_one_run(api_app, fake_openai, auth_headers, monkeypatch):
+    monkeypatch.setitem(fake_openai.app.config, 'RUN_DURATION', 0.5)
+    fake_openai.reset()
+    headers = auth_headers()
+    responses = []
+
+    def ask():
+        responses.append(api_app.test_client().post('/ai/ask', json={'assistant_name': 'Manuals', 'question': 'Shared question?'}, headers=headers))
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len({response.get_data() for response in responses}) == 1
+    assert fake_openai.calls('POST /v1/threads/<thread_id>/runs') == 1
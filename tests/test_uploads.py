@@ -0,0 +1,60 @@
+import io
+import os
+import time
+
+import pytest
+
+from api.utils.assistant_registry import assistant_registry
+from api.utils.uploads import assistant_folder, assistant_upload_folder
+from benchmark import make_pdf
+from utils.openai_client import openai_client
+
+
+def test_new_folders_use_the_sanitized_name(tmp_path):
+    assert assistant_upload_folder(str(tmp_path), 'Field Manuals') == os.path.join(str(tmp_path), 'Field_Manuals')
+    assert assistant_folder(str(tmp_path), '../../etc') == os.path.join(str(tmp_path), 'etc')
+
+
+def test_existing_folder_of_the_raw_name_is_kept(tmp_path):
+    (tmp_path / 'Field Manuals').mkdir()
+    assert assistant_upload_folder(str(tmp_path), 'Field Manuals') == os.path.join(str(tmp_path), 'Field Manuals')
+
+
+@pytest.mark.parametrize('assistant_name', ['..', '.', 'nested/../Manuals', '../outside', 'linked manuals'])
+def test_legacy_folder_outside_of_root_is_ignored(tmp_path, assistant_name):
+    root = tmp_path / 'uploads'
+    (root / 'nested').mkdir(parents=True)
+    (root / 'Manuals').mkdir()
+    (tmp_path / 'outside').mkdir()
+    (root / 'linked manuals').symlink_to(tmp_path / 'outside')
+    assert assistant_upload_folder(str(root), assistant_name) == assistant_folder(str(root), assistant_name)
+
+
+def test_pdfs_of_a_legacy_folder_are_ingested_and_searched(api_app, client, auth_headers):
+    with api_app.app_context():
+        openai_client.get().beta.assistants.create(model='gpt-4o-mini', name='Field Manuals')
+    assistant_registry.invalidate()
+    # Uploaded before the folders were named after the sanitized assistant name
+    legacy_folder = os.path.join(api_app.config['UPLOAD_FOLDER'], 'Field Manuals')
+    os.makedirs(legacy_folder)
+    with open(os.path.join(legacy_folder, 'compressor.pdf'), 'wb') as stream:
+        stream.write(make_pdf('The compressor inverter overheats when the oil pressure drops.'))
+
+    headers = auth_headers()
+    response = client.post('/ai/add-pdf', headers=headers, data={
+        'assistant_name': 'Field Manuals',
+        'file': (io.BytesIO(make_pdf('The condenser fan runs at full speed on startup.')), 'fan.pdf', 'application/pdf'),
+    })
+    assert response.status_code == 202
+    job_id = response.get_json()['job']['id']
+    deadline = time.monotonic() + 10
+    while (job := client.get(f'/ai/jobs/{job_id}', headers=headers).get_json()['job'])['status'] not in ('done', 'failed'):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert job['status'] == 'done'
+    assert job['files']['uploaded'] == 2
+    assert sorted(os.listdir(legacy_folder)) == ['compressor.pdf', 'fan.pdf']
+
+    response = client.post('/ai/search', json={'assistant_name': 'Field Manuals', 'query': 'inverter oil pressure'}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['file'] == 'compressor.pdf'
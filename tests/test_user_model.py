@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from data.user_model import User, user_cache
+
+
+def integrity_error(message: str) -> IntegrityError:
+    return IntegrityError('INSERT INTO users ...', {}, Exception(message))
+
+
+@pytest.mark.parametrize('message, field', [
+    # MySQL 8 prefixes the key with the table, 5.7 does not
+    ("(1062, \"Duplicate entry 'alice' for key 'users.username'\")", 'username'),
+    ("(1062, \"Duplicate entry 'a@x.io' for key 'email'\")", 'email'),
+    ('UNIQUE constraint failed: users.username', 'username'),
+    ('UNIQUE constraint failed: users.email', 'email'),
+    ('duplicate key value violates unique constraint "users_email_key"\nDETAIL:  Key (email)=(a@x.io) already exists.', 'email'),
+    ('duplicate key value violates unique constraint "users_username_key"\nDETAIL:  Key (username)=(alice) already exists.', 'username'),
+])
+def test_duplicated_field_from_the_database_error(message, field, monkeypatch):
+    monkeypatch.setattr(User, 'get_user_by_username', classmethod(lambda cls, username: pytest.fail('no query expected')))
+    assert User.get_duplicated_field(integrity_error(message), 'alice') == field
+
+
+@pytest.mark.parametrize('existing, field', [(object(), 'username'), (None, 'email')])
+def test_duplicated_field_falls_back_to_a_username_query(existing, field, monkeypatch):
+    monkeypatch.setattr(User, 'get_user_by_username', classmethod(lambda cls, username: existing))
+    # An unknown constraint name is not trusted
+    message = "(1062, \"Duplicate entry 'x' for key 'users.ix_users_other'\")"
+    assert User.get_duplicated_field(integrity_error(message), 'alice') == field
+    assert User.get_duplicated_field(integrity_error('database is locked'), 'alice') == field
+
+
+def test_register_reports_the_duplicated_field(client):
+    register = lambda username, email: client.post('/user/register', json={'username': username, 'email': email, 'password': 'Passw0rdOk', 'sudoPassword': 'sudo'})
+    assert register('dave', 'dave@example.com').status_code == 200
+    taken_username = register('dave', 'other@example.com')
+    taken_email = register('david', 'dave@example.com')
+    assert taken_username.status_code == taken_email.status_code == 400
+    assert taken_username.get_json()['error'] == 'username_already_taken'
+    assert taken_email.get_json()['error'] == 'email_already_taken'
+
+
+def test_cached_user_is_saved_and_dropped_by_the_views(api_app, client, auth_headers):
+    headers = auth_headers('carol')
+    with api_app.app_context():
+        User.get_cached_user_by_username('carol')
+        hits = user_cache.stats()['hits']
+        assert User.get_cached_user_by_username('carol').email == 'carol@example.com'
+        assert user_cache.stats()['hits'] == hits + 1
+
+    # The view saves the cached user: the new password is stored and the entry dropped
+    assert client.post('/user/update-password', json={'new_password': 'Passw0rdNew'}, headers=headers).status_code == 200
+    assert user_cache.get('carol') is None
+    assert client.post('/user/login', json={'username': 'carol', 'password': 'Passw0rdNew'}).status_code == 200
+
+    assert client.post('/user/delete', headers=headers).status_code == 200
+    # The deleted user is not served from the cache
+    assert client.post('/user/delete', headers=headers).status_code == 401
@@ -0,0 +1,348 @@
+"""Benchmark of the backend endpoints, offline: SQLite instead of MySQL and tools/fake_openai.py instead of OpenAI.
+
+    python tools/benchmark.py --concurrency 1 4 16 --requests 200 --latency 0.05 --run-duration 1 --output bench.json
+    python tools/benchmark.py --scenario ask --baseline bench.json
+
+The app is started with waitress (`--threads`) in a temporary folder, the fake OpenAI server next to
+it. /user/login, /ai/ask, /ai/add-pdf and /admin/get-all are driven at each concurrency level. The
+latency percentiles, the requests per second and the OpenAI calls per request of every scenario and
+level are printed and written to the `--output` JSON file. With `--baseline`, the results are compared
+to the ones of a previous run.
+
+Extra app settings are passed as FLASK_ environment variables, e.g. `--app-config ANSWER_CACHE_ENABLED=true`.
+The admission control and the email dispatcher are disabled unless enabled that way.
+"""
+import argparse
+import itertools
+import json
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_USERNAME = 'fatjonfreskina'  # Gets the admin role, see main.add_claims_to_access_token()
+PASSWORD = 'Benchmark-Passw0rd'
+SUDO_PASSWORD = secrets.token_hex(8)
+ASSISTANT_NAME = 'bench'
+SCENARIOS = ('login', 'ask', 'add-pdf', 'get-all')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args} exited with code {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Nothing listens on port {port} after {timeout} seconds')
+
+
+def make_pdf(text: str) -> bytes:
+    """A single page PDF showing the given text, enough for the upload checks and the text extraction.
+    """
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1', 'replace')
+    content = b'BT /F1 12 Tf 72 720 Td (' + escaped + b') Tj ET'
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b'%010d 00000 n \n' % offset
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def percentile(sorted_values: list, share: float) -> float:
+    """Nearest-rank percentile of already sorted values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(share * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Servers():
+    """The fake OpenAI server and the app, started in a temporary folder and stopped on exit.
+
+    Without `fake`, only the app is started, e.g. to answer the OpenAI calls from a recording.
+    """
+
+    def __init__(self, args, fake: bool = True):
+        self.args = args
+        self.fake = fake
+        self.folder = tempfile.mkdtemp(prefix='ai-pdf-bench-')
+        self.fake_port = free_port()
+        self.app_port = free_port()
+        self.processes = []
+
+    def __enter__(self):
+        log = open(os.path.join(self.folder, 'servers.log'), 'wb')
+        if self.fake:
+            fake = subprocess.Popen([
+                sys.executable, os.path.join(ROOT, 'tools', 'fake_openai.py'),
+                '--port', str(self.fake_port),
+                '--latency', str(self.args.latency),
+                '--jitter', str(self.args.jitter),
+                '--run-duration', str(self.args.run_duration),
+                '--assistant', ASSISTANT_NAME,
+            ], stdout=log, stderr=subprocess.STDOUT)
+            self.processes.append(fake)
+            wait_for_port(self.fake_port, fake)
+
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.path.join(ROOT, 'src'),
+            ENVIRONMENT='benchmark',
+            SUDO_PASSWORD=SUDO_PASSWORD,
+            SQLALCHEMY_DATABASE_URI_DEV=f"sqlite:///{os.path.join(self.folder, 'bench.db')}",
+            FLASK_SECRET_KEY=secrets.token_hex(16),
+            FLASK_JWT_SECRET_KEY=secrets.token_hex(16),
+            FLASK_OPENAI_API_KEY='sk-benchmark',
+            FLASK_OPENAI_BASE_URL=f'http://127.0.0.1:{self.fake_port}/v1',
+            FLASK_WAITRESS_THREADS=str(self.args.threads),
+            FLASK_ADMISSION_ENABLED='false',
+            FLASK_EMAIL_DISPATCHER_ENABLED='false',
+        )
+        for setting in self.args.app_config:
+            key, _, value = setting.partition('=')
+            env[f'FLASK_{key}'] = value
+        app = subprocess.Popen([
+            sys.executable, '-m', 'waitress',
+            '--host', '127.0.0.1', '--port', str(self.app_port),
+            '--threads', str(self.args.threads),
+            '--call', 'main:create_app',
+        ], cwd=self.folder, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(app)
+
+        wait_for_port(self.app_port, app)
+        return self
+
+    def __exit__(self, *exc_info):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.args.keep:
+            print(f'Databases, uploads and logs kept in {self.folder}')
+        else:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+    @property
+    def app_url(self) -> str:
+        return f'http://127.0.0.1:{self.app_port}'
+
+    def upstream_calls(self) -> dict:
+        return requests.get(f'http://127.0.0.1:{self.fake_port}/_stats', timeout=5).json()
+
+    def reset_upstream_calls(self) -> None:
+        requests.post(f'http://127.0.0.1:{self.fake_port}/_reset', timeout=5)
+
+    def wait_for_quiet_upstream(self, quiet: float = 1.0, timeout: float = 120) -> None:
+        """Wait until the background jobs (PDF ingestion) stopped calling the fake server.
+        """
+        deadline = time.monotonic() + timeout
+        total = self.upstream_calls()['total']
+        while time.monotonic() < deadline:
+            time.sleep(quiet)
+            current = self.upstream_calls()['total']
+            if current == total:
+                return
+            total = current
+
+
+def seed(servers: Servers, users: int) -> dict:
+    """Register the admin and the benchmark users, return their access tokens.
+    """
+    url = servers.app_url
+    usernames = [ADMIN_USERNAME] + [f'bench-user-{index}' for index in range(users)]
+    for username in usernames:
+        response = requests.post(f'{url}/user/register', json={
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': PASSWORD,
+            'sudoPassword': SUDO_PASSWORD,
+        }, timeout=30)
+        response.raise_for_status()
+    tokens = {}
+    for username in usernames[:2]:
+        response = requests.post(f'{url}/user/login', json={'username': username, 'password': PASSWORD}, timeout=30)
+        response.raise_for_status()
+        tokens[username] = response.json()['tokens']['access_token']
+    return {'admin': tokens[ADMIN_USERNAME], 'user': tokens[usernames[1]], 'username': usernames[1]}
+
+
+def build_request(scenario: str, url: str, tokens: dict, sequence: int, args) -> dict:
+    """The arguments of requests.Session.request() for the sequence-th request of a scenario.
+    """
+    if scenario == 'login':
+        return {'method': 'POST', 'url': f'{url}/user/login', 'json': {'username': tokens['username'], 'password': PASSWORD}}
+    if scenario == 'ask':
+        question = 'What does the benchmark manual say?' if args.repeat_questions else f'What does section {sequence} of the manual say?'
+        return {
+            'method': 'POST', 'url': f'{url}/ai/ask',
+            'json': {'question': question, 'assistant_name': ASSISTANT_NAME},
+            'headers': {'Authorization': f"Bearer {tokens['user']}"},
+        }
+    if scenario == 'add-pdf':
+        filename = f'bench-{sequence}.pdf'
+        return {
+            'method': 'POST', 'url': f'{url}/ai/add-pdf',
+            'data': {'assistant_name': ASSISTANT_NAME},
+            'files': {'file': (filename, make_pdf(f'Benchmark document {sequence}, section {sequence} of the manual.'), 'application/pdf')},
+            'headers': {'Authorization': f"Bearer {tokens['user']}"},
+        }
+    if scenario == 'get-all':
+        return {
+            'method': 'GET', 'url': f'{url}/admin/get-all',
+            'params': {'page': 1, 'per_page': 20},
+            'headers': {'Authorization': f"Bearer {tokens['admin']}"},
+        }
+    raise ValueError(f'Unknown scenario {scenario}')
+
+
+def run_level(servers: Servers, tokens: dict, scenario: str, concurrency: int, args, sequence: itertools.count) -> dict:
+    """Send args.requests requests of a scenario from `concurrency` threads, each waiting for its response before the next.
+    """
+    servers.reset_upstream_calls()
+    sessions = threading.local()
+    remaining = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+
+    def worker():
+        session = getattr(sessions, 'session', None) or requests.Session()
+        sessions.session = session
+        while next(remaining) < args.requests:
+            request = build_request(scenario, servers.app_url, tokens, next(sequence), args)
+            started = time.perf_counter()
+            try:
+                status = str(session.request(timeout=args.timeout, **request).status_code)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall_time = time.perf_counter() - started
+
+    if scenario == 'add-pdf':
+        servers.wait_for_quiet_upstream()
+    upstream = servers.upstream_calls()
+    latencies.sort()
+    completed = len(latencies)
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': completed,
+        'errors': errors,
+        'status_codes': statuses,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(sum(latencies) / completed, 2) if completed else 0.0,
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+        'requests_per_second': round(completed / wall_time, 2) if wall_time else 0.0,
+        'upstream_calls_per_request': round(upstream['total'] / completed, 2) if completed else 0.0,
+        'upstream_calls': upstream['calls'],
+    }
+
+
+def compare(results: list, baseline_path: str) -> None:
+    with open(baseline_path) as stream:
+        baseline = {(result['scenario'], result['concurrency']): result for result in json.load(stream)['results']}
+    print(f'\nCompared to {baseline_path} (negative latency and positive throughput changes are improvements):')
+    for result in results:
+        previous = baseline.get((result['scenario'], result['concurrency']))
+        if previous is None:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second', 'upstream_calls_per_request'):
+            if previous[key]:
+                changes.append(f'{key} {100 * (result[key] - previous[key]) / previous[key]:+.1f}%')
+        print(f"  {result['scenario']:<8} c={result['concurrency']:<4} " + '  '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario and concurrency level')
+    parser.add_argument('--threads', type=int, default=8, help='waitress threads of the app')
+    parser.add_argument('--users', type=int, default=50, help='users registered before the benchmark, listed by get-all')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every OpenAI call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds added to the latency')
+    parser.add_argument('--run-duration', type=float, default=1.0, help='seconds before an assistant run completes')
+    parser.add_argument('--repeat-questions', action='store_true', help='ask the same question every time (cache and coalescing)')
+    parser.add_argument('--timeout', type=float, default=120, help='client timeout of a request')
+    parser.add_argument('--app-config', action='append', default=[], metavar='KEY=VALUE', help='app setting, sent as FLASK_KEY')
+    parser.add_argument('--output', default=f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary folder (database, uploads, logs)')
+    args = parser.parse_args()
+
+    results = []
+    with Servers(args) as servers:
+        tokens = seed(servers, args.users)
+        sequence = itertools.count()
+        for scenario in args.scenario:
+            for concurrency in args.concurrency:
+                result = run_level(servers, tokens, scenario, concurrency, args, sequence)
+                results.append(result)
+                print(
+                    f"{scenario:<8} c={concurrency:<4} {result['requests']:>5} req  {result['errors']:>4} err  "
+                    f"p50 {result['p50_ms']:>9.1f} ms  p95 {result['p95_ms']:>9.1f} ms  p99 {result['p99_ms']:>9.1f} ms  "
+                    f"{result['requests_per_second']:>8.1f} req/s  {result['upstream_calls_per_request']:>5.1f} upstream/req"
+                )
+
+    with open(args.output, 'w') as stream:
+        json.dump({
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            'results': results,
+        }, stream, indent=2)
+    print(f'Results written to {args.output}')
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
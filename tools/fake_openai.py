@@ -0,0 +1,380 @@
+"""Local stand-in for the OpenAI API endpoints used by the backend, for benchmarks and offline runs.
+
+    python tools/fake_openai.py --port 9200 --latency 0.05 --run-duration 2
+
+Point the backend to it with FLASK_OPENAI_BASE_URL=http://localhost:9200/v1. It emulates the
+assistants, threads, messages, runs, files, vector stores and file batches endpoints in memory.
+Every call waits `--latency` seconds (plus up to `--jitter`), runs complete `--run-duration` seconds
+after they were created and answer with a citation of a file of the assistant's vector store.
+
+GET /_stats returns the number of calls per operation, POST /_reset clears them. The run duration is
+read from `app.config['RUN_DURATION']`, so tests can change it on a running stand-in.
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Flask, jsonify, request
+
+
+def new_id(prefix: str) -> str:
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+
+def listing(items: list):
+    """A page of a list endpoint, the client asks for the next page `after` the last id until one is empty.
+    """
+    after = request.args.get('after')
+    if after:
+        ids = [item['id'] for item in items]
+        items = items[ids.index(after) + 1:] if after in ids else []
+    limit = request.args.get('limit', default=20, type=int)
+    has_more = len(items) > limit
+    items = items[:limit]
+    return jsonify({
+        'object': 'list',
+        'data': items,
+        'first_id': items[0]['id'] if items else None,
+        'last_id': items[-1]['id'] if items else None,
+        'has_more': has_more,
+    })
+
+
+def not_found(kind: str):
+    return jsonify({'error': {'message': f'No {kind} found', 'type': 'invalid_request_error', 'code': None, 'param': None}}), 404
+
+
+def create_fake_app(latency: float = 0.0, jitter: float = 0.0, run_duration: float = 0.0, assistants: list = ()) -> Flask:
+    app = Flask(__name__)
+    app.config['RUN_DURATION'] = run_duration
+    lock = threading.Lock()
+    calls = Counter()
+    state = {
+        'assistants': {},
+        'threads': {},
+        'messages': {},
+        'runs': {},
+        'files': {},
+        'vector_stores': {},
+        'file_batches': {},
+    }
+
+    def add_assistant(name: str, instructions: str = None, model: str = 'gpt-4o', tool_resources: dict = None) -> dict:
+        assistant = {
+            'id': new_id('asst'),
+            'object': 'assistant',
+            'created_at': int(time.time()),
+            'name': name,
+            'description': None,
+            'model': model,
+            'instructions': instructions,
+            'tools': [{'type': 'file_search'}],
+            'tool_resources': tool_resources or {},
+            'metadata': {},
+            'temperature': 1.0,
+            'top_p': 1.0,
+            'response_format': 'auto',
+        }
+        state['assistants'][assistant['id']] = assistant
+        return assistant
+
+    def add_message(thread_id: str, role: str, text: str, annotations: list = (), assistant_id: str = None, run_id: str = None) -> dict:
+        message = {
+            'id': new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'status': 'completed',
+            'role': role,
+            'content': [{'type': 'text', 'text': {'value': text, 'annotations': list(annotations)}}],
+            'assistant_id': assistant_id,
+            'run_id': run_id,
+            'attachments': [],
+            'metadata': {},
+        }
+        state['messages'][thread_id].append(message)
+        return message
+
+    def complete_run(run: dict) -> None:
+        """Answer the last question of the thread, citing a file of the assistant's vector store.
+        """
+        question = next(
+            (message['content'][0]['text']['value'] for message in reversed(state['messages'][run['thread_id']]) if message['role'] == 'user'),
+            '',
+        )
+        text = f'This is the answer to: {question}'
+        annotations = []
+        assistant = state['assistants'].get(run['assistant_id'], {})
+        store_ids = (assistant.get('tool_resources') or {}).get('file_search', {}).get('vector_store_ids', [])
+        file_ids = [file_id for store_id in store_ids for file_id in state['vector_stores'].get(store_id, {}).get('file_ids', [])]
+        if file_ids:
+            marker = '【4:0†source】'
+            annotations.append({
+                'type': 'file_citation',
+                'text': marker,
+                'start_index': len(text),
+                'end_index': len(text) + len(marker),
+                'file_citation': {'file_id': file_ids[0]},
+            })
+            text += marker
+        add_message(run['thread_id'], 'assistant', text, annotations, run['assistant_id'], run['id'])
+        run['status'] = 'completed'
+        run['completed_at'] = int(time.time())
+
+    def refresh_run(run: dict) -> dict:
+        if run['status'] in ('queued', 'in_progress'):
+            if time.time() - run['_started'] >= app.config['RUN_DURATION']:
+                complete_run(run)
+            else:
+                run['status'] = 'in_progress'
+        elif run['status'] == 'cancelling':
+            run['status'] = 'cancelled'
+        return {key: value for key, value in run.items() if not key.startswith('_')}
+
+    for name in assistants:
+        add_assistant(name)
+
+    @app.before_request
+    def count_and_wait():
+        if request.path.startswith('/_'):
+            return
+        calls[f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'] += 1
+        delay = latency + random.uniform(0, jitter)
+        if delay:
+            time.sleep(delay)
+
+    # Assistants
+
+    @app.get('/v1/assistants')
+    def list_assistants():
+        with lock:
+            return listing(sorted(state['assistants'].values(), key=lambda assistant: assistant['created_at'], reverse=True))
+
+    @app.post('/v1/assistants')
+    def create_assistant():
+        data = request.get_json()
+        with lock:
+            return jsonify(add_assistant(data.get('name'), data.get('instructions'), data.get('model', 'gpt-4o'), data.get('tool_resources')))
+
+    @app.get('/v1/assistants/<assistant_id>')
+    def retrieve_assistant(assistant_id: str):
+        with lock:
+            assistant = state['assistants'].get(assistant_id)
+            return jsonify(assistant) if assistant else not_found('assistant')
+
+    @app.post('/v1/assistants/<assistant_id>')
+    def update_assistant(assistant_id: str):
+        with lock:
+            assistant = state['assistants'].get(assistant_id)
+            if assistant is None:
+                return not_found('assistant')
+            assistant.update(request.get_json())
+            return jsonify(assistant)
+
+    # Threads and messages
+
+    @app.post('/v1/threads')
+    def create_thread():
+        data = request.get_json(silent=True) or {}
+        with lock:
+            thread = {'id': new_id('thread'), 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}, 'tool_resources': {}}
+            state['threads'][thread['id']] = thread
+            state['messages'][thread['id']] = []
+            for message in data.get('messages', []):
+                add_message(thread['id'], message.get('role', 'user'), message.get('content', ''))
+            return jsonify(thread)
+
+    @app.delete('/v1/threads/<thread_id>')
+    def delete_thread(thread_id: str):
+        with lock:
+            state['threads'].pop(thread_id, None)
+            state['messages'].pop(thread_id, None)
+        return jsonify({'id': thread_id, 'object': 'thread.deleted', 'deleted': True})
+
+    @app.post('/v1/threads/<thread_id>/messages')
+    def create_message(thread_id: str):
+        data = request.get_json()
+        with lock:
+            if thread_id not in state['threads']:
+                return not_found('thread')
+            return jsonify(add_message(thread_id, data.get('role', 'user'), data.get('content', '')))
+
+    @app.get('/v1/threads/<thread_id>/messages')
+    def list_messages(thread_id: str):
+        with lock:
+            if thread_id not in state['threads']:
+                return not_found('thread')
+            messages = list(state['messages'][thread_id])
+        if request.args.get('order', 'desc') == 'desc':
+            messages.reverse()
+        return listing(messages)
+
+    # Runs
+
+    @app.post('/v1/threads/<thread_id>/runs')
+    def create_run(thread_id: str):
+        data = request.get_json()
+        with lock:
+            if thread_id not in state['threads']:
+                return not_found('thread')
+            run = {
+                'id': new_id('run'),
+                'object': 'thread.run',
+                'created_at': int(time.time()),
+                'thread_id': thread_id,
+                'assistant_id': data.get('assistant_id'),
+                'status': 'queued',
+                'model': 'gpt-4o',
+                'instructions': '',
+                'tools': [],
+                'last_error': None,
+                'metadata': {},
+                'parallel_tool_calls': True,
+                '_started': time.time(),
+            }
+            state['runs'][run['id']] = run
+            return jsonify(refresh_run(run) if app.config['RUN_DURATION'] <= 0 else {key: value for key, value in run.items() if not key.startswith('_')})
+
+    @app.get('/v1/threads/<thread_id>/runs/<run_id>')
+    def retrieve_run(thread_id: str, run_id: str):
+        with lock:
+            run = state['runs'].get(run_id)
+            return jsonify(refresh_run(run)) if run else not_found('run')
+
+    @app.post('/v1/threads/<thread_id>/runs/<run_id>/cancel')
+    def cancel_run(thread_id: str, run_id: str):
+        with lock:
+            run = state['runs'].get(run_id)
+            if run is None:
+                return not_found('run')
+            if run['status'] in ('queued', 'in_progress'):
+                run['status'] = 'cancelling'
+            return jsonify({key: value for key, value in run.items() if not key.startswith('_')})
+
+    # Files
+
+    @app.post('/v1/files')
+    def create_file():
+        upload = request.files['file']
+        content = upload.read()
+        with lock:
+            stored = {
+                'id': new_id('file'),
+                'object': 'file',
+                'bytes': len(content),
+                'created_at': int(time.time()),
+                'filename': upload.filename,
+                'purpose': request.form.get('purpose', 'assistants'),
+                'status': 'processed',
+            }
+            state['files'][stored['id']] = stored
+            return jsonify(stored)
+
+    @app.get('/v1/files/<file_id>')
+    def retrieve_file(file_id: str):
+        with lock:
+            stored = state['files'].get(file_id)
+            return jsonify(stored) if stored else not_found('file')
+
+    @app.delete('/v1/files/<file_id>')
+    def delete_file(file_id: str):
+        with lock:
+            state['files'].pop(file_id, None)
+        return jsonify({'id': file_id, 'object': 'file', 'deleted': True})
+
+    # Vector stores and file batches
+
+    @app.post('/v1/vector_stores')
+    def create_vector_store():
+        data = request.get_json(silent=True) or {}
+        with lock:
+            store = {
+                'id': new_id('vs'),
+                'object': 'vector_store',
+                'created_at': int(time.time()),
+                'name': data.get('name'),
+                'status': 'completed',
+                'usage_bytes': 0,
+                'file_counts': {'in_progress': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'total': 0},
+                'metadata': {},
+                'file_ids': [],
+            }
+            state['vector_stores'][store['id']] = store
+            return jsonify(store)
+
+    @app.delete('/v1/vector_stores/<store_id>')
+    def delete_vector_store(store_id: str):
+        with lock:
+            state['vector_stores'].pop(store_id, None)
+        return jsonify({'id': store_id, 'object': 'vector_store.deleted', 'deleted': True})
+
+    @app.delete('/v1/vector_stores/<store_id>/files/<file_id>')
+    def delete_vector_store_file(store_id: str, file_id: str):
+        with lock:
+            store = state['vector_stores'].get(store_id)
+            if store and file_id in store['file_ids']:
+                store['file_ids'].remove(file_id)
+        return jsonify({'id': file_id, 'object': 'vector_store.file.deleted', 'deleted': True})
+
+    @app.post('/v1/vector_stores/<store_id>/file_batches')
+    def create_file_batch(store_id: str):
+        file_ids = request.get_json().get('file_ids', [])
+        with lock:
+            store = state['vector_stores'].get(store_id)
+            if store is None:
+                return not_found('vector store')
+            store['file_ids'].extend(file_ids)
+            batch = {
+                'id': new_id('vsfb'),
+                'object': 'vector_store.files_batch',
+                'created_at': int(time.time()),
+                'vector_store_id': store_id,
+                'status': 'completed',
+                'file_counts': {'in_progress': 0, 'completed': len(file_ids), 'failed': 0, 'cancelled': 0, 'total': len(file_ids)},
+            }
+            state['file_batches'][batch['id']] = batch
+            return jsonify(batch)
+
+    @app.get('/v1/vector_stores/<store_id>/file_batches/<batch_id>')
+    def retrieve_file_batch(store_id: str, batch_id: str):
+        with lock:
+            batch = state['file_batches'].get(batch_id)
+            return jsonify(batch) if batch else not_found('file batch')
+
+    @app.get('/v1/vector_stores/<store_id>/file_batches/<batch_id>/files')
+    def list_file_batch_files(store_id: str, batch_id: str):
+        # Batches never fail here
+        return listing([])
+
+    # Benchmark helpers
+
+    @app.get('/_stats')
+    def stats():
+        with lock:
+            return jsonify({'calls': dict(calls), 'total': sum(calls.values())})
+
+    @app.post('/_reset')
+    def reset():
+        with lock:
+            calls.clear()
+        return jsonify({'message': 'Counters cleared'})
+
+    return app
+
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--threads', type=int, default=64, help='waitress threads, calls beyond are queued')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds waited by every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds added to the latency')
+    parser.add_argument('--run-duration', type=float, default=0.0, help='seconds before a run completes')
+    parser.add_argument('--assistant', action='append', default=[], help='name of an assistant to create at startup, repeatable')
+    args = parser.parse_args()
+    app = create_fake_app(args.latency, args.jitter, args.run_duration, args.assistant)
+    serve(app, host='127.0.0.1', port=args.port, threads=args.threads)
@@ -0,0 +1,145 @@
+"""Report of the OpenAI calls of a recording made with OPENAI_RECORD_PATH (see src/utils/openai_recorder.py).
+
+    python tools/openai_traffic_report.py recording.jsonl
+    python tools/openai_traffic_report.py replayed.jsonl --compare recording.jsonl
+
+For every /ai route, the requests, the upstream calls per request and the calls per operation are
+printed, then the calls which could have been avoided:
+
+- assistants.list listings started within --registry-ttl seconds of the previous one, the assistant
+  registry should have answered them;
+- files.retrieve of a file id already retrieved, or of a file uploaded in the same recording;
+- files.create of a content (SHA-256) already uploaded, i.e. full folder re-uploads.
+
+Calls made outside of a request are grouped under 'background:<pool>', e.g. the ingestion jobs.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from utils.openai_recorder import load_recording  # noqa: E402
+
+
+def _response_id(entry: dict):
+    try:
+        return json.loads(entry['response']).get('id')
+    except (ValueError, AttributeError):
+        return None
+
+
+def summarize(entries: list, registry_ttl: float = 300) -> dict:
+    inbound = [entry for entry in entries if entry['type'] == 'inbound']
+    upstream = sorted((entry for entry in entries if entry['type'] == 'upstream'), key=lambda entry: entry['started'])
+
+    routes = defaultdict(lambda: {'requests': 0, 'upstream_calls': 0, 'upstream_seconds': 0.0, 'operations': Counter()})
+    for entry in inbound:
+        routes[entry['route']]['requests'] += 1
+    for entry in upstream:
+        route = routes[entry['route']]
+        route['upstream_calls'] += 1
+        route['upstream_seconds'] += entry['duration']
+        route['operations'][entry['operation']] += 1
+    for route in routes.values():
+        route['calls_per_request'] = round(route['upstream_calls'] / route['requests'], 2) if route['requests'] else None
+        route['upstream_seconds'] = round(route['upstream_seconds'], 3)
+        route['operations'] = dict(route['operations'].most_common())
+
+    # Listings restarted while the registry should still hold the previous one (continuation pages excluded)
+    listings = [entry['started'] for entry in upstream if entry['operation'] == 'assistants.list' and 'after=' not in entry['query']]
+    repeated_listings = sum(1 for previous, current in zip(listings, listings[1:]) if current - previous < registry_ttl)
+
+    uploaded_ids = set()
+    uploaded_hashes = Counter()
+    reuploaded = Counter()
+    for entry in upstream:
+        if entry['operation'] == 'files.create' and entry['status'] < 400:
+            uploaded_ids.add(_response_id(entry))
+            upload = entry.get('upload') or {}
+            if upload.get('sha256') in uploaded_hashes:
+                reuploaded[upload['filename']] += 1
+            uploaded_hashes[upload.get('sha256')] += 1
+
+    retrieved = Counter(entry['path'].rsplit('/', 1)[-1] for entry in upstream if entry['operation'] == 'files.retrieve')
+    return {
+        'inbound_requests': len(inbound),
+        'upstream_calls': len(upstream),
+        'upstream_seconds': round(sum(entry['duration'] for entry in upstream), 3),
+        'operations': dict(Counter(entry['operation'] for entry in upstream).most_common()),
+        'routes': dict(routes),
+        'redundant': {
+            'assistants.list': repeated_listings,
+            'files.retrieve': {
+                'calls': sum(retrieved.values()),
+                'repeated': sum(retrieved.values()) - len(retrieved),
+                'of_uploaded_files': sum(count for file_id, count in retrieved.items() if file_id in uploaded_ids),
+                'most_retrieved': dict(retrieved.most_common(5)),
+            },
+            'files.create': {
+                'calls': sum(uploaded_hashes.values()),
+                'reuploads': sum(reuploaded.values()),
+                'most_reuploaded': dict(reuploaded.most_common(5)),
+            },
+        },
+    }
+
+
+def print_summary(summary: dict, title: str) -> None:
+    print(f"{title}: {summary['inbound_requests']} requests, {summary['upstream_calls']} upstream calls, "
+          f"{summary['upstream_seconds']:.1f} s upstream")
+    for name, route in sorted(summary['routes'].items()):
+        per_request = f"{route['calls_per_request']:>6.2f}/req" if route['calls_per_request'] is not None else '          '
+        operations = ', '.join(f'{operation} {count}' for operation, count in route['operations'].items())
+        print(f"  {name:<40} {route['requests']:>5} req {route['upstream_calls']:>6} calls {per_request}  {operations}")
+    redundant = summary['redundant']
+    retrieve, create = redundant['files.retrieve'], redundant['files.create']
+    print('  Avoidable calls:')
+    print(f"    assistants.list within the registry TTL  {redundant['assistants.list']}")
+    print(f"    files.retrieve repeated                  {retrieve['repeated']} of {retrieve['calls']}"
+          f" ({retrieve['of_uploaded_files']} of files uploaded in this recording)")
+    print(f"    files.create of an uploaded content      {create['reuploads']} of {create['calls']}")
+    for filename, count in create['most_reuploaded'].items():
+        print(f'      {filename} re-uploaded {count} times')
+
+
+def print_comparison(summary: dict, baseline: dict) -> None:
+    print('\nUpstream calls per request, compared to the baseline:')
+    for name in sorted(set(summary['routes']) | set(baseline['routes'])):
+        current = summary['routes'].get(name, {}).get('calls_per_request')
+        previous = baseline['routes'].get(name, {}).get('calls_per_request')
+        if current is None or previous is None:
+            continue
+        print(f'  {name:<40} {previous:>6.2f} -> {current:>6.2f}')
+    print(f"  {'total calls':<40} {baseline['upstream_calls']:>6} -> {summary['upstream_calls']:>6}")
+    for operation in sorted(set(summary['operations']) | set(baseline['operations'])):
+        previous, current = baseline['operations'].get(operation, 0), summary['operations'].get(operation, 0)
+        if previous != current:
+            print(f'    {operation:<40} {previous:>6} -> {current:>6}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording')
+    parser.add_argument('--compare', metavar='BASELINE', help='another recording, e.g. the one which was replayed')
+    parser.add_argument('--registry-ttl', type=float, default=300, help='ASSISTANT_REGISTRY_TTL of the recorded app')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    summary = summarize(load_recording(args.recording), args.registry_ttl)
+    baseline = summarize(load_recording(args.compare), args.registry_ttl) if args.compare else None
+    if args.json:
+        print(json.dumps({'summary': summary, 'baseline': baseline}, indent=2))
+        return
+    if baseline:
+        print_summary(baseline, args.compare)
+        print()
+    print_summary(summary, args.recording)
+    if baseline:
+        print_comparison(summary, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Replay a recording of the /ai traffic offline, the OpenAI calls answered from the recording itself.
+
+    FLASK_OPENAI_RECORD_PATH=recording.jsonl waitress-serve --call main:create_app   # record, against OpenAI
+    python tools/replay_session.py recording.jsonl --latency-scale 0.5 --output replayed.jsonl
+
+The app is started like in tools/benchmark.py, with OPENAI_REPLAY_PATH set to the recording and
+OPENAI_RECORD_PATH to `--output`. The recorded /ai requests are sent again in their order, by a
+single registered user, after which the report of tools/openai_traffic_report.py compares the
+upstream calls of the replay to the recorded ones. Uploaded PDFs are not recorded, a small PDF
+named after the original file is sent instead.
+
+With `--preserve-timing`, the requests are sent at their recorded offsets (scaled by
+`--latency-scale`) from `--concurrency` threads instead of one after the other.
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+
+from benchmark import PASSWORD, SUDO_PASSWORD, Servers, make_pdf
+from openai_traffic_report import load_recording, print_comparison, print_summary, summarize
+
+USERNAME = 'replay-user'
+
+
+def login(servers: Servers) -> str:
+    url = servers.app_url
+    response = requests.post(f'{url}/user/register', json={
+        'username': USERNAME,
+        'email': f'{USERNAME}@example.com',
+        'password': PASSWORD,
+        'sudoPassword': SUDO_PASSWORD,
+    }, timeout=30)
+    response.raise_for_status()
+    response = requests.post(f'{url}/user/login', json={'username': USERNAME, 'password': PASSWORD}, timeout=30)
+    response.raise_for_status()
+    return response.json()['tokens']['access_token']
+
+
+def build_request(entry: dict, url: str, token: str, locations: dict) -> dict:
+    """The arguments of requests.request() replaying an inbound entry of the recording.
+    """
+    # Async runs get new ids, GET /ai/runs/<id> follows the Location of the replayed submission
+    path = locations.get(entry['path'], entry['path'])
+    request = {
+        'method': entry['method'],
+        'url': f"{url}{path}" + (f"?{entry['query']}" if entry['query'] else ''),
+        'headers': {'Authorization': f'Bearer {token}'},
+    }
+    if entry.get('accept'):
+        request['headers']['Accept'] = entry['accept']
+    if entry.get('json') is not None:
+        request['json'] = entry['json']
+    if entry.get('form'):
+        request['data'] = entry['form']
+    if entry.get('files'):
+        request['files'] = {
+            file['field']: (file['filename'], make_pdf(f"Replay of {file['filename']}"), 'application/pdf')
+            for file in entry['files']
+        }
+    return request
+
+
+def wait_for_quiet(path: str, quiet: float = 2.0, timeout: float = 300) -> None:
+    """Wait until the background jobs (PDF ingestion) stopped adding calls to the replay recording.
+    """
+    deadline = time.monotonic() + timeout
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    while time.monotonic() < deadline:
+        time.sleep(quiet)
+        current = os.path.getsize(path) if os.path.exists(path) else 0
+        if current == size:
+            return
+        size = current
+
+
+def replay(servers: Servers, inbound: list, token: str, args) -> dict:
+    locations = {}
+    statuses = {}
+    lock = threading.Lock()
+    started = time.monotonic()
+    first = inbound[0]['started'] if inbound else 0.0
+
+    def send(entry):
+        if args.preserve_timing:
+            time.sleep(max(0.0, started + (entry['started'] - first) * args.latency_scale - time.monotonic()))
+        try:
+            response = requests.request(timeout=args.timeout, **build_request(entry, servers.app_url, token, locations))
+            status = str(response.status_code)
+            if entry.get('location') and response.headers.get('Location'):
+                with lock:
+                    locations[urlparse(entry['location']).path] = urlparse(response.headers['Location']).path
+        except requests.RequestException as e:
+            status = type(e).__name__
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+
+    if args.preserve_timing:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(send, inbound))
+    else:
+        for entry in inbound:
+            send(entry)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='factor of the recorded OpenAI latencies (0: none)')
+    parser.add_argument('--preserve-timing', action='store_true', help='send the requests at their recorded offsets')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads with --preserve-timing')
+    parser.add_argument('--threads', type=int, default=8, help='waitress threads of the app')
+    parser.add_argument('--timeout', type=float, default=120, help='client timeout of a request')
+    parser.add_argument('--registry-ttl', type=float, default=300, help='ASSISTANT_REGISTRY_TTL of the recorded app')
+    parser.add_argument('--app-config', action='append', default=[], metavar='KEY=VALUE', help='app setting, sent as FLASK_KEY')
+    parser.add_argument('--output', default=f"replay-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl")
+    parser.add_argument('--keep', action='store_true', help='keep the temporary folder (database, uploads, logs)')
+    args = parser.parse_args()
+
+    recording = os.path.abspath(args.recording)
+    output = os.path.abspath(args.output)
+    args.app_config = [
+        f'OPENAI_REPLAY_PATH={recording}',
+        f'OPENAI_REPLAY_LATENCY_SCALE={args.latency_scale}',
+        f'OPENAI_RECORD_PATH={output}',
+    ] + args.app_config
+
+    entries = load_recording(recording)
+    inbound = sorted((entry for entry in entries if entry['type'] == 'inbound'), key=lambda entry: entry['started'])
+    with Servers(args, fake=False) as servers:
+        token = login(servers)
+        statuses = replay(servers, inbound, token, args)
+        wait_for_quiet(output)
+    print(f'Replayed {len(inbound)} requests, status codes {statuses}, recorded to {args.output}\n')
+
+    baseline = summarize(entries, args.registry_ttl)
+    summary = summarize(load_recording(output), args.registry_ttl)
+    print_summary(baseline, args.recording)
+    print()
+    print_summary(summary, args.output)
+    print_comparison(summary, baseline)
+
+
+if __name__ == '__main__':
+    main()
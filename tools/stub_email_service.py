@@ -0,0 +1,44 @@
+"""Local stand-in for the email service, to exercise the email outbox without sending real emails.
+
+    python tools/stub_email_service.py --port 9100 --fail-rate 0.3 --delay 0.5
+
+Every POST is logged and answered with 200, or with 503 for a random `--fail-rate` share of them.
+GET /sent returns the emails received so far.
+"""
+import argparse
+import random
+import time
+
+from flask import Flask, jsonify, request
+
+
+def create_stub_app(fail_rate: float = 0.0, delay: float = 0.0) -> Flask:
+    app = Flask(__name__)
+    app.config['SENT'] = []
+
+    @app.post('/<path:endpoint>')
+    def receive(endpoint: str):
+        time.sleep(delay)
+        if random.random() < fail_rate:
+            app.logger.warning(f"Failing {endpoint} on purpose")
+            return jsonify({'message': 'Unavailable'}), 503
+        email = dict(request.get_json(), endpoint=endpoint)
+        email.pop('token', None)
+        app.config['SENT'].append(email)
+        app.logger.warning(f"Received {endpoint}: {email}")
+        return jsonify({'message': 'Email sent'}), 200
+
+    @app.get('/sent')
+    def sent():
+        return jsonify({'emails': app.config['SENT']}), 200
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of the requests answered with 503')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds waited before answering')
+    args = parser.parse_args()
+    create_stub_app(args.fail_rate, args.delay).run(port=args.port, threaded=True)